@@ -26,6 +26,7 @@
 """
 
 import csv
+import hashlib
 import json
 import os
 import pathlib
@@ -33,10 +34,11 @@ import pickle
 import re
 import sys
 import warnings
-from typing import Any, List, Union
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import numpy as np
-from osgeo import gdal
+from osgeo import gdal, gdal_array
 from qgis.core import Qgis, QgsCategorizedSymbolRenderer, QgsField, QgsFillSymbol, QgsLineSymbol, QgsMapLayer, \
     QgsMarkerSymbol, QgsPalettedRasterRenderer, QgsProject, QgsProviderRegistry, QgsRasterLayer, QgsRasterRenderer, \
     QgsReadWriteContext, QgsRendererCategory, QgsVectorLayer
@@ -44,13 +46,13 @@ from qgis.gui import QgsDialog, QgsEditorConfigWidget, QgsEditorWidgetFactory, Q
     QgsMapLayerComboBox
 from qgis.PyQt.QtCore import NULL, pyqtSignal, QAbstractListModel, QAbstractTableModel, QByteArray, QItemSelectionModel, \
     QMimeData, QModelIndex, QObject, QSize, Qt, QVariant
-from qgis.PyQt.QtGui import QBrush, QClipboard, QColor, QIcon, QPixmap
+from qgis.PyQt.QtGui import QBrush, QClipboard, QColor, QGuiApplication, QIcon, QPixmap
 from qgis.PyQt.QtWidgets import QAction, QApplication, QColorDialog, QComboBox, QDialog, QDialogButtonBox, QFileDialog, \
     QHBoxLayout, QInputDialog, QMenu, QMessageBox, QPushButton, QTableView, QToolButton, QVBoxLayout, QWidget
 from qgis.PyQt.QtXml import QDomDocument, QDomImplementation
 
 from ..qgisenums import QMETATYPE_DOUBLE, QMETATYPE_INT, QMETATYPE_QSTRING
-from ..utils import gdalDataset, loadUi, nextColor, registeredMapLayers
+from ..utils import gdalDataset, loadUi, nextColor, rasterBandUniqueValues, registeredMapLayers
 
 DEFAULT_UNCLASSIFIEDCOLOR = QColor('black')
 DEFAULT_FIRST_COLOR = QColor('#a6cee3')
@@ -124,6 +126,12 @@ def getTextColorWithContrast(c: QColor) -> QColor:
 class ClassInfo(QObject):
     sigSettingsChanged = pyqtSignal()
 
+    # color pixmaps and icons shared between all ClassInfos, keyed by (rgba, width, height, device pixel ratio).
+    # As the key contains the color, setColor() does not need to invalidate cached items.
+    PIXMAP_CACHE: OrderedDict = OrderedDict()
+    ICON_CACHE: OrderedDict = OrderedDict()
+    MAX_CACHED_PIXMAPS = 512
+
     def __init__(self, label=0, name=None, color=None, parent=None):
         super(ClassInfo, self).__init__(parent)
 
@@ -193,18 +201,46 @@ class ClassInfo(QObject):
         self.mName = name
         self.sigSettingsChanged.emit()
 
+    @staticmethod
+    def _cacheKey(color: QColor, *args) -> Optional[tuple]:
+        """
+        Returns the key of a color pixmap in the shared cache, or None if the pixmap arguments do not define a size
+        """
+        if len(args) == 0:
+            size = QSize(20, 20)
+        elif len(args) == 1 and isinstance(args[0], QSize):
+            size = args[0]
+        elif len(args) == 2 and all(isinstance(a, int) for a in args):
+            size = QSize(*args)
+        else:
+            return None
+        app = QApplication.instance()
+        dpr = app.devicePixelRatio() if isinstance(app, QGuiApplication) else 1.0
+        return color.rgba(), size.width(), size.height(), dpr
+
     def pixmap(self, *args) -> QPixmap:
         """
-        Returns a QPixmap. Default size is 20x20px
+        Returns a QPixmap. Default size is 20x20px.
+        Pixmaps are shared between all ClassInfos of same color and size.
         :param args: QPixmap arguments.
         :return: QPixmap
         """
-        if len(args) == 0:
-            args = (QSize(20, 20),)
-
-        pm = QPixmap(*args)
-        pm.fill(self.mColor)
-        return pm
+        key = ClassInfo._cacheKey(self.mColor, *args)
+        if key is None:
+            pm = QPixmap(*args)
+            pm.fill(self.mColor)
+            return pm
+
+        pm = ClassInfo.PIXMAP_CACHE.get(key)
+        if pm is None:
+            _, w, h, dpr = key
+            pm = QPixmap(QSize(int(round(w * dpr)), int(round(h * dpr))))
+            pm.setDevicePixelRatio(dpr)
+            pm.fill(self.mColor)
+            ClassInfo._cacheItem(ClassInfo.PIXMAP_CACHE, key, pm)
+        else:
+            ClassInfo.PIXMAP_CACHE.move_to_end(key)
+        return QPixmap(pm)
 
     def icon(self, *args) -> QIcon:
         """
@@ -212,7 +248,23 @@ class ClassInfo(QObject):
         :param args: QPixmap arguments
         :return: QIcon
         """
-        return QIcon(self.pixmap(*args))
+        key = ClassInfo._cacheKey(self.mColor, *args)
+        if key is None:
+            return QIcon(self.pixmap(*args))
+
+        icon = ClassInfo.ICON_CACHE.get(key)
+        if icon is None:
+            icon = QIcon(self.pixmap(*args))
+            ClassInfo._cacheItem(ClassInfo.ICON_CACHE, key, icon)
+        else:
+            ClassInfo.ICON_CACHE.move_to_end(key)
+        return QIcon(icon)
+
+    @staticmethod
+    def _cacheItem(cache: OrderedDict, key: tuple, item):
+        cache[key] = item
+        while len(cache) > ClassInfo.MAX_CACHED_PIXMAPS:
+            cache.popitem(last=False)
 
     def clone(self):
         """
@@ -263,6 +315,9 @@ class ClassificationScheme(QAbstractTableModel):
 
     sigIsEditableChanged = pyqtSignal(bool)
 
+    # maximum label value that is looked up by array index
+    LUT_MAX_LABEL = 2 ** 16
+
     def __init__(self, name: str = 'Classification', zero_based: bool = False):
         super(ClassificationScheme, self).__init__()
         self.mClasses: List[ClassInfo] = []
@@ -275,6 +330,14 @@ class ClassificationScheme(QAbstractTableModel):
         self.mColName = 'Name'
         self.mColLabel = 'Label'
 
+        # lookup tables, rebuilt on demand after classes have been changed
+        self.mLookupDirty: bool = True
+        self.mLabelIndex: Dict[Any, int] = dict()
+        self.mNameIndex: Dict[str, int] = dict()
+        self.mLabelLUT: Optional[np.ndarray] = None
+        self.mLabelColorLUT: Optional[np.ndarray] = None
+        self.mColorLUT: Optional[np.ndarray] = None
+
     def setIsEditable(self, b: bool):
         """
         Sets if class names and colors can be changed
@@ -406,15 +469,80 @@ class ClassificationScheme(QAbstractTableModel):
         :param label: the class label to match with
         :param name: the class name to match with
         """
-        if label:
-            for c in self.classInfos():
-                if c.label() == label:
-                    return c
+        self._updateLookup()
+        i = None
+        if label is not None:
+            i = self.mLabelIndex.get(label)
         elif name:
-            for c in self.classInfos():
-                if c.name() == name:
-                    return c
-        return None
+            i = self.mNameIndex.get(name)
+        return None if i is None else self.mClasses[i]
+
+    def _invalidateLookup(self):
+        self.mLookupDirty = True
+
+    def _updateLookup(self):
+        """
+        Rebuilds the label and name lookup tables, if classes have been changed since the last call
+        """
+        if not self.mLookupDirty:
+            return
+        self.mLabelIndex.clear()
+        self.mNameIndex.clear()
+        for i, c in enumerate(self.mClasses):
+            self.mLabelIndex.setdefault(c.label(), i)
+            self.mNameIndex.setdefault(c.name(), i)
+
+        # RGBA colors, the last row is used for values without class
+        colors = np.zeros((len(self.mClasses) + 1, 4), dtype=np.uint8)
+        if len(self.mClasses) > 0:
+            colors[0:-1, :] = self.classColorArray()
+        self.mColorLUT = colors
+
+        # label -> class index LUT for non-negative integer labels
+        self.mLabelLUT = self.mLabelColorLUT = None
+        labels = list(self.mLabelIndex.keys())
+        if all(isinstance(v, (int, np.integer)) and not isinstance(v, bool) and 0 <= v < self.LUT_MAX_LABEL
+               for v in labels):
+            lut = np.full(max(labels, default=-1) + 2, -1, dtype=np.int64)
+            for label, i in self.mLabelIndex.items():
+                lut[label] = i
+            self.mLabelLUT = lut
+            self.mLabelColorLUT = colors[lut]
+        self.mLookupDirty = False
+
+    def labelsToIndices(self, labels: np.ndarray) -> np.ndarray:
+        """
+        Returns the class indices of an array of class labels
+        :param labels: array-like of class labels
+        :return: np.ndarray of same shape with class indices, -1 for labels without class
+        """
+        self._updateLookup()
+        labels = np.asarray(labels)
+        if isinstance(self.mLabelLUT, np.ndarray) and np.issubdtype(labels.dtype, np.integer):
+            return self.mLabelLUT[self._lutPositions(labels)]
+
+        uniqueLabels, inverse = np.unique(labels, return_inverse=True)
+        indices = np.asarray([self.mLabelIndex.get(v, -1) for v in uniqueLabels.tolist()], dtype=np.int64)
+        return indices[inverse].reshape(labels.shape)
+
+    def labelsToColors(self, labels: np.ndarray) -> np.ndarray:
+        """
+        Returns the RGBA class colors of an array of class labels
+        :param labels: array-like of class labels
+        :return: np.ndarray of shape (*labels.shape, 4) and type uint8. Labels without class are transparent.
+        """
+        self._updateLookup()
+        labels = np.asarray(labels)
+        if isinstance(self.mLabelLUT, np.ndarray) and np.issubdtype(labels.dtype, np.integer):
+            return self.mLabelColorLUT.take(self._lutPositions(labels), axis=0)
+        return self.mColorLUT.take(self.labelsToIndices(labels), axis=0)
+
+    def _lutPositions(self, labels: np.ndarray) -> np.ndarray:
+        """
+        Returns positions in the label LUT. Out-of-range labels point to its last element, which is -1.
+        """
+        n = len(self.mLabelLUT) - 1
+        return np.where((labels >= 0) & (labels < n), labels, n)
 
     def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
         if not index.isValid():
@@ -722,6 +850,9 @@ class ClassificationScheme(QAbstractTableModel):
         removed = self.mClasses[:]
         del self.mClasses[:]
         self.endRemoveRows()
+        for c in removed:
+            self._disconnectClassInfo(c)
+        self._invalidateLookup()
         self.sigClassesRemoved.emit(removed)
 
     def clone(self):
@@ -815,6 +946,7 @@ class ClassificationScheme(QAbstractTableModel):
         Assigns class labels according to the ClassInfo position
         in case the ClassificationScheme is zero-based
         """
+        self._invalidateLookup()
         if not self.mZeroBased:
             return
 
@@ -846,6 +978,7 @@ class ClassificationScheme(QAbstractTableModel):
             c = self.mClasses[i]
             self.beginRemoveRows(QModelIndex(), i, i)
             self.mClasses.remove(c)
+            self._disconnectClassInfo(c)
             removedClasses.append(c)
             self.endRemoveRows()
         self._updateLabels()
@@ -913,19 +1046,24 @@ class ClassificationScheme(QAbstractTableModel):
         for i, c in enumerate(classes):
             assert isinstance(c, ClassInfo)
             index = index + i
-            # c.sigSettingsChanged.connect(self.onClassInfoSettingChanged)
+            c.sigSettingsChanged.connect(self._invalidateLookup)
             self.mClasses.insert(index, c)
         self.endInsertRows()
         self._updateLabels()
         self.sigClassesAdded.emit(classes)
 
+    def _disconnectClassInfo(self, c: ClassInfo):
+        try:
+            c.sigSettingsChanged.disconnect(self._invalidateLookup)
+        except TypeError:
+            pass
+
     def classIndexFromValue(self, value, matchSimilarity=False) -> int:
         """
         Get a values and returns the index of ClassInfo that matches best to.
         :param value: any
         :return: int
         """
-        classNames = self.classNames()
         i = -1
 
         # 1. match on identity
@@ -933,18 +1071,9 @@ class ClassificationScheme(QAbstractTableModel):
             i = int(value)
 
         elif isinstance(value, str):
-            if value in classNames:
-                i = classNames.index(value)
+            self._updateLookup()
+            i = self.mNameIndex.get(value, -1)
 
-        # 2. not found? match on similarity
-        if i == -1 and matchSimilarity is True:
-            if isinstance(value, (int, float)):
-                pass
-
-            elif isinstance(value, str):
-                if value in classNames:
-                    i = classNames.index(value)
-            pass
         return i
 
     def classFromValue(self, value, matchSimilarity=False) -> ClassInfo:
@@ -966,6 +1095,27 @@ class ClassificationScheme(QAbstractTableModel):
         assert isinstance(c, ClassInfo)
         self.insertClasses([c], index=index)
 
+    @staticmethod
+    def colorTableArray(ct: gdal.ColorTable) -> np.ndarray:
+        """
+        Returns the entries of a gdal.ColorTable as RGBA array
+        :param ct: gdal.ColorTable
+        :return: numpy.ndarray([nEntries, 4]) of type uint8
+        """
+        if not isinstance(ct, gdal.ColorTable):
+            return np.empty((0, 4), dtype=np.uint8)
+        return np.asarray([ct.GetColorEntry(i) for i in range(ct.GetCount())], dtype=np.uint8).reshape((-1, 4))
+
+    @staticmethod
+    def colorArrayHash(colors: np.ndarray) -> str:
+        """
+        Returns a hash of an RGBA color array, e.g. from classColorArray() or colorTableArray()
+        :param colors: numpy.ndarray([nColors, 4])
+        :return: str
+        """
+        colors = np.ascontiguousarray(colors, dtype=np.uint8).reshape((-1, 4))
+        return hashlib.sha1(colors.tobytes()).hexdigest()
+
     def saveToRasterBand(self, band: gdal.Band):
         """
         Saves the ClassificationScheme to the gdal.Band.
@@ -973,42 +1123,71 @@ class ClassificationScheme(QAbstractTableModel):
         :param band: gdal.Band
         """
         assert isinstance(band, gdal.Band)
+        self.saveToRasterBands([band])
 
-        ct = gdal.ColorTable()
-        cat = []
-
-        for i, classInfo in enumerate(self.mClasses):
-            c = classInfo.mColor
-            cat.append(classInfo.mName)
-            assert isinstance(c, QColor)
-            rgba = (c.red(), c.green(), c.blue(), c.alpha())
-            ct.SetColorEntry(i, rgba)
-        if len(cat) == 0:
-            ct = None
-
-        def equalColorTables(ct1: gdal.ColorTable, ct2: gdal.ColorTable) -> bool:
-            if ct1 is None and ct2 is None:
-                return True
-            elif isinstance(ct1, gdal.ColorTable) and isinstance(ct2, gdal.ColorTable):
-                if ct1.GetCount() != ct2.GetCount():
-                    return False
-                for c in range(ct1.GetCount()):
-                    if ct1.GetColorEntry(c) != ct2.GetColorEntry(c):
-                        return False
-                return True
-            else:
-                return False
+    def saveToRasterBands(self, bands: List[gdal.Band], colors: np.ndarray = None) -> int:
+        """
+        Saves the ClassificationScheme to multiple gdal.Bands.
+        Category names and color table are created once. Bands whose names and colors
+        are unchanged are not modified.
+        :param bands: list of gdal.Bands
+        :param colors: optional RGBA array of shape (nClasses, 4), defaults to classColorArray()
+        :return: number of bands that have been changed
+        """
+        cat = self.classNames()
+        ct, ctHash = self._rasterColorTable(colors)
+        return ClassificationScheme._saveToRasterBands(bands, cat, ct, ctHash)
 
-        try:
-            band.SetCategoryNames(cat)
-        except Exception as ex:
-            print(ex, file=sys.stderr)
+    def _rasterColorTable(self, colors: np.ndarray = None) -> Tuple[Optional[gdal.ColorTable], str]:
+        """
+        Returns the gdal.ColorTable to be saved to raster bands and the hash of its colors
+        :param colors: optional RGBA array of shape (nClasses, 4), defaults to classColorArray()
+        :return: (gdal.ColorTable or None, str)
+        """
+        if colors is None:
+            colors = self.classColorArray()
+        colors = np.asarray(colors, dtype=np.uint8).reshape((-1, 4))
+        assert colors.shape[0] == len(self), 'requires one color per class'
 
-        try:
-            if not equalColorTables(ct, band.GetColorTable()):
-                band.SetColorTable(ct)
-        except Exception as ex:
-            print(ex, file=sys.stderr)
+        ct = None
+        if len(self) > 0:
+            ct = gdal.ColorTable()
+            for i, rgba in enumerate(colors.tolist()):
+                ct.SetColorEntry(i, tuple(rgba))
+        return ct, ClassificationScheme.colorArrayHash(colors)
+
+    @staticmethod
+    def _saveToRasterBands(bands: List[gdal.Band],
+                           cat: List[str],
+                           ct: Optional[gdal.ColorTable],
+                           ctHash: str) -> int:
+        nChanged = 0
+        for band in bands:
+            assert isinstance(band, gdal.Band)
+            changed = False
+            try:
+                if band.GetCategoryNames() != cat:
+                    band.SetCategoryNames(cat)
+                    changed = True
+            except Exception as ex:
+                print(ex, file=sys.stderr)
+
+            try:
+                bandCt = band.GetColorTable()
+                if ct is None:
+                    if bandCt is not None:
+                        band.SetColorTable(ct)
+                        changed = True
+                # read and compare the color entries only if the number of entries is the same
+                elif bandCt is None or bandCt.GetCount() != len(cat) or \
+                        ClassificationScheme.colorArrayHash(ClassificationScheme.colorTableArray(bandCt)) != ctHash:
+                    band.SetColorTable(ct)
+                    changed = True
+            except Exception as ex:
+                print(ex, file=sys.stderr)
+            if changed:
+                nChanged += 1
+        return nChanged
 
     def saveToRaster(self, raster: Union[str, gdal.Dataset, QgsRasterLayer], bandIndex=0):
         """
@@ -1017,13 +1196,37 @@ class ClassificationScheme(QAbstractTableModel):
         :param bandIndex: band index of raster band to set this ClassificationScheme.
                           Defaults to 0 = the first band
         """
+        self.saveToRasters([raster], bandIndex=bandIndex)
+
+    def saveToRasters(self,
+                      rasters: List[Union[str, gdal.Dataset, QgsRasterLayer]],
+                      bandIndex: Union[int, List[int]] = 0,
+                      colors: np.ndarray = None) -> int:
+        """
+        Saves this ClassificationScheme to multiple raster images
+        :param rasters: list of raster image paths (str), gdal.Datasets or QgsRasterLayers
+        :param bandIndex: band index or list of band indices to set this ClassificationScheme.
+                          Defaults to 0 = the first band
+        :param colors: optional RGBA array of shape (nClasses, 4), defaults to classColorArray()
+        :return: number of bands that have been changed
+        """
         from ..utils import gdalDataset
-        ds = gdalDataset(raster)
-        assert isinstance(ds, gdal.Dataset)
-        assert ds.RasterCount > bandIndex
-        band = ds.GetRasterBand(bandIndex + 1)
-        self.saveToRasterBand(band)
-        ds.FlushCache()
+        bandIndices = [bandIndex] if isinstance(bandIndex, int) else list(bandIndex)
+        # create names and color table once for all rasters
+        cat = self.classNames()
+        ct, ctHash = self._rasterColorTable(colors)
+
+        nChanged = 0
+        for raster in rasters:
+            ds = gdalDataset(raster)
+            assert isinstance(ds, gdal.Dataset)
+            assert ds.RasterCount > max(bandIndices)
+            bands = [ds.GetRasterBand(b + 1) for b in bandIndices]
+            n = ClassificationScheme._saveToRasterBands(bands, cat, ct, ctHash)
+            if n > 0:
+                ds.FlushCache()
+            nChanged += n
+        return nChanged
 
     def toString(self, sep=';') -> str:
         """
@@ -1171,16 +1374,25 @@ class ClassificationScheme(QAbstractTableModel):
         return scheme
 
     @staticmethod
-    def fromRasterBand(band: gdal.Band):
+    def fromRasterBand(band: gdal.Band,
+                       scanValues: bool = False,
+                       maxClasses: int = MAX_UNIQUE_CLASSES,
+                       threads: int = 1):
         """
         Reads the ClassificationScheme of a gdal.Band
         :param band: gdal.Band
+        :param scanValues: set True to derive classes from the unique pixel values of integer bands
+                           without category names.
+        :param maxClasses: maximum number of classes to derive from pixel values
+        :param threads: number of threads to scan pixel values with
         :return: ClassificationScheme, None if classes are undefined.
         """
         assert isinstance(band, gdal.Band)
         ct = band.GetColorTable()
         cat = band.GetCategoryNames()
         if not isinstance(cat, list) or len(cat) == 0:
+            if scanValues:
+                return ClassificationScheme.fromRasterBandValues(band, maxClasses=maxClasses, threads=threads)
             return None
         scheme = ClassificationScheme()
         classes = []
@@ -1201,11 +1413,48 @@ class ClassificationScheme(QAbstractTableModel):
         return scheme
 
     @staticmethod
-    def fromRasterImage(path, bandIndex=None):
+    def fromRasterBandValues(band: gdal.Band, maxClasses: int = MAX_UNIQUE_CLASSES, threads: int = 1):
+        """
+        Derives a ClassificationScheme from the unique pixel values of an integer gdal.Band.
+        The band is scanned tile by tile, so that it does not need to fit into memory.
+        :param band: gdal.Band
+        :param maxClasses: maximum number of classes. The scan stops early if the band contains more unique values.
+        :param threads: number of threads to scan pixel values with
+        :return: ClassificationScheme, None if the band is not an integer band or contains too many unique values.
+        """
+        assert isinstance(band, gdal.Band)
+        if not np.issubdtype(gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType), np.integer):
+            return None
+
+        counts = rasterBandUniqueValues(band, maxValues=maxClasses, threads=threads)
+        if counts is None:
+            return None
+        values = sorted(v for v in counts.keys() if v > 0)
+        if len(values) == 0:
+            return None
+
+        ct = band.GetColorTable()
+        scheme = ClassificationScheme()
+        classes = [ClassInfo(0, 'Unclassified')]
+        color = DEFAULT_FIRST_COLOR
+        for v in values:
+            if isinstance(ct, gdal.ColorTable) and v < ct.GetCount():
+                c = QColor(*ct.GetColorEntry(v))
+            else:
+                c = QColor(color)
+                color = nextColor(color)
+            classes.append(ClassInfo(int(v), name=str(v), color=c))
+        scheme.insertClasses(classes)
+        return scheme
+
+    @staticmethod
+    def fromRasterImage(path, bandIndex=None, scanValues: bool = False, maxClasses: int = MAX_UNIQUE_CLASSES):
         """
         Reads a ClassificationScheme from a gdal.Dataset
         :param path: str with path to gdal.Dataset or gdal.Dataset instances
         :param bandIndex: int with band index
+        :param scanValues: set True to derive classes from the unique pixel values if no band has category names.
+        :param maxClasses: maximum number of classes to derive from pixel values
         :return: ClassificationScheme
         """
         ds = gdalDataset(path)
@@ -1222,11 +1471,14 @@ class ClassificationScheme(QAbstractTableModel):
                     break
                 s = ""
             if bandIndex is None:
-                return None
+                if scanValues and ds.RasterCount > 0:
+                    bandIndex = 0
+                else:
+                    return None
 
         assert bandIndex >= 0 and bandIndex < ds.RasterCount
         band = ds.GetRasterBand(bandIndex + 1)
-        return ClassificationScheme.fromRasterBand(band)
+        return ClassificationScheme.fromRasterBand(band, scanValues=scanValues, maxClasses=maxClasses)
 
     @staticmethod
     def fromCsv(pathCSV: str, mode: str = None):
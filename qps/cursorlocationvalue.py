@@ -91,12 +91,85 @@ class VectorValueSet(SourceValueSet):
     def __init__(self, source, point: SpatialPoint):
         super(VectorValueSet, self).__init__(source, point)
         self.features = []
+        # True if more features have been found than loaded
+        self.hasMoreFeatures: bool = False
 
     def addFeatureInfo(self, featureInfo):
         assert isinstance(featureInfo, VectorValueSet.FeatureInfo)
         self.features.append(featureInfo)
 
 
+class VectorFieldTreeNode(TreeNode):
+    """
+    A node that shows the values of a vector field for a list of features.
+    The feature nodes are created on demand, i.e. when the node gets expanded.
+    """
+    FETCH_SIZE = 25
+
+    def __init__(self, field: QgsField, features: List[QgsFeature], *args, **kwds):
+        super().__init__(*args, **kwds)
+        self.mField: QgsField = field
+        self.mFeatures: List[QgsFeature] = features
+        self.mFetched: int = 0
+        self.setName(field.name())
+
+    def hasChildren(self) -> bool:
+        return len(self.mFeatures) > 0
+
+    def canFetchMore(self) -> bool:
+        return self.mFetched < len(self.mFeatures)
+
+    def fetch(self):
+        name = self.mField.name()
+        typeName = self.mField.typeName()
+        i0 = self.mFetched
+        i1 = min(i0 + self.FETCH_SIZE, len(self.mFeatures))
+        newNodes = []
+        for feature in self.mFeatures[i0:i1]:
+            nf = TreeNode(name='{}'.format(feature.id()))
+            nf.setValues([feature.attribute(name), typeName])
+            nf.setToolTip('Value of feature "{}" in field with name "{}"'.format(feature.id(), name))
+            newNodes.append(nf)
+        self.mFetched = i1
+        self.appendChildNodes(newNodes)
+
+
+class VectorValueSetTreeNode(TreeNode):
+    """
+    A node that shows the field values of features in a VectorValueSet.
+    The field nodes are created on demand, i.e. when the node gets expanded.
+    """
+    FETCH_SIZE = 50
+
+    def __init__(self, valueSet: 'VectorValueSet', *args, **kwds):
+        super().__init__(*args, **kwds)
+        assert isinstance(valueSet, VectorValueSet)
+        self.mValueSet = valueSet
+        self.mFields: List[QgsField] = []
+        if len(valueSet.features) > 0:
+            self.mFields.extend(valueSet.features[0].fields())
+        self.mFetched: int = 0
+
+        n = len(valueSet.features)
+        if valueSet.hasMoreFeatures:
+            self.setToolTip(f'{valueSet.source}<br>First {n} features')
+        else:
+            self.setToolTip(f'{valueSet.source}<br>{n} features')
+
+    def hasChildren(self) -> bool:
+        return len(self.mFields) > 0
+
+    def canFetchMore(self) -> bool:
+        return self.mFetched < len(self.mFields)
+
+    def fetch(self):
+        i0 = self.mFetched
+        i1 = min(i0 + self.FETCH_SIZE, len(self.mFields))
+        newNodes = [VectorFieldTreeNode(field, self.mValueSet.features) for field in self.mFields[i0:i1]]
+        self.mFetched = i1
+        self.appendChildNodes(newNodes)
+
+
 class PixelPositionTreeNode(TreeNode):
 
     def __init__(self, px: QPoint, coord: SpatialPoint, *args,
@@ -216,7 +289,7 @@ class CursorLocationInfoModel(TreeModel):
             if len(sourceValueSet.features) == 0:
                 return
 
-            root = TreeNode(name=bn)
+            root = VectorValueSetTreeNode(sourceValueSet, name=bn)
             refFeature = sourceValueSet.features[0]
             assert isinstance(refFeature, QgsFeature)
             typeName = QgsWkbTypes.displayString(refFeature.geometry().wkbType()).lower()
@@ -227,22 +300,7 @@ class CursorLocationInfoModel(TreeModel):
             if 'point' in typeName:
                 root.setIcon(QIcon(r':/images/themes/default/mIconPointLayer.svg'))
 
-            subNodes = []
-            for field in refFeature.fields():
-                assert isinstance(field, QgsField)
-
-                fieldNode = TreeNode(name=field.name())
-
-                featureNodes = []
-                for i, feature in enumerate(sourceValueSet.features):
-                    assert isinstance(feature, QgsFeature)
-                    nf = TreeNode(name='{}'.format(feature.id()))
-                    nf.setValues([feature.attribute(field.name()), field.typeName()])
-                    nf.setToolTip('Value of feature "{}" in field with name "{}"'.format(feature.id(), field.name()))
-                    featureNodes.append(nf)
-                fieldNode.appendChildNodes(featureNodes)
-                subNodes.append(fieldNode)
-            root.appendChildNodes(subNodes)
+            # field and feature nodes are created on demand
             newSourceNodes.append(root)
 
         self.rootNode().appendChildNodes(newSourceNodes)
@@ -346,6 +404,7 @@ class CursorLocationInfoDock(QDockWidget):
         loadUi(path_ui, self)
 
         self.mMaxPoints = 1
+        self.mMaxFeatures = 256
         self.mLocationHistory = []
 
         self.mCrs: QgsCoordinateReferenceSystem = QgsCoordinateReferenceSystem('EPSG:4326')
@@ -404,6 +463,21 @@ class CursorLocationInfoDock(QDockWidget):
     def treeView(self) -> CursorLocationInfoTreeView:
         return self.mTreeView
 
+    def setMaxFeatures(self, n: int):
+        """
+        Sets the maximum number of features that are loaded per vector layer
+        :param n: int
+        """
+        assert isinstance(n, int) and n > 0
+        self.mMaxFeatures = n
+
+    def maxFeatures(self) -> int:
+        """
+        Returns the maximum number of features that are loaded per vector layer
+        :return: int
+        """
+        return self.mMaxFeatures
+
     def reloadCursorLocation(self):
         """
         Call to load / re-load the data for the cursor location
@@ -513,12 +587,17 @@ class CursorLocationInfoDock(QDockWidget):
                 searchRect.setYMaximum(pointLyr.y() + searchRadius)
 
                 flags = QgsFeatureRequest.ExactIntersect
+                # request one more feature to know if there are more than mMaxFeatures
                 features = lyr.getFeatures(QgsFeatureRequest()
                                            .setFilterRect(searchRect)
-                                           .setFlags(flags))
+                                           .setFlags(flags)
+                                           .setLimit(self.mMaxFeatures + 1))
                 feature = QgsFeature()
                 s = VectorValueSet(lyr.source(), pointLyr)
                 while features.nextFeature(feature):
+                    if len(s.features) == self.mMaxFeatures:
+                        s.hasMoreFeatures = True
+                        break
                     s.features.append(QgsFeature(feature))
 
                 self.mLocationInfoModel.addSourceValues(s)
@@ -32,8 +32,9 @@ from pathlib import Path
 from typing import Any, Dict, List, Match, Pattern, Tuple, Union
 
 from osgeo import gdal, ogr
-from qgis.core import edit, Qgis, QgsAttributeTableConfig, QgsDefaultValue, QgsEditorWidgetSetup, QgsFeature, \
-    QgsFeatureRequest, QgsField, QgsFieldConstraints, QgsMapLayer, QgsRasterDataProvider, QgsRasterLayer, QgsVectorLayer
+from qgis.core import Qgis, QgsAttributeTableConfig, QgsDefaultValue, QgsEditorWidgetSetup, QgsFeature, \
+    QgsFeatureRequest, QgsField, QgsFieldConstraints, QgsMapLayer, QgsRasterDataProvider, QgsRasterLayer, \
+    QgsVectorDataProvider, QgsVectorLayer
 from qgis.gui import QgsAttributeEditorContext, QgsAttributeTableModel, QgsDualView, QgsFieldCalculator, QgsGui, \
     QgsMapCanvas, QgsMapLayerConfigWidgetFactory, QgsMessageBar
 from qgis.PyQt.QtCore import NULL, QAbstractTableModel, QMimeData, QModelIndex, QRegExp, \
@@ -46,7 +47,8 @@ from .core import QpsMapLayerConfigWidget
 from .. import debugLog
 from ..classification.classificationscheme import ClassificationScheme, ClassificationSchemeWidget
 from ..qgisenums import QMETATYPE_DOUBLE, QMETATYPE_INT, QMETATYPE_QSTRING
-from ..qgsrasterlayerproperties import QgsRasterLayerSpectralProperties
+from ..qgsrasterlayerproperties import ENVIHeaderCache, parseENVIHeader, QgsRasterLayerSpectralProperties, \
+    SpectralMetadataCache
 from ..utils import gdalDataset, loadUi, ogrDataSource
 
 HAS_PYSTAC = importlib.util.find_spec('pystac') is not None
@@ -67,46 +69,47 @@ class MetadataUtils(object):
     """
     A class to parse metadata files
     """
-    rxSingle = re.compile(r'^(?P<key>[^=\n]+)= *(?P<value>[^{ ][^{}\n]*)', re.M)
-    rxArray = re.compile(r'^(?P<key>[^=\n]+)= *{(?P<values>[^{}]+)}', re.M)
-
     @staticmethod
     def parseEnviHeader(text: str) -> Dict[str, Union[str, List]]:
+        """
+        Parses ENVI header text and returns the values that describe band metadata
+        :param text: str, ENVI header text
+        :return: dict
+        """
+        return MetadataUtils.enviBandMetadata(parseENVIHeader(text, keys=MetadataUtils.enviBandKeys().keys()))
 
-        # remove comments
-        lines = text.splitlines(False)
-        lines = [line for line in lines if not re.search(r'\s*#.*', line)]
-        lines = '\n'.join(lines)
-
-        ENVI = dict()
-        r1 = MetadataUtils.rxSingle.findall(lines)
-        r2 = MetadataUtils.rxArray.findall(lines)
-        for r in r1 + r2:
-            value = re.sub(' *\n+ *', ' ', r[1].strip()).strip()
-            if len(value) > 0:
-                if r in r2:
-                    value = re.split(r' *, *', value)
-                ENVI[r[0].strip()] = value
-
-        md = dict()
-
-        if len(ENVI) > 0:
-
-            LUT = {'wavelength units': BandFieldNames.WavelengthUnit,
-                   'wavelength': BandFieldNames.Wavelength,
-                   'fwhm': BandFieldNames.FWHM,
-                   'bbl': BandFieldNames.BadBand,
-                   'band names': BandFieldNames.Name,
-                   'data gain values': BandFieldNames.Scale,
-                   'data offset values': BandFieldNames.Offset,
-                   'data ignore value': BandFieldNames.NoData
-                   }
+    @staticmethod
+    def readEnviHeader(path: Union[str, Path]) -> Dict[str, Union[str, List]]:
+        """
+        Reads an ENVI header file and returns the values that describe band metadata
+        :param path: path of the ENVI header file (*.hdr)
+        :return: dict
+        """
+        ENVI = ENVIHeaderCache.header(path, typeConversion=False, keys=MetadataUtils.enviBandKeys().keys())
+        return MetadataUtils.enviBandMetadata(ENVI if isinstance(ENVI, dict) else dict())
 
-            for enviKey, fieldName in LUT.items():
-                if enviKey in ENVI.keys():
-                    md[fieldName] = ENVI[enviKey]
+    @staticmethod
+    def enviBandKeys() -> Dict[str, str]:
+        """
+        Returns the ENVI header keys that describe band metadata and their BandFieldNames
+        """
+        return {'wavelength units': BandFieldNames.WavelengthUnit,
+                'wavelength': BandFieldNames.Wavelength,
+                'fwhm': BandFieldNames.FWHM,
+                'bbl': BandFieldNames.BadBand,
+                'band names': BandFieldNames.Name,
+                'data gain values': BandFieldNames.Scale,
+                'data offset values': BandFieldNames.Offset,
+                'data ignore value': BandFieldNames.NoData
+                }
 
-        return md
+    @staticmethod
+    def enviBandMetadata(ENVI: Dict[str, Union[str, List]]) -> Dict[str, Union[str, List]]:
+        """
+        Maps ENVI header keys to BandFieldNames
+        """
+        return {fieldName: ENVI[enviKey] for enviKey, fieldName in MetadataUtils.enviBandKeys().items()
+                if enviKey in ENVI}
 
     @staticmethod
     def parseSTAC(text: str) -> Dict:
@@ -267,6 +270,9 @@ class GDALBandMetadataModel(QgsVectorLayer):
 
         self.mDataLookup: List[Tuple[QgsField, Pattern]] = []
 
+        # band values as loaded from the layer, {band number: {field name: value}}
+        self.mLoadedState: Dict[int, Dict[str, Any]] = dict()
+
         self.hasEdits: bool = False
 
         def setEditsTrue():
@@ -455,8 +461,7 @@ class GDALBandMetadataModel(QgsVectorLayer):
                     path = Path(url.toLocalFile())
                     if path.exists() and path.stat().st_size < max_size:
                         if path.name.lower().endswith('.hdr'):
-                            with open(path) as f:
-                                ENVI = MetadataUtils.parseEnviHeader(f.read())
+                            ENVI = MetadataUtils.readEnviHeader(path)
                         elif path.name.lower().endswith('.json'):
                             with open(path) as f:
                                 STAC = MetadataUtils.parseSTAC(f.read())
@@ -568,112 +573,123 @@ class GDALBandMetadataModel(QgsVectorLayer):
         if was_editable:
             self.rollBack()
 
-        with edit(self):
-            self.deleteFeatures(self.allFeatureIds())
-
-            lyr = self.mMapLayer
-
-            if isGDALRasterLayer(lyr):
-                self.beginEditCommand('Sync to layer')
-                if spectralProperties is None:
-                    spectralProperties = QgsRasterLayerSpectralProperties.fromRasterLayer(lyr)
-
-                dp: QgsRasterDataProvider = lyr.dataProvider()
-
-                wl = spectralProperties.wavelengths()
-                wlu = spectralProperties.wavelengthUnits()
-                bbl = spectralProperties.badBands()
-                fwhm = spectralProperties.fullWidthHalfMaximum()
-                bandRanges = []
-                for a, b in zip(wl, fwhm):
-                    if not (a is None or b is None) and math.isfinite(a) and math.isfinite(b):
-                        v_min = a - 0.5 * b
-                        v_max = a + 0.5 * b
-                        bandRange = '{:0.3f} - {:0.3f}'.format(v_min, v_max)
-                    else:
-                        bandRange = None
-                    bandRanges.append(bandRange)
-
-                ds: gdal.Dataset = gdal.Open(lyr.source())
-                gdalBandNames = []
+        # band rows are written directly into the memory provider, i.e. without edit buffer and undo stack
+        dp: QgsVectorDataProvider = self.dataProvider()
+        dp.deleteFeatures(dp.allFeatureIds())
+        self.mLoadedState.clear()
 
-                gdalNoData = []
-                gdalScale = []
-                gdalOffset = []
+        lyr = self.mMapLayer
 
-                lyrScale = []
-                lyrOffset = []
-                lyrNoData = []
+        if isGDALRasterLayer(lyr):
+            if spectralProperties is None:
+                spectralProperties = QgsRasterLayerSpectralProperties.fromRasterLayer(lyr)
 
-                # ENVIDataOffset = spectralProperties.bandValues(None, 'data_gain')
-                # ENVIDataGain = spectralProperties.bandValues(None, 'data_offset')
+            columns = self.bandColumns(lyr, spectralProperties)
+            fieldNames = self.fields().names()
+            columns = [[self.toFieldValue(v) for v in columns[n]] for n in fieldNames]
 
-                # hide ENVI specific columns if they do not provide meaningfull information
-                # show_envi = any(ENVIDataOffset) or any(ENVIDataGain)
+            features = []
+            for row in zip(*columns):
+                f = QgsFeature(self.fields())
+                f.setAttributes(list(row))
+                features.append(f)
 
-                tableConfig = self.attributeTableConfig()
-                columnConfigs = tableConfig.columns()
+            success, features = dp.addFeatures(features)
+            assert success, dp.lastError()
 
-                for c in columnConfigs:
-                    c: QgsAttributeTableConfig.ColumnConfig
-                    # if c.name in [BandFieldNames.ENVIDataOffset, BandFieldNames.ENVIDataGain]:
-                    #    c.hidden = not show_envi
-                tableConfig.setColumns(columnConfigs)
-                self.setAttributeTableConfig(tableConfig)
+            # remember the loaded values as stored in the provider, i.e. converted to the field types
+            for f in dp.getFeatures():
+                values = [None if v == NULL else v for v in f.attributes()]
+                self.mLoadedState[f.attribute(BandFieldNames.Number)] = dict(zip(fieldNames, values))
 
-                for b in range(ds.RasterCount):
-                    band: gdal.Band = ds.GetRasterBand(b + 1)
-                    gdalBandNames.append(band.GetDescription())
-                    gdalNoData.append(band.GetNoDataValue())
-                    gdalScale.append(band.GetScale())
-                    gdalOffset.append(band.GetOffset())
+        self.updateExtents()
+        self.dataChanged.emit()
+        self.hasEdits = False
+        if was_editable:
+            self.startEditing()
 
-                    lyrScale.append(dp.bandScale(b + 1))
-                    lyrOffset.append(dp.bandOffset(b + 1))
-                    lyrNoData.append(dp.sourceNoDataValue(b + 1))
+    def bandColumns(self, lyr: QgsRasterLayer,
+                    spectralProperties: QgsRasterLayerSpectralProperties) -> Dict[str, List[Any]]:
+        """
+        Returns the band values of each field, i.e. {field name: [value band 1, value band 2, ...]}
+        """
+        nb = lyr.bandCount()
+        bands = list(range(1, nb + 1))
+        dp: QgsRasterDataProvider = lyr.dataProvider()
+
+        wl = spectralProperties.wavelengths()
+        fwhm = spectralProperties.fullWidthHalfMaximum()
+        bandRanges = []
+        for a, b in zip(wl, fwhm):
+            if not (a is None or b is None) and math.isfinite(a) and math.isfinite(b):
+                v_min = a - 0.5 * b
+                v_max = a + 0.5 * b
+                bandRange = '{:0.3f} - {:0.3f}'.format(v_min, v_max)
+            else:
+                bandRange = None
+            bandRanges.append(bandRange)
+
+        gdalBandNames = []
+        gdalNoData = []
+        gdalScale = []
+        gdalOffset = []
+        ds: gdal.Dataset = gdal.Open(lyr.source())
+        for b in range(ds.RasterCount):
+            band: gdal.Band = ds.GetRasterBand(b + 1)
+            gdalBandNames.append(band.GetDescription())
+            gdalNoData.append(band.GetNoDataValue())
+            gdalScale.append(band.GetScale())
+            gdalOffset.append(band.GetOffset())
+        del ds
 
-                del ds
+        columns = {
+            BandFieldNames.Number: bands,
+            BandFieldNames.Wavelength: wl,
+            BandFieldNames.WavelengthUnit: spectralProperties.wavelengthUnits(),
+            BandFieldNames.BadBand: spectralProperties.badBands(),
+            BandFieldNames.Range: bandRanges,
+            BandFieldNames.FWHM: fwhm,
+            BandFieldNames.NoData: gdalNoData,
+            BandFieldNames.Name: gdalBandNames,
+            BandFieldNames.Offset: gdalOffset,
+            BandFieldNames.Scale: gdalScale,
+        }
+        for n in self.fields().names():
+            if n not in columns:
+                columns[n] = spectralProperties.bandValues(bands, n)
 
-                KEY2VALUE = {
-                    BandFieldNames.Number: lambda i: i + 1,
-                    BandFieldNames.Wavelength: lambda i: wl[i],
-                    BandFieldNames.WavelengthUnit: lambda i: wlu[i],
-                    BandFieldNames.BadBand: lambda i: bbl[i],
-                    BandFieldNames.Range: lambda i: bandRanges[i],
-                    BandFieldNames.FWHM: lambda i: fwhm[i],
-                    BandFieldNames.NoData: lambda i: gdalNoData[i],
-                    BandFieldNames.Name: lambda i: gdalBandNames[i],
-                    # BandFieldNames.Domain: lambda i: domain,
-                    BandFieldNames.Offset: lambda i: gdalOffset[i],
-                    BandFieldNames.Scale: lambda i: gdalScale[i],
-
-                    # BandFieldNames.ENVIDataOffset: lambda i: ENVIDataOffset[i],
-                    # BandFieldNames.ENVIDataGain: lambda i: ENVIDataGain[i],
-                }
+        for n, values in columns.items():
+            if len(values) < nb:
+                values = list(values) + [None] * (nb - len(values))
+            columns[n] = values[0:nb]
+        return columns
 
-                domain = ''
-
-                for i in range(lyr.bandCount()):
-                    b = i + 1
-                    f = QgsFeature(self.fields())
-                    for field in self.fields():
-                        field: QgsField
-                        n = field.name()
-                        value = None
-                        if n in KEY2VALUE.keys():
-                            value = self.toFieldValue(KEY2VALUE[n](i))
-                        else:
-                            itemKey = spectralProperties.bandItemKey(b, field.name())
-                            value = spectralProperties.value(itemKey)
-                            value = self.toFieldValue(value)
-
-                        f.setAttribute(n, value)
-                    assert self.addFeature(f)
-                self.endEditCommand()
-                self.hasEdits = False
-        self.hasEdits = False
-        if was_editable:
-            self.startEditing()
+    @staticmethod
+    def _equalValues(v1, v2) -> bool:
+        if v1 in [None, NULL]:
+            v1 = None
+        if v2 in [None, NULL]:
+            v2 = None
+        return v1 == v2
+
+    def changedBandValues(self) -> Dict[int, Dict[str, Any]]:
+        """
+        Returns the values that differ from those loaded from the layer, i.e. {band number: {field name: value}}
+        """
+        changes = dict()
+        fields = [f.name() for f in self.fields() if not f.isReadOnly()]
+        for f in self.orderedFeatures():
+            f: QgsFeature
+            bandNo = f.attribute(BandFieldNames.Number)
+            loaded = self.mLoadedState.get(bandNo, dict())
+            for n in fields:
+                value = f.attribute(n)
+                if value == NULL:
+                    value = None
+                if n in loaded and self._equalValues(loaded[n], value):
+                    continue
+                changes.setdefault(bandNo, dict())[n] = value
+        return changes
 
     def orderedFeatures(self) -> List[QgsFeature]:
         request = QgsFeatureRequest()
@@ -682,6 +698,11 @@ class GDALBandMetadataModel(QgsVectorLayer):
 
     def applyToGDALSource(self):
 
+        # write only band values that differ from the loaded ones
+        changes = self.changedBandValues()
+        if len(changes) == 0:
+            return
+
         cpl_state_pam: str = gdal.GetConfigOption('GDAL_PAM_ENABLED', 'YES')
         gdal.SetConfigOption('GDAL_PAM_ENABLED', 'YES')
 
@@ -694,10 +715,7 @@ class GDALBandMetadataModel(QgsVectorLayer):
         if is_envi:
             domain = 'ENVI'
 
-        for f in self.orderedFeatures():
-            f: QgsFeature
-            bandNo = f.attribute(BandFieldNames.Number)
-            # assert f.id() == bandNo
+        for bandNo, bandChanges in changes.items():
             band: gdal.Band = ds.GetRasterBand(bandNo)
             if not isinstance(band, gdal.Band):
                 continue
@@ -706,14 +724,7 @@ class GDALBandMetadataModel(QgsVectorLayer):
             # if domain in ['', NULL]:
             #    domain = None
 
-            for field in f.fields():
-                if field.isReadOnly():
-                    continue
-
-                n = field.name()
-                value = f.attribute(n)
-                if value == NULL:
-                    value = None
+            for n, value in bandChanges.items():
 
                 # handle metadata available with designated GDAL API access
                 if n == BandFieldNames.Name:
@@ -740,13 +751,16 @@ class GDALBandMetadataModel(QgsVectorLayer):
                 else:
                     # handle non-designated metadata values
                     v = value2str(value)
-                    md_key = self.FIELD2GDALKey.get(field.name(), None)
+                    md_key = self.FIELD2GDALKey.get(n, None)
                     if md_key:
                         band.SetMetadataItem(md_key, v, domain)
 
+            self.mLoadedState.setdefault(bandNo, dict()).update(bandChanges)
+
         self.driverSpecific(ds)
         ds.FlushCache()
         del ds
+        SpectralMetadataCache.invalidate(self.mMapLayer.source())
 
         gdal.SetConfigOption('GDAL_PAM_ENABLED', cpl_state_pam)
 
@@ -1009,6 +1023,7 @@ class GDALMetadataModel(QAbstractTableModel):
 
         ds.FlushCache()
         del ds
+        SpectralMetadataCache.invalidate(self.mMapLayer.source())
 
         gdal.SetConfigOption('GDAL_PAM_ENABLED', cpl_state_pam)
 
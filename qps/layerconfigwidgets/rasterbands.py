@@ -23,7 +23,7 @@
 ***************************************************************************
 """
 import pathlib
-from typing import Union, List
+from typing import Dict, List, Optional, Set, Tuple, Union
 
 import numpy as np
 from qgis.core import Qgis
@@ -33,6 +33,7 @@ from qgis.PyQt.QtGui import QIcon
 from qgis.PyQt.QtWidgets import QPushButton
 from qgis.PyQt.QtWidgets import QSlider, QWidget, QStackedWidget, QLabel
 from qgis.core import QgsRasterLayer, QgsMapLayer, \
+    QgsContrastEnhancement, \
     QgsRasterRenderer, \
     QgsSingleBandGrayRenderer, \
     QgsSingleBandColorDataRenderer, \
@@ -41,6 +42,7 @@ from qgis.core import QgsRasterLayer, QgsMapLayer, \
     QgsPalettedRasterRenderer
 from qgis.gui import QgsMapCanvas, QgsMapLayerConfigWidget, QgsMapLayerConfigWidgetFactory, QgsRasterBandComboBox
 from ..layerconfigwidgets.core import QpsMapLayerConfigWidget
+from ..layerproperties import loadRasterBandStatistics, RasterBandStatisticsCache, RasterBandStatisticsTask
 from ..simplewidgets import FlowLayout
 from ..utils import loadUi, parseWavelength, parseFWHM, LUT_WAVELENGTH, WAVELENGTH_DESCRIPTION, \
     SignalBlocker, printCaller, rendererXML
@@ -242,7 +244,16 @@ class RasterBandConfigWidget(QpsMapLayerConfigWidget):
         self.mLytMulti = lMulti
         self.mLytSingle = lSingle
 
+        # sample size of the statistics used to stretch newly selected bands
+        self.mSampleSize: int = 256
+        self.mStatisticsTask = None
+        # bands whose stretch waits for statistics, with the min / max values to be replaced
+        self.mPendingStretches: Dict[int, Tuple[float, float]] = dict()
+        # bands whose statistics are calculated in a background task
+        self.mLoadingBands: Set[int] = set()
+
         self.syncToLayer()
+        self.loadBandCombinationStatistics()
 
         self.setPanelTitle('Band Selection')
 
@@ -268,6 +279,121 @@ class RasterBandConfigWidget(QpsMapLayerConfigWidget):
         renderer = self.mLayer.renderer().clone()
         self.setRenderer(renderer)
 
+    def loadBandCombinationStatistics(self):
+        """
+        Calculates the statistics of the bands used by the band combination buttons in a background task,
+        so that switching between band combinations does not need to wait for them.
+        """
+        bands = set(self.mLayer.renderer().usesBands())
+        for bc in BAND_COMBINATIONS:
+            for key in bc.bandKeys():
+                b = self.wlBand(key)
+                if isinstance(b, int):
+                    bands.add(b)
+        bands = sorted(b for b in bands if 0 < b <= self.mLayer.bandCount())
+        self.mStatisticsTask = self.loadStatistics(bands)
+
+    def loadStatistics(self, bands: List[int]) -> Optional[RasterBandStatisticsTask]:
+        """
+        Calculates missing band statistics in a background task, unless they are calculated already
+        """
+        bands = [b for b in bands if b not in self.mLoadingBands]
+        if len(bands) == 0:
+            return None
+        task = loadRasterBandStatistics(self.mLayer, bands, sampleSize=self.mSampleSize)
+        if isinstance(task, RasterBandStatisticsTask):
+            taskBands = list(task.mBands)
+            self.mLoadingBands.update(taskBands)
+            task.sigStatisticsReady.connect(self.onStatisticsReady)
+            task.taskTerminated.connect(lambda *args, b=taskBands: self.mLoadingBands.difference_update(b))
+        return task
+
+    def cachedStretch(self, band: int) -> Optional[Tuple[float, float]]:
+        """
+        Returns the 2 % and 98 % cumulative cut of a band, if its statistics are cached already
+        """
+        stats = RasterBandStatisticsCache.cachedStatistics(self.mLayer, [band], sampleSize=self.mSampleSize)[band]
+        if stats is None:
+            return None
+        return RasterBandStatisticsCache.quantileCut(stats, 0.02, 0.98)
+
+    def isAutoStretched(self, ce: QgsContrastEnhancement, band: int) -> bool:
+        """
+        Returns True if the min / max values of a contrast enhancement are the stretch that has been derived
+        from the band statistics, i.e. not set explicitly by the user.
+        """
+        stats = RasterBandStatisticsCache.cachedStatistics(self.mLayer, [band], sampleSize=self.mSampleSize)[band]
+        if stats is None:
+            return False
+        values = (ce.minimumValue(), ce.maximumValue())
+        for stretch in [RasterBandStatisticsCache.quantileCut(stats, 0.02, 0.98), (stats['min'], stats['max'])]:
+            if np.allclose(values, stretch):
+                return True
+        return False
+
+    def stretchedContrastEnhancement(self,
+                                     ce: QgsContrastEnhancement,
+                                     oldBand: int,
+                                     newBand: int) -> Optional[QgsContrastEnhancement]:
+        """
+        Returns a copy of a contrast enhancement that stretches the values of a newly selected band
+        between its 2 % and 98 % cumulative cut. Returns None if the band did not change, if the
+        contrast enhancement does not stretch values or if its min / max values have been set explicitly.
+        If the statistics of the new band are not cached yet, they are calculated in a background task
+        and the stretch is applied to the layer renderer once they are ready.
+        """
+        if not isinstance(ce, QgsContrastEnhancement) or oldBand == newBand or newBand < 1:
+            return None
+        if ce.contrastEnhancementAlgorithm() == QgsContrastEnhancement.NoEnhancement:
+            return None
+        if not self.isAutoStretched(ce, oldBand):
+            # keep min / max values set by the user
+            return None
+        stretch = self.cachedStretch(newBand)
+        if stretch is None:
+            self.mPendingStretches[newBand] = (ce.minimumValue(), ce.maximumValue())
+            self.loadStatistics([newBand])
+            return None
+        ce = QgsContrastEnhancement(ce)
+        ce.setMinimumValue(stretch[0])
+        ce.setMaximumValue(stretch[1])
+        return ce
+
+    def onStatisticsReady(self, bands: List[int]):
+        """
+        Applies the pending stretches of bands whose statistics have been calculated in the background
+        to the layer renderer, as long as the min / max values have not been changed in between.
+        """
+        self.mLoadingBands.difference_update(bands)
+        renderer = self.mLayer.renderer()
+        channels = []
+        if isinstance(renderer, QgsSingleBandGrayRenderer):
+            channels.append((renderer.grayBand(), renderer.contrastEnhancement(), renderer.setContrastEnhancement))
+        elif isinstance(renderer, QgsMultiBandColorRenderer):
+            channels.extend([
+                (renderer.redBand(), renderer.redContrastEnhancement(), renderer.setRedContrastEnhancement),
+                (renderer.greenBand(), renderer.greenContrastEnhancement(), renderer.setGreenContrastEnhancement),
+                (renderer.blueBand(), renderer.blueContrastEnhancement(), renderer.setBlueContrastEnhancement)])
+
+        changed = False
+        for band, ce, setContrastEnhancement in channels:
+            pending = self.mPendingStretches.get(band)
+            if band not in bands or pending is None or not isinstance(ce, QgsContrastEnhancement):
+                continue
+            stretch = self.cachedStretch(band)
+            if stretch is not None and np.allclose((ce.minimumValue(), ce.maximumValue()), pending):
+                ce = QgsContrastEnhancement(ce)
+                ce.setMinimumValue(stretch[0])
+                ce.setMaximumValue(stretch[1])
+                setContrastEnhancement(ce)
+                changed = True
+        for band in bands:
+            self.mPendingStretches.pop(band, None)
+
+        if changed:
+            self.mLayer.triggerRepaint()
+            self.mLayer.emitStyleChanged()
+
     def renderer(self) -> QgsRasterRenderer:
         printCaller(prefix=id(self))
         oldRenderer = self.mLayer.renderer()
@@ -276,6 +402,10 @@ class RasterBandConfigWidget(QpsMapLayerConfigWidget):
         if isinstance(oldRenderer, QgsSingleBandGrayRenderer):
             newRenderer: QgsSingleBandGrayRenderer = oldRenderer.clone()
             newRenderer.setGrayBand(self.cbSingleBand.currentBand())
+            ce = self.stretchedContrastEnhancement(oldRenderer.contrastEnhancement(),
+                                                   oldRenderer.grayBand(), newRenderer.grayBand())
+            if ce:
+                newRenderer.setContrastEnhancement(ce)
 
         elif isinstance(oldRenderer, QgsSingleBandPseudoColorRenderer):
             newRenderer: QgsSingleBandGrayRenderer = oldRenderer.clone()
@@ -294,6 +424,19 @@ class RasterBandConfigWidget(QpsMapLayerConfigWidget):
             newRenderer.setGreenBand(self.cbMultiBandGreen.currentBand())
             newRenderer.setBlueBand(self.cbMultiBandBlue.currentBand())
 
+            ce = self.stretchedContrastEnhancement(oldRenderer.redContrastEnhancement(),
+                                                   oldRenderer.redBand(), newRenderer.redBand())
+            if ce:
+                newRenderer.setRedContrastEnhancement(ce)
+            ce = self.stretchedContrastEnhancement(oldRenderer.greenContrastEnhancement(),
+                                                   oldRenderer.greenBand(), newRenderer.greenBand())
+            if ce:
+                newRenderer.setGreenContrastEnhancement(ce)
+            ce = self.stretchedContrastEnhancement(oldRenderer.blueContrastEnhancement(),
+                                                   oldRenderer.blueBand(), newRenderer.blueBand())
+            if ce:
+                newRenderer.setBlueContrastEnhancement(ce)
+
         else:
             newRenderer = oldRenderer.clone()
 
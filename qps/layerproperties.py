@@ -16,11 +16,19 @@
 *                                                                         *
 ***************************************************************************
 """
+import json
+import math
+import os
 import pathlib
 import re
 import sys
+import threading
 import warnings
-from typing import Any, Dict, List, Optional, Union
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from osgeo import gdal
 
 from qgis.PyQt.QtWidgets import QAction, QApplication, QButtonGroup, QCheckBox, QComboBox, QDialog, QDialogButtonBox, \
     QGridLayout, QHBoxLayout, QLabel, QLineEdit, QMainWindow, QMenu, QMessageBox, QSizePolicy, QSpacerItem, \
@@ -30,9 +38,10 @@ from qgis.core import Qgis, QgsAction, QgsApplication, QgsCategorizedSymbolRende
     QgsExpressionContextGenerator, QgsExpressionContextScope, QgsExpressionContextUtils, QgsFeature, QgsFeatureRenderer, \
     QgsFeatureRequest, QgsField, QgsFieldModel, QgsFieldProxyModel, QgsFields, QgsHillshadeRenderer, QgsLayerTreeGroup, \
     QgsLayerTreeLayer, QgsMapLayer, QgsMapLayerStyle, QgsMultiBandColorRenderer, QgsPalettedRasterRenderer, QgsProject, \
-    QgsRasterBandStats, QgsRasterDataProvider, QgsRasterLayer, QgsRasterRenderer, QgsReadWriteContext, QgsRectangle, \
+    QgsRasterDataProvider, QgsRasterLayer, QgsRasterRenderer, QgsReadWriteContext, QgsRectangle, \
     QgsScopedProxyProgressTask, QgsSettings, QgsSingleBandColorDataRenderer, QgsSingleBandGrayRenderer, \
-    QgsSingleBandPseudoColorRenderer, QgsSingleSymbolRenderer, QgsVectorDataProvider, QgsVectorLayer, QgsWkbTypes
+    QgsSingleBandPseudoColorRenderer, QgsSingleSymbolRenderer, QgsTask, QgsVectorDataProvider, QgsVectorLayer, \
+    QgsWkbTypes
 from qgis.PyQt.QtCore import pyqtSignal, QMimeData, QModelIndex, QObject, QTimer, QVariant
 from qgis.PyQt.QtGui import QCloseEvent, QIcon
 from qgis.PyQt.QtXml import QDomDocument
@@ -70,7 +79,7 @@ from . import DIR_UI_FILES
 from .classification.classificationscheme import ClassificationScheme
 from .models import OptionListModel, Option
 from .speclib.core import can_store_spectral_profiles
-from .utils import loadUi, defaultBands, iconForFieldType, qgsFields, copyEditorWidgetSetup
+from .utils import loadUi, defaultBands, iconForFieldType, qgsFields, copyEditorWidgetSetup, rasterBlockArray
 from .vectorlayertools import VectorLayerTools
 
 RENDER_CLASSES = {}
@@ -567,6 +576,340 @@ def rendererFromXml(xml):
     return None
 
 
+class RasterBandStatisticsCache(object):
+    """
+    A process-wide cache of sampled raster band statistics that are used to calculate contrast stretches.
+    Entries are keyed by (source, band, sampleSize, extent) and remain valid as long as the modification
+    time and size of the source file do not change. Statistics of sources without such a file signature,
+    e.g. in-memory providers, are not cached. Statistics of the full extent can be persisted
+    in the GDAL PAM (*.aux.xml), see setUsePam.
+    """
+    MAX_ENTRIES: int = 4096
+
+    # max. number of pixels that are read with a single block request
+    BLOCK_PIXELS: int = 2 ** 22
+
+    # max. number of pixel values used to estimate the quantiles
+    MAX_VALUES: int = 2 ** 20
+
+    # quantiles in 0.5 % steps
+    QUANTILES = np.linspace(0, 1, 201)
+
+    PAM_DOMAIN = 'QPS'
+
+    _ENTRIES: OrderedDict = OrderedDict()
+    _LOCK = threading.Lock()
+    _USE_PAM: bool = False
+
+    @classmethod
+    def setUsePam(cls, b: bool):
+        """
+        Set True to read and write the statistics of full raster extents from / into the GDAL PAM (*.aux.xml)
+        """
+        cls._USE_PAM = b is True
+
+    @classmethod
+    def usePam(cls) -> bool:
+        return cls._USE_PAM
+
+    @classmethod
+    def clear(cls):
+        with cls._LOCK:
+            cls._ENTRIES.clear()
+
+    @staticmethod
+    def fileSignature(source: str) -> Optional[Tuple]:
+        """
+        Returns the modification time and size of a raster file, or None if the source is not a file.
+        GDAL virtual file systems, e.g. /vsimem/, are supported.
+        """
+        if not isinstance(source, str):
+            return None
+        if source.startswith('/vsi'):
+            st = gdal.VSIStatL(source)
+            if st is None:
+                return None
+            return st.mtime, st.size
+        try:
+            st = os.stat(source)
+            return st.st_mtime_ns, st.st_size
+        except (OSError, TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def source(raster: Union[QgsRasterLayer, QgsRasterDataProvider]) -> str:
+        if isinstance(raster, QgsRasterLayer):
+            raster = raster.dataProvider()
+        return raster.dataSourceUri()
+
+    @staticmethod
+    def key(source: str, band: int, sampleSize: int, extent: QgsRectangle = None) -> tuple:
+        if isinstance(extent, QgsRectangle) and not extent.isEmpty():
+            extent = (extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum())
+        else:
+            extent = None
+        return source, band, sampleSize, extent
+
+    @classmethod
+    def cachedStatistics(cls, raster: Union[QgsRasterLayer, QgsRasterDataProvider], bands: List[int],
+                         sampleSize: int = 256, extent: QgsRectangle = None) -> Dict[int, Optional[dict]]:
+        """
+        Returns the cached statistics of raster bands, without calculating missing ones.
+        :return: {band number: dict | None}
+        """
+        source = cls.source(raster)
+        signature = cls.fileSignature(source)
+        results = {band: None for band in bands}
+        if signature is None:
+            # sources without signature can not be invalidated
+            return results
+        with cls._LOCK:
+            for band in bands:
+                key = cls.key(source, band, sampleSize, extent)
+                entry = cls._ENTRIES.get(key)
+                if entry is not None and entry[0] == signature:
+                    cls._ENTRIES.move_to_end(key)
+                    results[band] = entry[1]
+                else:
+                    results[band] = None
+        return results
+
+    @classmethod
+    def insertStatistics(cls, source: str, statistics: Dict[int, Optional[dict]], sampleSize: int,
+                         extent: QgsRectangle = None, signature: Optional[Tuple] = None):
+        if signature is None:
+            return
+        with cls._LOCK:
+            for band, stats in statistics.items():
+                if stats is None:
+                    continue
+                key = cls.key(source, band, sampleSize, extent)
+                cls._ENTRIES[key] = (signature, stats)
+                cls._ENTRIES.move_to_end(key)
+            while len(cls._ENTRIES) > cls.MAX_ENTRIES:
+                cls._ENTRIES.popitem(last=False)
+
+    @classmethod
+    def statistics(cls, raster: Union[QgsRasterLayer, QgsRasterDataProvider], bands: List[int],
+                   sampleSize: int = 256, extent: QgsRectangle = None, feedback=None) -> Dict[int, Optional[dict]]:
+        """
+        Returns the statistics of raster bands. Missing statistics are calculated and added to the cache.
+        :param raster: QgsRasterLayer or QgsRasterDataProvider. Use a provider clone in background threads.
+        :param bands: list of band numbers
+        :param sampleSize: approximate number of pixels to sample. 0 = use all pixels
+        :param extent: QgsRectangle, defaults to the full raster extent
+        :param feedback: optional QgsFeedback or QgsTask to cancel the calculation
+        :return: {band number: {'min': float, 'max': float, 'count': int, 'quantiles': np.ndarray} | None}
+        """
+        results = cls.cachedStatistics(raster, bands, sampleSize=sampleSize, extent=extent)
+        missing = [b for b, stats in results.items() if stats is None]
+        if len(missing) == 0:
+            return results
+
+        provider = raster.dataProvider() if isinstance(raster, QgsRasterLayer) else raster
+        source = cls.source(provider)
+        signature = cls.fileSignature(source)
+        usePam = cls.usePam() and extent is None and signature is not None
+        computed = dict()
+        if usePam:
+            computed.update(cls.readFromPam(source, missing, sampleSize))
+        missing = [b for b in missing if computed.get(b) is None]
+        if len(missing) > 0:
+            newStats = cls.computeStatistics(provider, missing, sampleSize=sampleSize, extent=extent,
+                                             feedback=feedback)
+            computed.update(newStats)
+            if usePam:
+                cls.writeToPam(source, newStats, sampleSize)
+
+        cls.insertStatistics(source, computed, sampleSize, extent=extent, signature=signature)
+        results.update(computed)
+        return results
+
+    @classmethod
+    def cumulativeCut(cls, raster: Union[QgsRasterLayer, QgsRasterDataProvider], band: int,
+                      lower: float = 0.02, upper: float = 0.98,
+                      sampleSize: int = 256, extent: QgsRectangle = None) -> Tuple[float, float]:
+        """
+        Returns the values of the lower and upper cumulative cut of a raster band, like
+        QgsRasterDataProvider.cumulativeCut, but based on cached statistics.
+        """
+        stats = cls.statistics(raster, [band], sampleSize=sampleSize, extent=extent)[band]
+        if stats is None:
+            provider = raster.dataProvider() if isinstance(raster, QgsRasterLayer) else raster
+            return provider.cumulativeCut(band, lower, upper, sampleSize=sampleSize)
+        return cls.quantileCut(stats, lower, upper)
+
+    @classmethod
+    def quantileCut(cls, stats: dict, lower: float = 0.02, upper: float = 0.98) -> Tuple[float, float]:
+        """
+        Returns the values of the lower and upper cumulative cut from band statistics
+        :param stats: band statistics, as returned by statistics()
+        """
+        q = stats['quantiles']
+        return float(np.interp(lower, cls.QUANTILES, q)), float(np.interp(upper, cls.QUANTILES, q))
+
+    @classmethod
+    def computeStatistics(cls, dp: QgsRasterDataProvider, bands: List[int], sampleSize: int = 256,
+                          extent: QgsRectangle = None, feedback=None) -> Dict[int, Optional[dict]]:
+        """
+        Calculates the statistics of raster bands by reading pixel blocks from a raster data provider.
+        If sampleSize > 0, the pixels are read with a lower resolution, so that about sampleSize pixels are used.
+        """
+        fullExtent: QgsRectangle = dp.extent()
+        if not isinstance(extent, QgsRectangle) or extent.isEmpty():
+            extent = fullExtent
+        else:
+            extent = extent.intersect(fullExtent)
+
+        results = {b: None for b in bands}
+        if extent.isEmpty() or fullExtent.width() <= 0 or fullExtent.height() <= 0:
+            return results
+
+        nx = max(1, int(round(dp.xSize() * extent.width() / fullExtent.width())))
+        ny = max(1, int(round(dp.ySize() * extent.height() / fullExtent.height())))
+        if 0 < sampleSize < nx * ny:
+            f = math.sqrt(sampleSize / (nx * ny))
+            nx, ny = max(1, int(nx * f)), max(1, int(ny * f))
+
+        rowsPerBlock = max(1, cls.BLOCK_PIXELS // nx)
+        dy = extent.height() / ny
+        step = max(1, int(math.ceil(nx * ny / cls.MAX_VALUES)))
+
+        for band in bands:
+            values = []
+            vmin = vmax = None
+            count = 0
+            for y0 in range(0, ny, rowsPerBlock):
+                if feedback is not None and feedback.isCanceled():
+                    return results
+                nRows = min(rowsPerBlock, ny - y0)
+                blockExtent = QgsRectangle(extent.xMinimum(), extent.yMaximum() - (y0 + nRows) * dy,
+                                           extent.xMaximum(), extent.yMaximum() - y0 * dy)
+                block = dp.block(band, blockExtent, nx, nRows)
+                if not block.isValid():
+                    continue
+                array = rasterBlockArray(block).ravel()
+                valid = np.ones(array.shape, dtype=bool)
+                if np.issubdtype(array.dtype, np.floating):
+                    valid &= np.isfinite(array)
+                if block.hasNoDataValue():
+                    valid &= array != block.noDataValue()
+                for r in dp.userNoDataValues(band):
+                    valid &= ~((array >= r.min()) & (array <= r.max()))
+                array = array[valid]
+                if array.size == 0:
+                    continue
+                count += array.size
+                bmin, bmax = array.min(), array.max()
+                vmin = bmin if vmin is None else min(vmin, bmin)
+                vmax = bmax if vmax is None else max(vmax, bmax)
+                values.append(array[::step])
+
+            if count > 0:
+                values = np.concatenate(values)
+                results[band] = {'min': float(vmin),
+                                 'max': float(vmax),
+                                 'count': count,
+                                 'quantiles': np.quantile(values, cls.QUANTILES)}
+        return results
+
+    @classmethod
+    def pamKey(cls, sampleSize: int) -> str:
+        return f'STATISTICS_SAMPLE_{sampleSize}'
+
+    @classmethod
+    def readFromPam(cls, source: str, bands: List[int], sampleSize: int) -> Dict[int, Optional[dict]]:
+        results = {b: None for b in bands}
+        try:
+            ds: gdal.Dataset = gdal.Open(source)
+        except RuntimeError:
+            ds = None
+        if not isinstance(ds, gdal.Dataset):
+            return results
+        key = cls.pamKey(sampleSize)
+        for b in bands:
+            if 0 < b <= ds.RasterCount:
+                value = ds.GetRasterBand(b).GetMetadataItem(key, cls.PAM_DOMAIN)
+                if value:
+                    try:
+                        d = json.loads(value)
+                        q = np.asarray(d['quantiles'], dtype=float)
+                        if len(q) == len(cls.QUANTILES):
+                            results[b] = {'min': float(d['min']), 'max': float(d['max']),
+                                          'count': int(d['count']), 'quantiles': q}
+                    except (ValueError, KeyError, TypeError):
+                        pass
+        return results
+
+    @classmethod
+    def writeToPam(cls, source: str, statistics: Dict[int, Optional[dict]], sampleSize: int):
+        statistics = {b: s for b, s in statistics.items() if s is not None}
+        if len(statistics) == 0:
+            return
+        try:
+            ds: gdal.Dataset = gdal.Open(source)
+        except RuntimeError:
+            ds = None
+        if not isinstance(ds, gdal.Dataset):
+            return
+        key = cls.pamKey(sampleSize)
+        for b, s in statistics.items():
+            value = json.dumps({'min': s['min'], 'max': s['max'], 'count': s['count'],
+                                'quantiles': s['quantiles'].tolist()})
+            ds.GetRasterBand(b).SetMetadataItem(key, value, cls.PAM_DOMAIN)
+        ds.FlushCache()
+        del ds
+
+
+class RasterBandStatisticsTask(QgsTask):
+    """
+    A QgsTask that calculates raster band statistics in a background thread and adds them to the
+    RasterBandStatisticsCache.
+    """
+    sigStatisticsReady = pyqtSignal(list)
+
+    def __init__(self, layer: QgsRasterLayer, bands: List[int], sampleSize: int = 256,
+                 extent: QgsRectangle = None, description: str = 'Calculate raster statistics'):
+        super().__init__(description, QgsTask.CanCancel)
+        # providers are not thread-safe, so read from a clone
+        self.mProvider: QgsRasterDataProvider = layer.dataProvider().clone()
+        self.mBands = list(bands)
+        self.mSampleSize = sampleSize
+        self.mExtent = QgsRectangle(extent) if isinstance(extent, QgsRectangle) else None
+        self.mError: Optional[str] = None
+
+    def run(self):
+        try:
+            for i, b in enumerate(self.mBands):
+                if self.isCanceled():
+                    return False
+                RasterBandStatisticsCache.statistics(self.mProvider, [b], sampleSize=self.mSampleSize,
+                                                     extent=self.mExtent, feedback=self)
+                self.setProgress(100. * (i + 1) / len(self.mBands))
+        except Exception as ex:
+            self.mError = str(ex)
+            return False
+        self.sigStatisticsReady.emit(self.mBands)
+        return True
+
+
+def loadRasterBandStatistics(layer: QgsRasterLayer, bands: List[int], sampleSize: int = 256,
+                             extent: QgsRectangle = None) -> Optional[RasterBandStatisticsTask]:
+    """
+    Calculates missing raster band statistics in a background task.
+    :return: the started RasterBandStatisticsTask, or None if all statistics are cached already
+    """
+    if not (isinstance(layer, QgsRasterLayer) and layer.isValid()):
+        return None
+    cached = RasterBandStatisticsCache.cachedStatistics(layer, bands, sampleSize=sampleSize, extent=extent)
+    missing = [b for b, stats in cached.items() if stats is None]
+    if len(missing) == 0:
+        return None
+    task = RasterBandStatisticsTask(layer, missing, sampleSize=sampleSize, extent=extent)
+    QgsApplication.taskManager().addTask(task)
+    return task
+
+
 def defaultRasterRenderer(layer: QgsRasterLayer,
                           bandIndices: List[int] = None,
                           sampleSize: int = 256,
@@ -638,16 +981,9 @@ def defaultRasterRenderer(layer: QgsRasterLayer,
 
     assert isinstance(bandIndices, list)
 
-    # get band stats
     dp: QgsRasterDataProvider = layer.dataProvider()
     assert isinstance(dp, QgsRasterDataProvider)
 
-    stats = QGIS_RASTERBANDSTATISTIC.Min | QGIS_RASTERBANDSTATISTIC.Max
-
-    with warnings.catch_warnings():
-        warnings.simplefilter('ignore', category=DeprecationWarning)
-        bandStats = [dp.bandStatistics(b + 1, stats=stats, sampleSize=sampleSize) for b in bandIndices]
-
     # classification ? -> QgsPalettedRasterRenderer
     classes = ClassificationScheme.fromMapLayer(layer)
     if isinstance(classes, ClassificationScheme):
@@ -655,11 +991,22 @@ def defaultRasterRenderer(layer: QgsRasterLayer,
         r.setInput(layer.dataProvider())
         return r
 
+    # get band stats
+    bandStats = RasterBandStatisticsCache.statistics(layer, [b + 1 for b in bandIndices], sampleSize=sampleSize)
+
+    def cumulativeCut(band: int) -> Tuple[float, float]:
+        if bandStats.get(band) is not None:
+            return RasterBandStatisticsCache.quantileCut(bandStats[band], 0.02, 0.98)
+        return RasterBandStatisticsCache.cumulativeCut(layer, band, 0.02, 0.98, sampleSize=sampleSize)
+
     # single-band / two bands -> QgsSingleBandGrayRenderer
-    if len(bandStats) < 3:
+    if len(bandIndices) < 3:
         b = bandIndices[0] + 1
-        stats = bandStats[0]
-        assert isinstance(stats, QgsRasterBandStats)
+        stats = bandStats[b]
+        if stats is None:
+            stats = dp.bandStatistics(b, QGIS_RASTERBANDSTATISTIC.Min | QGIS_RASTERBANDSTATISTIC.Max,
+                                      sampleSize=sampleSize)
+            stats = {'min': stats.minimumValue, 'max': stats.maximumValue}
         dt = dp.dataType(b)
         ce = QgsContrastEnhancement(dt)
 
@@ -667,15 +1014,15 @@ def defaultRasterRenderer(layer: QgsRasterLayer,
         ce.setContrastEnhancementAlgorithm(QgsContrastEnhancement.StretchToMinimumMaximum, True)
 
         if dt == Qgis.Byte:
-            if stats.minimumValue == 0 and stats.maximumValue == 1:
+            if stats['min'] == 0 and stats['max'] == 1:
                 # handle mask, stretch over larger range
-                ce.setMinimumValue(stats.minimumValue)
-                ce.setMaximumValue(stats.maximumValue)
+                ce.setMinimumValue(stats['min'])
+                ce.setMaximumValue(stats['max'])
             else:
                 ce.setMinimumValue(0)
                 ce.setMaximumValue(255)
         else:
-            vmin, vmax = layer.dataProvider().cumulativeCut(b, 0.02, 0.98, sampleSize=sampleSize)
+            vmin, vmax = cumulativeCut(b)
             ce.setMinimumValue(vmin)
             ce.setMaximumValue(vmax)
 
@@ -684,7 +1031,7 @@ def defaultRasterRenderer(layer: QgsRasterLayer,
         return r
 
     # 3 or more bands -> RGB
-    if len(bandStats) >= 3:
+    if len(bandIndices) >= 3:
         bands = [b + 1 for b in bandIndices[0:3]]
         contrastEnhancements = [QgsContrastEnhancement(dp.dataType(b)) for b in bands]
         ceR, ceG, ceB = contrastEnhancements
@@ -695,7 +1042,7 @@ def defaultRasterRenderer(layer: QgsRasterLayer,
 
             assert isinstance(ce, QgsContrastEnhancement)
             ce.setContrastEnhancementAlgorithm(QgsContrastEnhancement.StretchToMinimumMaximum, True)
-            vmin, vmax = layer.dataProvider().cumulativeCut(b, 0.02, 0.98, sampleSize=sampleSize)
+            vmin, vmax = cumulativeCut(b)
             if dt == Qgis.Byte:
                 # standard RGB photo?
                 if False and layer.bandCount() == 3:
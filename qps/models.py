@@ -314,6 +314,8 @@ class TreeNode(QObject):
 
         self.mParentNode: TreeNode = None
         self.mChildren: List[TreeNode] = []
+        # row of this node in the parent's child list, maintained on insert / remove
+        self.mRow: int = -1
         self.mName: str = name
         self.mValues: list = []
         self.mIcon: QIcon = None
@@ -354,7 +356,7 @@ class TreeNode(QObject):
         return len(self.mChildren)
 
     def __contains__(self, item):
-        return item in self.mChildren
+        return isinstance(item, TreeNode) and item.mParentNode is self
 
     def __getitem__(self, slice):
         return self.mChildren[slice]
@@ -440,16 +442,21 @@ class TreeNode(QObject):
         return n
 
     def nodeIndex(self) -> int:
+        """
+        Returns the row of this node within its parent node, or None if the node has no parent.
+        The row is cached and updated on child insertion / removal, so this is O(1).
+        :return: int
+        """
         p = self.parentNode()
         if isinstance(p, TreeNode):
-            return p.mChildren.index(self)
+            return self.mRow
         else:
-            None
+            return None
 
     def next(self):
         p = self.parentNode()
         if isinstance(p, TreeNode):
-            i = p.mChildren.index(self)
+            i = self.mRow
             if i < len(p.mChildren) - 1:
                 return p.mChildren[i + 1]
         return None
@@ -457,11 +464,20 @@ class TreeNode(QObject):
     def previous(self):
         p = self.parentNode()
         if isinstance(p, TreeNode):
-            i = p.mChildren.index(self)
+            i = self.mRow
             if i > 0:
                 return p.mChildren[i - 1]
         return None
 
+    def _updateChildRows(self, first: int = 0):
+        """
+        Updates the cached rows of all child nodes, starting at row `first`
+        :param first: int
+        """
+        children = self.mChildren
+        for row in range(first, len(children)):
+            children[row].mRow = row
+
     def detach(self):
         """
         Detaches this TreeNode from its parent TreeNode
@@ -478,13 +494,21 @@ class TreeNode(QObject):
         self.insertChildNodes(len(self.mChildren), child_nodes)
 
     def insertChildNodes(self, index: int, child_nodes):
+        """
+        Inserts child nodes at position `index`. All nodes are inserted within
+        a single begin/endAddChildNodes block.
+        :param index: int
+        :param child_nodes: TreeNode or [list-of-TreeNodes]
+        """
         assert index <= len(self.mChildren)
         if isinstance(child_nodes, TreeNode):
             child_nodes = [child_nodes]
         assert isinstance(child_nodes, list)
         unique = []
+        seen = set()
         for n in child_nodes:
-            if n not in unique and n not in self.mChildren:
+            if id(n) not in seen and n.mParentNode is not self:
+                seen.add(id(n))
                 unique.append(n)
 
         child_nodes = unique
@@ -496,7 +520,7 @@ class TreeNode(QObject):
 
         self.beginAddChildNodes.emit(self, index, idxLast)
 
-        for i, node in enumerate(child_nodes):
+        for node in child_nodes:
             assert isinstance(node, TreeNode)
 
             # connect node signals
@@ -508,62 +532,74 @@ class TreeNode(QObject):
 
             node.sigUpdated.connect(self.sigUpdated)
             node.setParentNode(self)
-            self.mChildren.insert(index + i, node)
+
+        self.mChildren[index:index] = child_nodes
+        self._updateChildRows(index)
 
         self.endAddChildNodes.emit(self, index, idxLast)
-        s = ""
 
     def removeAllChildNodes(self):
         self.removeChildNodes(self.childNodes())
 
     def removeChildNodes(self, child_nodes):
         """
-        Removes child-nodes
-        :param child_nodes:
-        :type child_nodes:
-        :return:
-        :rtype:
+        Removes child-nodes. Neighbouring nodes are removed within a single
+        begin/endRemoveChildNodes block.
+        :param child_nodes: TreeNode or [list-of-TreeNodes]
         """
         if isinstance(child_nodes, TreeNode):
             child_nodes = [child_nodes]
         child_nodes: List[TreeNode]
         for node in child_nodes:
             assert isinstance(node, TreeNode)
-            assert node in self.mChildren
             assert node.parentNode() == self
 
-        child_nodes = sorted(child_nodes, key=lambda node: node.nodeIndex())
-        removed = []
-        while len(child_nodes) > 0:
-            # find neighbored nodes to remove
-            nextNode = child_nodes[0]
-            toRemove = []
-            while isinstance(nextNode, TreeNode) and nextNode in child_nodes:
-                toRemove.append(nextNode)
-                nextNode = nextNode.next()
-
-            first = toRemove[0].nodeIndex()
-            last = toRemove[-1].nodeIndex()
-
-            self.beginRemoveChildNodes.emit(self, first, last)
-
-            for node in reversed(toRemove):
-                # disconnect node signals
-                node.beginAddChildNodes.disconnect(self.beginAddChildNodes)
-                node.endAddChildNodes.disconnect(self.endAddChildNodes)
-                node.beginRemoveChildNodes.disconnect(self.beginRemoveChildNodes)
-                node.endRemoveChildNodes.disconnect(self.endRemoveChildNodes)
-                node.sigUpdated.disconnect(self.sigUpdated)
-
-                self.mChildren.remove(node)
-
-                node.setParentNode(None)
-
-                child_nodes.remove(node)
-                removed.append(node)
+        rows = sorted(set(node.mRow for node in child_nodes))
+        if len(rows) == 0:
+            return
 
-            self.endRemoveChildNodes.emit(self, first, last)
-            s = ""
+        # group into ranges of neighboured rows
+        ranges = []
+        first = last = rows[0]
+        for row in rows[1:]:
+            if row == last + 1:
+                last = row
+            else:
+                ranges.append((first, last))
+                first = last = row
+        ranges.append((first, last))
+
+        # remove from the end, so that the rows of the remaining ranges stay valid
+        for first, last in reversed(ranges):
+            self.removeChildNodeRange(first, last)
+
+    def removeChildNodeRange(self, first: int, last: int) -> List['TreeNode']:
+        """
+        Removes the child nodes in rows first to last (inclusive) within a
+        single begin/endRemoveChildNodes block.
+        :param first: int, first row
+        :param last: int, last row
+        :return: [list-of-TreeNodes], the removed nodes
+        """
+        assert 0 <= first <= last < len(self.mChildren)
+
+        self.beginRemoveChildNodes.emit(self, first, last)
+        toRemove = self.mChildren[first:last + 1]
+        for node in toRemove:
+            # disconnect node signals
+            node.beginAddChildNodes.disconnect(self.beginAddChildNodes)
+            node.endAddChildNodes.disconnect(self.endAddChildNodes)
+            node.beginRemoveChildNodes.disconnect(self.beginRemoveChildNodes)
+            node.endRemoveChildNodes.disconnect(self.endRemoveChildNodes)
+            node.sigUpdated.disconnect(self.sigUpdated)
+            node.setParentNode(None)
+            node.mRow = -1
+
+        del self.mChildren[first:last + 1]
+        self._updateChildRows(first)
+
+        self.endRemoveChildNodes.emit(self, first, last)
+        return toRemove
 
     def setToolTip(self, toolTip: str):
         """
@@ -993,15 +1029,10 @@ class TreeModel(QAbstractItemModel):
         childNode: TreeNode = index.internalPointer()
         parentNode: TreeNode = childNode.parentNode()
 
-        if parentNode == self.rootNode() or parentNode is None:
+        if parentNode is None or parentNode is self.mRootNode:
             return QModelIndex()
-
         else:
-            idx = self.node2idx(parentNode)
-            if idx.column() != 0:
-                s = ""
-            return self.createIndex(idx.row(), idx.column(), parentNode)
-        s = ""
+            return self.node2idx(parentNode)
 
     def rowCount(self, parent: QModelIndex = None) -> int:
         """
@@ -1160,9 +1191,11 @@ class TreeModel(QAbstractItemModel):
         """
         assert isinstance(indexes, list)
         nodes = []
+        seen = set()
         for idx in indexes:
             n = self.idx2node(idx)
-            if n not in nodes:
+            if id(n) not in seen:
+                seen.add(id(n))
                 nodes.append(n)
         return nodes
 
@@ -1177,11 +1210,16 @@ class TreeModel(QAbstractItemModel):
         if isinstance(nodes, TreeNode):
             nodes = [nodes]
 
+        # group nodes by parent to remove neighboured nodes in one go
+        parentNodes: Dict[int, Tuple[TreeNode, List[TreeNode]]] = dict()
         for n in nodes:
             assert isinstance(n, TreeNode)
-            idx = self.node2idx(n)
-            if idx.isValid():
-                n.parentNode().removeChildNodes(n)
+            p = n.parentNode()
+            if isinstance(p, TreeNode):
+                parentNodes.setdefault(id(p), (p, []))[1].append(n)
+
+        for p, childNodes in parentNodes.values():
+            p.removeChildNodes(childNodes)
 
     def nodes2indexes(self, nodes: list):
         """
@@ -1222,13 +1260,11 @@ class TreeModel(QAbstractItemModel):
         :param node: TreeNode
         :return: QModelIndex
         """
-        parentNode = node.parentNode()
-        if not isinstance(node, TreeNode) or parentNode is None:
+        if not isinstance(node, TreeNode) or node.parentNode() is None or node is self.mRootNode:
             return QModelIndex()
 
-        parentIndex = self.node2idx(parentNode)
-        row = parentNode.mChildren.index(node)
-        return self.index(row, 0, parent=parentIndex)
+        # the cached node row avoids a search in the parent's child list and a recursion up to the root
+        return self.createIndex(node.mRow, 0, node)
 
     def data(self, index: QModelIndex, role=Qt.DisplayRole):
         """
@@ -1364,18 +1400,28 @@ class TreeView(QTreeView):
 
         model: QAbstractItemModel = self.model()
         if isinstance(model, QAbstractItemModel):
-            rows = model.rowCount(index)
-            if rows > 0:
+            # hasChildren() is True for nodes that can fetch their child nodes on demand
+            if model.rowCount(index) > 0 or model.hasChildren(index):
                 nodeName = f'{prefix}:{model.data(index, role=Qt.DisplayRole)}'
                 nodeDepth: int = self.nodeDepth(index)
 
                 if restore:
                     # restore expansion state, if stored in mNodeExpansion
-                    self.setExpanded(index, self.mNodeExpansion.get(nodeName, nodeDepth < self.mAutoExpansionDepth))
+                    expand = self.mNodeExpansion.get(nodeName, None)
+                    if expand is None:
+                        expand = nodeDepth < self.mAutoExpansionDepth
+                        # nodes that create their child nodes on demand are expanded automatically
+                        # on the top level only, to not fetch the child nodes of all sub nodes
+                        if expand and nodeDepth > 1 and model.canFetchMore(index):
+                            expand = False
+                    if expand and index.isValid() and model.canFetchMore(index):
+                        model.fetchMore(index)
+                    self.setExpanded(index, expand)
                 else:
                     # save expansion state
                     self.mNodeExpansion[nodeName] = self.isExpanded(index)
 
+                rows = model.rowCount(index)
                 for row in range(rows):
                     idx = model.index(row, 0, index)
                     self.updateNodeExpansion(restore, index=idx, prefix=nodeName)
@@ -30,26 +30,29 @@ import os
 import pathlib
 import re
 import sys
+from collections import OrderedDict
 from json import JSONDecodeError
+from types import CodeType
 from typing import Any, Callable, Dict, List, Set, Tuple, Union, Optional
 
 import numpy as np
 
-from qgis.PyQt.QtCore import NULL, QByteArray, QCoreApplication, QVariant
+from qgis.PyQt.QtCore import NULL, QByteArray, QCoreApplication, QThread, QVariant
 from qgis.core import Qgis, QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsExpression, QgsExpressionContext, \
-    QgsExpressionContextScope, QgsExpressionFunction, QgsExpressionNode, QgsExpressionNodeFunction, QgsFeature, \
-    QgsFeatureRequest, QgsField, QgsGeometry, QgsMapLayer, QgsMapToPixel, QgsMessageLog, QgsPointXY, QgsProject, \
-    QgsRasterDataProvider, QgsRasterLayer
+    QgsExpressionContextScope, QgsExpressionFunction, QgsExpressionNode, QgsExpressionNodeColumnRef, \
+    QgsExpressionNodeFunction, QgsFeature, QgsFeatureRequest, QgsGeometry, QgsMapLayer, QgsMapToPixel, \
+    QgsMessageLog, QgsPointXY, QgsRasterDataProvider, QgsRasterLayer, QgsVectorLayer
 from .qgisenums import QGIS_WKBTYPE
 from .qgsrasterlayerproperties import QgsRasterLayerSpectralProperties
 from .speclib.core import is_profile_field
 from .speclib.core.spectrallibrary import FIELD_VALUES
-from .speclib.core.spectralprofile import decodeProfileValueDict, encodeProfileValueDict, prepareProfileValueDict, \
-    ProfileEncoding, SpectralProfileFileReader
+from .speclib.core.spectralprofile import decodeProfileValueDict, encodeProfileValueDict, encodeProfileValueDicts, \
+    prepareProfileValueDict, ProfileEncoding, SpectralProfileFileReader
 from .speclib.io.asd import ASDBinaryFile
 from .speclib.io.spectralevolution import SEDFile
 from .speclib.io.svc import SVCSigFile
-from .utils import _geometryIsSinglePoint, aggregateArray, MapGeometryToPixel, noDataValues, rasterArray
+from .utils import _geometryIsSinglePoint, aggregateArray, mapLayerIndex, MapGeometryToPixel, noDataValues, \
+    rasterArray
 
 SPECLIB_FUNCTION_GROUP = "Spectral Libraries"
 
@@ -584,15 +587,26 @@ class ExpressionFunctionUtils(object):
         Extracts a QgsRasterLayer instance
         """
         if isinstance(value, str):
+            stores = []
+            if Qgis.versionInt() >= 33000:
+                stores.extend(context.layerStores())
+            for s in stores:
+                lyr = s.mapLayer(value)
+                if isinstance(lyr, QgsRasterLayer):
+                    return lyr
+                for lyr in s.mapLayersByName(value):
+                    if isinstance(lyr, QgsRasterLayer):
+                        return lyr
+
+            # layers of QgsProject.instance() and other registered stores
+            index = mapLayerIndex()
+            for lyr in [index.layer(value)] + index.layersByName(value):
+                if isinstance(lyr, QgsRasterLayer):
+                    return lyr
+
             layers = QgsExpression('@layers').evaluate(context)
             if layers is None:
                 layers = []
-            stores = [QgsProject.instance().layerStore()]
-            if Qgis.versionInt() >= 33000:
-                stores = context.layerStores() + stores
-            for s in stores:
-                layers.extend(s.mapLayers().values())
-            layers = set(layers)
             for lyr in layers:
                 if isinstance(lyr, QgsRasterLayer) and value in [lyr.name(), lyr.id()]:
                     return lyr
@@ -974,12 +988,38 @@ class SpectralData(QgsExpressionFunction):
         return False
 
 
+class SpectralMathBatch(object):
+    """
+    Prefetched spectral_math results of a single expression evaluation
+    """
+
+    def __init__(self, key: tuple, size: int):
+        self.key = key
+        self.fids: Optional[np.ndarray] = None
+        self.results: Dict[int, tuple] = dict()
+        self.size: int = size
+        self.hits: int = 0
+
+
 class SpectralMath(QgsExpressionFunction):
     GROUP = SPECLIB_FUNCTION_GROUP
     NAME = 'spectral_math'
 
     RX_ENCODINGS = re.compile('^({})$'.format('|'.join(ProfileEncoding.__members__.keys())), re.I)
 
+    # compiled python code, keyed by the expression string
+    COMPILED_CODE: Dict[str, CodeType] = OrderedDict()
+    MAX_COMPILED_CODE = 128
+
+    # python code that contains this comment line works row-wise on stacked (profiles, bands) arrays
+    RX_STACKED = re.compile(r'^\s*#\s*stacked\s*$', re.M | re.I)
+
+    # min / max number of features that are evaluated at once when stacked code is called on the features of a layer.
+    # Features requested in random order are fetched in batches of BATCH_MIN, i.e. with up to BATCH_MIN times the
+    # costs of a per-feature evaluation.
+    BATCH_MIN = 16
+    BATCH_MAX = 16384
+
     def __init__(self):
         args = [
             QgsExpressionFunction.Parameter('p1', optional=False),
@@ -991,6 +1031,250 @@ class SpectralMath(QgsExpressionFunction):
         helptext = HM.helpText(self.NAME, args)
         super().__init__(self.NAME, -1, self.GROUP, helptext)
 
+    @staticmethod
+    def compiledCode(pyExpression: str) -> CodeType:
+        """
+        Returns the compiled python code of an expression string
+        :param pyExpression: str
+        :return: code object
+        """
+        code = SpectralMath.COMPILED_CODE.get(pyExpression)
+        if code is None:
+            code = compile(pyExpression, f'<{SpectralMath.NAME}>', 'exec')
+            SpectralMath.COMPILED_CODE[pyExpression] = code
+            while len(SpectralMath.COMPILED_CODE) > SpectralMath.MAX_COMPILED_CODE:
+                SpectralMath.COMPILED_CODE.popitem(last=False)
+        else:
+            SpectralMath.COMPILED_CODE.move_to_end(pyExpression)
+        return code
+
+    @staticmethod
+    def isStackedCode(pyExpression: str) -> bool:
+        """
+        Returns True if the python code is marked with a '# stacked' comment line to work row-wise on stacked profiles,
+        e.g. by using axis=-1 in reductions like y1.max(axis=-1, keepdims=True)
+        :param pyExpression: str
+        :return: bool
+        """
+        return SpectralMath.RX_STACKED.search(pyExpression) is not None
+
+    @staticmethod
+    def defaultEncoding(dump) -> ProfileEncoding:
+        # use same input type as output type
+        if isinstance(dump, (QByteArray, bytes)):
+            return ProfileEncoding.Bytes
+        elif isinstance(dump, dict):
+            return ProfileEncoding.Map
+        else:
+            return ProfileEncoding.Text
+
+    @staticmethod
+    def evaluateProfiles(code: CodeType, profiles: List[dict]) -> dict:
+        """
+        Evaluates the python code for the decoded profiles of a single feature
+        :param code: compiled python code
+        :param profiles: list of decoded profile dictionaries, one per input profile
+        :return: profile dictionary of the results
+        """
+        DATA = dict()
+        for i, d in enumerate(profiles):
+            if len(d) == 0:
+                continue
+            if i == 0:
+                DATA.update(d)
+            # append position number
+            # y of 1st profile = y1, y of 2nd profile = y2 ...
+            n = i + 1
+            for k, v in d.items():
+                if isinstance(k, str):
+                    DATA[f'{k}{n}'] = v
+
+        exec(code, DATA)
+
+        # collect output profile values
+        return prepareProfileValueDict(x=DATA.get('x', None),
+                                       y=DATA['y'],
+                                       xUnit=DATA.get('xUnit', None),
+                                       yUnit=DATA.get('yUnit', None),
+                                       bbl=DATA.get('bbl', None),
+                                       )
+
+    @staticmethod
+    def _profileKey(d: dict) -> Optional[tuple]:
+        # profiles with same key can be stacked into a (profiles, bands) array
+        if len(d) == 0:
+            return None
+        other = tuple(sorted((k, repr(v)) for k, v in d.items() if k not in ['x', 'y', 'bbl']))
+        return (len(d['y']),
+                d['x'].tobytes() if 'x' in d else None,
+                d['bbl'].tobytes() if 'bbl' in d else None,
+                other)
+
+    @staticmethod
+    def evaluateBatch(profileColumns: List[List[Any]],
+                      pyExpression: str,
+                      encoding: Union[None, str, ProfileEncoding] = None,
+                      stacked: Optional[bool] = None) -> List[Any]:
+        """
+        Evaluates python code for many features. If the code works row-wise on stacked profiles, profiles that share
+        the same number of bands, x values, bad band list and units are stacked, so that the code is executed once
+        on arrays of shape (profiles, bands) instead of once per feature. Otherwise, the code is evaluated per feature.
+        Stacked groups that fail, e.g. because the code does not return a (profiles, bands) array, are evaluated
+        per feature as well.
+        :param profileColumns: list with the values of each input profile field, i.e. [[p1 values], [p2 values], ...]
+        :param pyExpression: python code
+        :param encoding: output encoding. Defaults to the encoding of the 1st profile input
+        :param stacked: set True if the code works row-wise on stacked profiles.
+                        Defaults to isStackedCode(pyExpression)
+        :return: list with an encoded result profile per feature, None for features that can not be evaluated
+        """
+        code = SpectralMath.compiledCode(pyExpression)
+        if stacked is None:
+            stacked = SpectralMath.isStackedCode(pyExpression)
+        if encoding is not None:
+            encoding = ProfileEncoding.fromInput(encoding)
+
+        nFeatures = len(profileColumns[0]) if len(profileColumns) > 0 else 0
+        decoded = [[decodeProfileValueDict(v, numpy_arrays=True) for v in column] for column in profileColumns]
+        results: List[Any] = [None] * nFeatures
+
+        # group features with stackable profiles
+        groups: Dict[tuple, List[int]] = dict()
+        for i in range(nFeatures):
+            if encoding is None:
+                e = SpectralMath.defaultEncoding(profileColumns[0][i]) if len(decoded[0][i]) > 0 else None
+            else:
+                e = encoding
+            key = (e,) + tuple(SpectralMath._profileKey(column[i]) for column in decoded)
+            groups.setdefault(key, []).append(i)
+
+        def evaluateFeature(i: int) -> Optional[dict]:
+            try:
+                return SpectralMath.evaluateProfiles(code, [column[i] for column in decoded])
+            except Exception:
+                return None
+
+        for key, rows in groups.items():
+            e = key[0]
+            batchResults = None
+            if stacked and e is not None and len(rows) > 1:
+                try:
+                    batchResults = SpectralMath._evaluateStacked(code, decoded, rows)
+                except Exception:
+                    batchResults = None
+
+            if batchResults is not None:
+                y, x, xUnit, yUnit, bbl = batchResults
+                for i, value in zip(rows, encodeProfileValueDicts(y.transpose(), e, x=x, xUnit=xUnit,
+                                                                  yUnit=yUnit, bbl=bbl)):
+                    results[i] = value
+            elif e is not None:
+                for i in rows:
+                    d = evaluateFeature(i)
+                    if isinstance(d, dict):
+                        results[i] = encodeProfileValueDict(d, e)
+        return results
+
+    @staticmethod
+    def _evaluateStacked(code: CodeType, decoded: List[List[dict]], rows: List[int]) -> Optional[tuple]:
+        DATA = dict()
+        for c, column in enumerate(decoded):
+            d0 = column[rows[0]]
+            if len(d0) == 0:
+                continue
+            d = dict(d0)
+            d['y'] = np.stack([column[i]['y'] for i in rows])
+            if c == 0:
+                DATA.update(d)
+            for k, v in d.items():
+                if isinstance(k, str):
+                    DATA[f'{k}{c + 1}'] = v
+
+        exec(code, DATA)
+
+        y = np.asarray(DATA['y'])
+        x = DATA.get('x', None)
+        bbl = DATA.get('bbl', None)
+        xUnit = DATA.get('xUnit', None)
+        yUnit = DATA.get('yUnit', None)
+        if y.ndim != 2 or y.shape[0] != len(rows):
+            return None
+        if x is not None and np.ndim(x) != 1 or bbl is not None and np.ndim(bbl) != 1:
+            return None
+        if not all(v is None or isinstance(v, str) for v in [xUnit, yUnit]):
+            return None
+        return y, x, xUnit, yUnit, bbl
+
+    def _batchResult(self, values: list, nProfiles: int, pyExpression: str, encoding: Optional[ProfileEncoding],
+                     context: QgsExpressionContext, node: QgsExpressionNodeFunction) -> Any:
+        """
+        Returns the result for the current feature from a batch evaluation of the following features of the same layer,
+        or None if the result can not be taken from a batch.
+        Batches are used for stacked code only and are prefetched in the main thread only. The batch state is kept
+        as cached value of the expression context, i.e. separately for each evaluation.
+        """
+        if nProfiles < 1 or not SpectralMath.isStackedCode(pyExpression):
+            return None
+        app = QCoreApplication.instance()
+        if not (isinstance(app, QCoreApplication) and QThread.currentThread() == app.thread()):
+            return None
+        if not isinstance(node, QgsExpressionNodeFunction) or node.args() is None:
+            return None
+        argNodes = node.args().list()
+        if not all(isinstance(n, QgsExpressionNodeColumnRef) for n in argNodes[0:nProfiles]):
+            return None
+        feature = context.feature()
+        layerId = context.variable('layer_id')
+        if not (isinstance(feature, QgsFeature) and isinstance(layerId, str)):
+            return None
+        layer = mapLayerIndex().layer(layerId)
+        if not isinstance(layer, QgsVectorLayer):
+            return None
+
+        fid = feature.id()
+        fieldNames = [n.name() for n in argNodes[0:nProfiles]]
+        key = (layerId, tuple(fieldNames), pyExpression, encoding)
+        cacheKey = f'{self.NAME}_batch_{hash(key)}'
+        batch = context.cachedValue(cacheKey) if context.hasCachedValue(cacheKey) else None
+        if not (isinstance(batch, SpectralMathBatch) and batch.key == key):
+            batch = SpectralMathBatch(key, self.BATCH_MIN)
+            context.setCachedValue(cacheKey, batch)
+
+        entry = batch.results.get(fid)
+        if entry is None:
+            # grow the batch size while the features are requested in fid order, shrink it otherwise
+            nLast = len(batch.results)
+            if nLast > 0:
+                if batch.hits >= nLast // 2:
+                    batch.size = min(self.BATCH_MAX, batch.size * 2)
+                else:
+                    batch.size = max(self.BATCH_MIN, batch.size // 4)
+            if batch.fids is None:
+                batch.fids = np.asarray(sorted(layer.allFeatureIds()), dtype=np.int64)
+            fids = batch.fids
+            i = int(np.searchsorted(fids, fid))
+            if i >= len(fids) or fids[i] != fid:
+                return None
+            request = QgsFeatureRequest()
+            request.setFilterFids(fids[i:i + batch.size].tolist())
+            request.setFlags(QgsFeatureRequest.NoGeometry)
+            request.setSubsetOfAttributes(fieldNames, layer.fields())
+            inputs = {f.id(): [f.attribute(n) for n in fieldNames] for f in layer.getFeatures(request)}
+            order = list(inputs.keys())
+            results = SpectralMath.evaluateBatch([[inputs[f][c] for f in order] for c in range(nProfiles)],
+                                                 pyExpression, encoding, stacked=True)
+            batch.results = {f: (inputs[f], r) for f, r in zip(order, results)}
+            batch.hits = 0
+            entry = batch.results.get(fid)
+            if entry is None:
+                return None
+
+        inputValues, result = entry
+        if result is None or inputValues != list(values[0:nProfiles]):
+            return None
+        batch.hits += 1
+        return result
+
     def func(self, values, context: QgsExpressionContext, parent: QgsExpression, node: QgsExpressionNodeFunction):
 
         if len(values) < 1:
@@ -1014,43 +1298,21 @@ class SpectralMath(QgsExpressionFunction):
                 f'{self.name()}: Argument {iPy + 1} needs to be a string with python code')
             return QVariant()
 
+        try:
+            result = self._batchResult(values, len(values) + iPy, pyExpression, encoding, context, node)
+        except Exception:
+            result = None
+        if result is not None:
+            return result
+
         try:
             profilesData = values[0:-1]
-            DATA = dict()
-            fieldType: QgsField = None
-            for i, dump in enumerate(profilesData):
-                d = decodeProfileValueDict(dump, numpy_arrays=True)
-                if len(d) == 0:
-                    continue
-                if i == 0:
-                    DATA.update(d)
-                    if encoding is None:
-                        #       # use same input type as output type
-                        if isinstance(dump, (QByteArray, bytes)):
-                            encoding = ProfileEncoding.Bytes
-                        elif isinstance(dump, dict):
-                            encoding = ProfileEncoding.Map
-                        else:
-                            encoding = ProfileEncoding.Text
-
-                n = i + 1
-                # append position number
-                # y of 1st profile = y1, y of 2nd profile = y2 ...
-                for k, v in d.items():
-                    if isinstance(k, str):
-                        k2 = f'{k}{n}'
-                        DATA[k2] = v
+            profiles = [decodeProfileValueDict(dump, numpy_arrays=True) for dump in profilesData]
+            if encoding is None and len(profiles) > 0 and len(profiles[0]) > 0:
+                encoding = SpectralMath.defaultEncoding(profilesData[0])
 
             assert context.fields()
-            exec(pyExpression, DATA)
-
-            # collect output profile values
-            d = prepareProfileValueDict(x=DATA.get('x', None),
-                                        y=DATA['y'],
-                                        xUnit=DATA.get('xUnit', None),
-                                        yUnit=DATA.get('yUnit', None),
-                                        bbl=DATA.get('bbl', None),
-                                        )
+            d = SpectralMath.evaluateProfiles(SpectralMath.compiledCode(pyExpression), profiles)
             return encodeProfileValueDict(d, encoding)
         except Exception as ex:
             parent.setEvalErrorString(f'{ex}')
@@ -1,7 +1,10 @@
+import os
 import re
 import sys
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from typing import Any, List, Optional, Pattern, Union
+from typing import Any, Dict, Iterable, List, Optional, Pattern, Tuple, Union
 
 import numpy as np
 from osgeo import gdal
@@ -19,6 +22,10 @@ rx_key_value_pair = re.compile(r'^(?P<key>[^=]+)=(?P<value>.+)$')
 rx_envi_array = re.compile(r'^{\s*(?P<value>([^}]+))\s*}$')
 
 rx_is_int = re.compile(r'^\s*\d+\s*$')
+rx_envi_comment = re.compile(r'^[ \t]*[;#][^\n]*$', re.M)
+rx_envi_item = re.compile(r'^[ \t]*(?P<key>[^=\n{};#][^=\n{}]*?)[ \t]*=[ \t]*'
+                          r'(?:{(?P<values>[^{}]*)}|(?P<value>[^\n]*))', re.M)
+rx_envi_int_list = re.compile(r'^[\s\d,+-]+$')
 
 EXCLUDED_GDAL_DOMAINS = ['IMAGE_STRUCTURE', 'DERIVED_SUBDATASETS']
 
@@ -53,6 +60,63 @@ def stringToTypeList(value: str) -> List:
     return [stringToType(v) for v in re.split(r'[\s,;]+', value)]
 
 
+def enviListToArray(values: str) -> Union[np.ndarray, List[str]]:
+    """
+    Converts the content of an ENVI header brace-list into a numpy array
+    :param values: str, comma-separated values without the enclosing braces
+    :return: numpy.ndarray of type int64 or float64, or a list of str if the values are not numeric
+    """
+    items = values.split(',')
+    if rx_envi_int_list.match(values):
+        try:
+            return np.asarray(items, dtype=np.int64)
+        except ValueError:
+            pass
+    try:
+        return np.asarray(items, dtype=np.float64)
+    except ValueError:
+        return [v.strip() for v in items]
+
+
+def parseENVIHeader(text: str,
+                    typeConversion: bool = False,
+                    keys: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """
+    Tokenizes the text of an ENVI header (*.hdr) into a dictionary.
+    Comment lines (starting with ';' or '#') are ignored, keys without values are skipped.
+    :param text: str, ENVI header text
+    :param typeConversion: Set on True to convert single values into int / float and
+                           numeric brace-lists into numpy arrays.
+                           Otherwise values are returned as str or list of str.
+    :param keys: optional, the keys to return. Values of other keys are not converted.
+    :return: dict
+    """
+    if ';' in text or '#' in text:
+        text = rx_envi_comment.sub('', text)
+    if keys is not None:
+        keys = set(keys)
+
+    md = dict()
+    for match in rx_envi_item.finditer(text):
+        key = match.group('key').strip()
+        if keys is not None and key not in keys:
+            continue
+        values = match.group('values')
+        if values is None:
+            value = match.group('value').strip()
+            if len(value) > 0:
+                md[key] = stringToType(value) if typeConversion else value
+        elif len(values.strip()) > 0:
+            if typeConversion:
+                value = enviListToArray(values)
+                if isinstance(value, np.ndarray):
+                    value.flags.writeable = False
+            else:
+                value = [v.strip() for v in values.split(',')]
+            md[key] = value
+    return md
+
+
 class SpectralPropertyKeys(object):
     """
     Enumeration of Spectral Property Keys
@@ -322,7 +386,7 @@ class QgsRasterLayerSpectralProperties(QgsObjectCustomProperties):
         for b in range(ds.RasterCount):
             band: gdal.Band = ds.GetRasterBand(b + 1)
             self.setValue(self.bandItemKey(b + 1, 'offset'), band.GetOffset())
-            self.setValue(self.bandItemKey(b + 1, 'scale'), band.GetOffset())
+            self.setValue(self.bandItemKey(b + 1, 'scale'), band.GetScale())
 
             # domain specific values
             for domain in domainList(band):
@@ -355,12 +419,10 @@ class QgsRasterLayerSpectralProperties(QgsObjectCustomProperties):
         assert isinstance(provider, QgsRasterDataProvider)
 
         if provider.name() == 'gdal':
-            uri = provider.dataSourceUri()
-
-            ds: gdal.Dataset = gdal.Open(uri)
-            if isinstance(ds, gdal.Dataset):
-                self._readFromGDALDataset(ds)
-                del ds
+            md = SpectralMetadataCache.gdalMetadata(provider.dataSourceUri())
+            if isinstance(md, SpectralMetadata):
+                for k in md.properties.keys():
+                    self.setValue(k, md.properties.value(k))
                 return
 
         html = provider.htmlMetadata()
@@ -426,6 +488,213 @@ class QgsRasterLayerSpectralProperties(QgsObjectCustomProperties):
             self.setBandValues(None, 'wlu', wlu)
 
 
+def _floatArray(values: List[Any], default: float) -> np.ndarray:
+    """
+    Converts a list of values into a float array. Values that cannot be converted are replaced by `default`.
+    """
+    array = np.empty(len(values), dtype=float)
+    for i, v in enumerate(values):
+        try:
+            array[i] = float(v)
+        except (TypeError, ValueError):
+            array[i] = default
+    return array
+
+
+class SpectralMetadata(object):
+    """
+    The spectral metadata of a raster source as numpy arrays of length n = number of bands
+    """
+
+    def __init__(self, properties: QgsRasterLayerSpectralProperties):
+        assert isinstance(properties, QgsRasterLayerSpectralProperties)
+        nan = float('nan')
+        # the properties the arrays were derived from. Do not modify.
+        self.properties: QgsRasterLayerSpectralProperties = properties
+        self.wavelength: np.ndarray = np.asarray(properties.wavelengths())
+        wlu = properties.wavelengthUnits()
+        self.wavelengthUnit: Optional[str] = wlu[0] if len(wlu) > 0 else None
+        self.fwhm: np.ndarray = _floatArray(properties.fullWidthHalfMaximum(), nan)
+        self.badBands: np.ndarray = np.asarray(properties.badBands(), dtype=int)
+        self.offsets: np.ndarray = _floatArray(properties.bandValues(None, 'offset'), 0.0)
+        self.scales: np.ndarray = _floatArray(properties.bandValues(None, 'scale'), 1.0)
+
+    def bandCount(self) -> int:
+        return self.properties.bandCount()
+
+
+class SpectralMetadataCache(object):
+    """
+    A process-wide cache of the spectral metadata of GDAL raster sources.
+    An entry is keyed by the source uri and remains valid as long as the modification
+    time and size of the source file and its sidecar files (*.aux.xml, *.hdr) do not change.
+    """
+    MAX_ENTRIES: int = 128
+    SIDECAR_SUFFIXES = ['.aux.xml', '.hdr']
+
+    _ENTRIES: OrderedDict = OrderedDict()
+    _LOCK = threading.Lock()
+
+    @classmethod
+    def fileSignature(cls, uri: str) -> Optional[Tuple]:
+        """
+        Returns the modification times and sizes of a local raster file and its sidecar files,
+        or None if the uri does not point to a local file.
+        """
+        if not (isinstance(uri, str) and os.path.isfile(uri)):
+            return None
+        files = [uri] + [uri + suffix for suffix in cls.SIDECAR_SUFFIXES]
+        files.append(os.path.splitext(uri)[0] + '.hdr')
+        signature = []
+        for f in files:
+            try:
+                st = os.stat(f)
+                signature.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    @classmethod
+    def gdalMetadata(cls, uri: str) -> Optional[SpectralMetadata]:
+        """
+        Returns the SpectralMetadata read from the GDAL metadata of a raster source.
+        Results for local files are taken from / added to the cache.
+        """
+        signature = cls.fileSignature(uri)
+        if signature is not None:
+            with cls._LOCK:
+                entry = cls._ENTRIES.get(uri)
+                if entry is not None and entry[0] == signature:
+                    cls._ENTRIES.move_to_end(uri)
+                    return entry[1]
+
+        try:
+            ds: gdal.Dataset = gdal.Open(uri)
+        except RuntimeError:
+            ds = None
+        if not (isinstance(ds, gdal.Dataset) and ds.RasterCount > 0):
+            return None
+        properties = QgsRasterLayerSpectralProperties(ds.RasterCount)
+        properties._readFromGDALDataset(ds)
+        del ds
+        md = SpectralMetadata(properties)
+
+        if signature is not None:
+            with cls._LOCK:
+                cls._ENTRIES[uri] = (signature, md)
+                cls._ENTRIES.move_to_end(uri)
+                while len(cls._ENTRIES) > cls.MAX_ENTRIES:
+                    cls._ENTRIES.popitem(last=False)
+        return md
+
+    @classmethod
+    def metadata(cls, dataset: Union[QgsRasterLayer, QgsRasterDataProvider, gdal.Dataset, str, Path]) \
+            -> Optional[SpectralMetadata]:
+        """
+        Returns the SpectralMetadata of a raster. Uses cached values where possible,
+        i.e. for GDAL raster sources without layer-specific spectral properties.
+        """
+        if isinstance(dataset, Path):
+            dataset = dataset.as_posix()
+        if isinstance(dataset, gdal.Dataset):
+            dataset = dataset.GetDescription()
+
+        if isinstance(dataset, QgsRasterLayer):
+            if dataset.isValid() and dataset.providerType() == 'gdal' \
+                    and not any(k.startswith('band_') for k in dataset.customPropertyKeys()):
+                return cls.gdalMetadata(dataset.source())
+        elif isinstance(dataset, QgsRasterDataProvider):
+            if dataset.name() == 'gdal':
+                return cls.gdalMetadata(dataset.dataSourceUri())
+        elif isinstance(dataset, str):
+            # a default style might define layer-specific spectral properties
+            if cls.fileSignature(dataset) is not None \
+                    and not os.path.isfile(os.path.splitext(dataset)[0] + '.qml'):
+                return cls.gdalMetadata(dataset)
+
+        properties = QgsRasterLayerSpectralProperties.fromRasterLayer(dataset)
+        if isinstance(properties, QgsRasterLayerSpectralProperties):
+            return SpectralMetadata(properties)
+        return None
+
+    @classmethod
+    def invalidate(cls, uri: Union[str, Path, None] = None):
+        """
+        Removes the cached metadata of a raster source. Removes all entries if uri is None.
+        Call this after the metadata of a raster source has been modified.
+        """
+        with cls._LOCK:
+            if uri is None:
+                cls._ENTRIES.clear()
+            else:
+                if isinstance(uri, Path):
+                    uri = uri.as_posix()
+                cls._ENTRIES.pop(uri, None)
+
+
+class ENVIHeaderCache(object):
+    """
+    A process-wide cache of parsed ENVI header files (*.hdr).
+    An entry is keyed by the header path and remains valid as long as the modification
+    time and size of the header file do not change. Only the header is read, not the binary data,
+    which allows to scan large catalogs of ENVI files, e.g. for wavelength compatibility.
+    """
+    MAX_ENTRIES: int = 4096
+
+    _ENTRIES: OrderedDict = OrderedDict()
+    _LOCK = threading.Lock()
+
+    @classmethod
+    def clear(cls):
+        """
+        Removes all cached headers
+        """
+        with cls._LOCK:
+            cls._ENTRIES.clear()
+
+    @classmethod
+    def header(cls,
+               path: Union[str, Path],
+               typeConversion: bool = True,
+               keys: Optional[Iterable[str]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Returns the values of an ENVI header file. See parseENVIHeader for details.
+        Numpy arrays are shared with the cache and therefore read-only.
+        :param path: path of the ENVI header file (*.hdr)
+        :param typeConversion: Set on True to convert values into int / float and numpy arrays.
+        :param keys: optional, the keys to return
+        :return: dict or None, if the header file does not exist
+        """
+        path = Path(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        signature = (st.st_mtime_ns, st.st_size)
+        cacheKey = (path.as_posix(), bool(typeConversion))
+
+        with cls._LOCK:
+            entry = cls._ENTRIES.get(cacheKey)
+            if entry is not None and entry[0] == signature:
+                cls._ENTRIES.move_to_end(cacheKey)
+                md = entry[1]
+            else:
+                md = None
+
+        if md is None:
+            with open(path, encoding='utf-8', errors='replace') as f:
+                md = parseENVIHeader(f.read(), typeConversion=typeConversion)
+            with cls._LOCK:
+                cls._ENTRIES[cacheKey] = (signature, md)
+                cls._ENTRIES.move_to_end(cacheKey)
+                while len(cls._ENTRIES) > cls.MAX_ENTRIES:
+                    cls._ENTRIES.popitem(last=False)
+
+        if keys is None:
+            keys = md.keys()
+        return {k: list(md[k]) if isinstance(md[k], list) else md[k] for k in keys if k in md}
+
+
 class QgsRasterLayerSpectralPropertiesTable(QgsVectorLayer):
     """
     A container to expose spectral properties of QgsRasterLayers
@@ -24,12 +24,73 @@
     along with this software. If not, see <http://www.gnu.org/licenses/>.
 ***************************************************************************
 """
-from qgis.PyQt.QtCore import pyqtSignal
+import os
+import re
+import time
+from typing import List, Optional
+
+from qgis.PyQt import sip
+from qgis.PyQt.QtCore import pyqtSignal, Qt
+from qgis.PyQt.QtGui import QStandardItem, QStandardItemModel
 from qgis.PyQt.QtWidgets import QDialog
 
+from qgis.core import QgsApplication, QgsTask
 from qgis.gui import QgsFileWidget
 from . import DIR_UI_FILES
-from .utils import loadUi
+from .utils import file_search, loadUi
+
+
+class FileSearchTask(QgsTask):
+    """
+    A QgsTask that searches for files in a background thread.
+    Found files are emitted in batches with sigFilesFound, so that partial results can be shown.
+    """
+    sigFilesFound = pyqtSignal(list)
+
+    def __init__(self,
+                 rootdir: str,
+                 pattern,
+                 description: str = 'Search files',
+                 emit_interval: float = 0.25,
+                 **kwds):
+        """
+        :param rootdir: root directory to search in
+        :param pattern: wildcard(s) or regular expression(s), see file_search
+        :param emit_interval: minimum time in seconds between two sigFilesFound signals
+        :param kwds: other keywords for file_search, e.g. recursive, ignoreCase, excludeDirs, maxResults or threads
+        """
+        super().__init__(description, QgsTask.CanCancel)
+        self.mRootDir = rootdir
+        self.mPattern = pattern
+        self.mKwds = kwds
+        self.mEmitInterval = emit_interval
+        self.mFiles: List[str] = []
+        self.mError: Optional[str] = None
+
+    def files(self) -> List[str]:
+        return self.mFiles[:]
+
+    def run(self):
+        t0 = time.time()
+        batch = []
+        try:
+            for path in file_search(self.mRootDir, self.mPattern, **self.mKwds):
+                if self.isCanceled():
+                    return False
+                batch.append(path)
+                if time.time() - t0 > self.mEmitInterval:
+                    self.mFiles.extend(batch)
+                    self.sigFilesFound.emit(batch)
+                    batch = []
+                    t0 = time.time()
+        except Exception as ex:
+            self.mError = str(ex)
+            return False
+
+        if len(batch) > 0:
+            self.mFiles.extend(batch)
+            self.sigFilesFound.emit(batch)
+        return True
 
 
 class SearchFilesDialog(QDialog):
@@ -47,15 +108,89 @@ class SearchFilesDialog(QDialog):
         self.btnRecursive.setDefaultAction(self.optionRecursive)
         self.btnReload.setDefaultAction(self.actionReload)
 
+        self.mFileModel = QStandardItemModel(0, 1, parent=self)
+        self.mFileModel.setHorizontalHeaderLabels(['File'])
+        self.tableView.setModel(self.mFileModel)
+        self.mTask: Optional[FileSearchTask] = None
+
+        # number of threads to scan directories in parallel
+        self.mThreads: int = min(8, os.cpu_count() or 1)
+
         self.fileWidget: QgsFileWidget
         # self.fileWidget.setReadOnly(True)
         self.fileWidget.setStorageMode(QgsFileWidget.GetDirectory)
         self.fileWidget.fileChanged.connect(self.reloadFiles)
-
-        s = ""
+        self.actionReload.triggered.connect(self.reloadFiles)
+        self.mFilter.editingFinished.connect(self.reloadFiles)
+        for option in [self.optionMatchCase, self.optionRegex, self.optionRecursive]:
+            option.toggled.connect(self.reloadFiles)
 
     def validate(self):
         s = ""
 
+    def filePattern(self):
+        """
+        Returns the file pattern(s) defined in the filter line edit
+        :return: regular expression or list of wildcard expressions
+        """
+        text = self.mFilter.text().strip()
+        if self.optionRegex.isChecked():
+            flags = 0 if self.optionMatchCase.isChecked() else re.IGNORECASE
+            try:
+                return re.compile(text, flags)
+            except re.error:
+                return None
+        patterns = [p.strip() for p in re.split(r'[;,]', text) if p.strip() != '']
+        if len(patterns) == 0:
+            patterns = ['*']
+        return patterns
+
+    def files(self) -> List[str]:
+        """
+        Returns the files found so far
+        """
+        return [self.mFileModel.item(r, 0).data(Qt.UserRole) for r in range(self.mFileModel.rowCount())]
+
+    def cancelSearch(self):
+        task = self.mTask
+        self.mTask = None
+        if isinstance(task, FileSearchTask) and not sip.isdeleted(task):
+            task.cancel()
+
     def reloadFiles(self, *args):
-        print('#RELOAD FILES')
+        self.cancelSearch()
+        self.mFileModel.removeRows(0, self.mFileModel.rowCount())
+
+        rootdir = self.fileWidget.filePath()
+        pattern = self.filePattern()
+        if not (os.path.isdir(rootdir) and pattern):
+            return
+
+        task = FileSearchTask(rootdir, pattern,
+                              recursive=self.optionRecursive.isChecked(),
+                              ignoreCase=not self.optionMatchCase.isChecked(),
+                              threads=self.mThreads)
+        # ignore results of canceled tasks that are still in the event queue
+        task.sigFilesFound.connect(lambda files, t=task: self.addFiles(files) if t is self.mTask else None)
+        self.mTask = task
+        QgsApplication.taskManager().addTask(task)
+
+    def addFiles(self, files: List[str]):
+        """
+        Adds found files to the file list
+        """
+        for path in files:
+            item = QStandardItem(os.path.basename(path))
+            item.setToolTip(path)
+            item.setData(path, Qt.UserRole)
+            item.setEditable(False)
+            self.mFileModel.appendRow(item)
+        self.sigFilesFound.emit(files)
+
+    def reject(self):
+        self.cancelSearch()
+        super().reject()
+
+    def accept(self):
+        self.cancelSearch()
+        super().accept()
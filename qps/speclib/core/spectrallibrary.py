@@ -26,6 +26,10 @@
 """
 
 import datetime
+import functools
+import io
+import itertools
+import json
 import os
 import pathlib
 import pickle
@@ -33,27 +37,29 @@ import re
 import sys
 import warnings
 import weakref
-from typing import Dict, List, Optional, Union
+import zipfile
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
 
+import numpy as np
 from osgeo import gdal, ogr
 
 from qgis.core import edit, Qgis, QgsAction, QgsActionManager, QgsApplication, QgsAttributeTableConfig, \
-    QgsCoordinateReferenceSystem, QgsCoordinateTransformContext, QgsEditorWidgetSetup, QgsExpression, \
-    QgsExpressionContext, QgsExpressionContextScope, QgsExpressionContextUtils, QgsFeature, QgsFeatureIterator, \
-    QgsFeatureRequest, QgsField, QgsFields, QgsGeometry, QgsMapLayerStore, QgsPointXY, QgsProcessingFeedback, \
-    QgsProject, QgsProperty, QgsRasterLayer, QgsRemappingProxyFeatureSink, QgsRemappingSinkDefinition, QgsVectorLayer, \
-    QgsWkbTypes
-from qgis.PyQt.QtCore import QDateTime, QMimeData, Qt, QUrl, QVariant
+    QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsCoordinateTransformContext, QgsEditorWidgetSetup, \
+    QgsExpression, QgsExpressionContext, QgsExpressionContextScope, QgsExpressionContextUtils, QgsFeature, \
+    QgsFeatureIterator, QgsFeatureRequest, QgsField, QgsFields, QgsGeometry, QgsMapLayerStore, QgsPointXY, \
+    QgsProcessingFeedback, QgsProject, QgsProperty, QgsRasterLayer, QgsRemappingProxyFeatureSink, \
+    QgsRemappingSinkDefinition, QgsVectorDataProvider, QgsVectorLayer, QgsWkbTypes
+from qgis.PyQt.QtCore import NULL, QByteArray, QDate, QDateTime, QMimeData, Qt, QTime, QUrl, QVariant
 from qgis.PyQt.QtWidgets import QWidget
 from . import can_store_spectral_profiles, create_profile_field, is_profile_field, is_spectral_library, \
     profile_field_list, profile_field_names
-from .spectralprofile import decodeProfileValueDict, encodeProfileValueDict, groupBySpectralProperties, \
-    prepareProfileValueDict, ProfileEncoding, SpectralSetting
+from .spectralprofile import decodeProfileValueDict, encodeProfileValueDict, encodeProfileValueDicts, \
+    groupBySpectralProperties, prepareProfileValueDict, ProfileEncoding, SpectralSetting
 from .. import EDITOR_WIDGET_REGISTRY_KEY, FIELD_NAME, FIELD_VALUES, SPECLIB_EPSG_CODE
 from ...plotstyling.plotstyling import PlotStyle
-from ...qgisenums import QGIS_WKBTYPE, QMETATYPE_QBYTEARRAY, QMETATYPE_QDATE, QMETATYPE_QDATETIME, QMETATYPE_QSTRING, \
-    QMETATYPE_QVARIANTMAP
-from ...utils import copyEditorWidgetSetup, findMapLayer, qgsField, SpatialPoint
+from ...qgisenums import QGIS_WKBTYPE, QMETATYPE_DOUBLE, QMETATYPE_INT, QMETATYPE_LONGLONG, QMETATYPE_QBYTEARRAY, \
+    QMETATYPE_QDATE, QMETATYPE_QDATETIME, QMETATYPE_QSTRING, QMETATYPE_QTIME, QMETATYPE_QVARIANTMAP, QMETATYPE_UINT
+from ...utils import copyEditorWidgetSetup, findMapLayer, qgsField, qgsFields2str, SpatialPoint, str2QgsFields
 
 # get to now how we can import this module
 MODULE_IMPORT_PATH = None
@@ -66,6 +72,7 @@ for name, module in sys.modules.items():
 
 MIMEDATA_SPECLIB = 'application/hub-spectrallibrary'
 MIMEDATA_SPECLIB_LINK = 'application/hub-spectrallibrary-link'
+MIMEDATA_SPECLIB_BINARY = 'application/hub-spectrallibrary-binary'
 MIMEDATA_XQT_WINDOWS_CSV = 'application/x-qt-windows-mime;value="Csv"'
 
 # see https://doc.qt.io/qt-5/qwinmime.html
@@ -126,7 +133,7 @@ def containsSpeclib(mimeData: QMimeData) -> bool:
     if mimeData.hasUrls():
         return True
 
-    for f in [MIMEDATA_SPECLIB, MIMEDATA_SPECLIB_LINK]:
+    for f in [MIMEDATA_SPECLIB, MIMEDATA_SPECLIB_LINK, MIMEDATA_SPECLIB_BINARY]:
         if f in mimeData.formats():
             return True
 
@@ -237,6 +244,8 @@ class SpectralLibraryUtils:
     """
     This class provides methods to handle SpectralProfiles in a QgsVectorLayer
     """
+    # number of features written at once by appendProfiles
+    BULK_BATCH_SIZE: int = 4096
 
     @staticmethod
     def createProfileField(
@@ -439,6 +448,11 @@ class SpectralLibraryUtils:
             if is_spectral_library(sl) and id(sl) == sid:
                 return sl
 
+        if MIMEDATA_SPECLIB_BINARY in mimeData.formats():
+            sl = SpectralLibraryUtils.readFromBinaryData(mimeData.data(MIMEDATA_SPECLIB_BINARY))
+            if is_spectral_library(sl):
+                return sl
+
         if mimeData.hasUrls():
             speclibs = []
             for url in mimeData.urls():
@@ -505,6 +519,56 @@ class SpectralLibraryUtils:
                 speclib.updatedFields.emit()
         return success
 
+    @staticmethod
+    def changeAttributeValues(speclib: QgsVectorLayer,
+                              values: Dict[int, Dict[int, Any]],
+                              oldValues: Dict[int, Dict[int, Any]] = None,
+                              undoable: bool = True) -> bool:
+        """
+        Changes the attribute values of multiple features with one call per feature.
+        :param speclib: QgsVectorLayer in editing mode
+        :param values: {fid: {field index: new value}}
+        :param oldValues: {fid: {field index: old value}}, optional. Avoids that the old values need to be fetched.
+        :param undoable: if False and the layer is not in editing mode, values of fields that exist in the data
+               provider are written to the data provider directly. These changes can not be undone or rolled back.
+               Layers in editing mode always use the edit buffer.
+        :return: bool
+        """
+        assert isinstance(speclib, QgsVectorLayer)
+        if oldValues is None:
+            oldValues = dict()
+        success = True
+
+        if not undoable and not speclib.isEditable():
+            provider: QgsVectorDataProvider = speclib.dataProvider()
+            if provider.capabilities() & QgsVectorDataProvider.ChangeAttributeValues:
+                if Qgis.versionInt() >= 33700:
+                    originProvider = Qgis.FieldOrigin.Provider
+                else:
+                    originProvider = QgsFields.OriginProvider
+                fields: QgsFields = speclib.fields()
+
+                providerValues = dict()
+                otherValues = dict()
+                for fid, attributes in values.items():
+                    for i, value in attributes.items():
+                        if fid >= 0 and fields.fieldOrigin(i) == originProvider:
+                            providerValues.setdefault(fid, dict())[fields.fieldOriginIndex(i)] = value
+                        else:
+                            otherValues.setdefault(fid, dict())[i] = value
+
+                if len(providerValues) > 0:
+                    success = provider.changeAttributeValues(providerValues)
+                    # the layer does not notice direct provider writes
+                    speclib.reload()
+                    speclib.dataChanged.emit()
+                    speclib.triggerRepaint()
+                values = otherValues
+
+        for fid, attributes in values.items():
+            success = speclib.changeAttributeValues(fid, attributes, oldValues.get(fid, {})) and success
+        return success
+
     @staticmethod
     def initTableConfig(speclib: QgsVectorLayer):
         """
@@ -580,7 +644,7 @@ class SpectralLibraryUtils:
 
     @staticmethod
     def canReadFromMimeData(mimeData: QMimeData) -> bool:
-        formats = [MIMEDATA_SPECLIB_LINK, MIMEDATA_SPECLIB, MIMEDATA_URL]
+        formats = [MIMEDATA_SPECLIB_LINK, MIMEDATA_SPECLIB_BINARY, MIMEDATA_SPECLIB, MIMEDATA_URL]
         for format in formats:
             if format in mimeData.formats():
                 if format == MIMEDATA_URL:
@@ -594,7 +658,12 @@ class SpectralLibraryUtils:
     @staticmethod
     def mimeData(speclib: QgsVectorLayer, formats: list = None) -> QMimeData:
         """
-        Wraps this Speclib into a QMimeData object
+        Wraps this Speclib into a QMimeData object.
+        By default, the mime data contains a link to the speclib only, which is used for drops within the
+        same process. Add MIMEDATA_SPECLIB_BINARY to the formats to support drops into other processes.
+        Note that this serializes all profiles when the mime data is created.
+        :param speclib: QgsVectorLayer
+        :param formats: list of mime data formats, defaults to [MIMEDATA_SPECLIB_LINK]
         :return: QMimeData
         """
         assert isinstance(speclib, QgsVectorLayer)
@@ -606,13 +675,16 @@ class SpectralLibraryUtils:
         mimeData = QMimeData()
 
         for format in formats:
-            assert format in [MIMEDATA_SPECLIB_LINK, MIMEDATA_SPECLIB, MIMEDATA_TEXT, MIMEDATA_URL]
+            assert format in [MIMEDATA_SPECLIB_LINK, MIMEDATA_SPECLIB_BINARY, MIMEDATA_SPECLIB, MIMEDATA_TEXT,
+                              MIMEDATA_URL]
             if format == MIMEDATA_SPECLIB_LINK:
                 global SPECLIB_CLIPBOARD
                 thisID = id(speclib)
                 SPECLIB_CLIPBOARD[thisID] = speclib
 
                 mimeData.setData(MIMEDATA_SPECLIB_LINK, pickle.dumps(thisID))
+            elif format == MIMEDATA_SPECLIB_BINARY:
+                mimeData.setData(MIMEDATA_SPECLIB_BINARY, SpectralLibraryUtils.binaryData(speclib))
             elif format == MIMEDATA_SPECLIB:
                 mimeData.setData(MIMEDATA_SPECLIB, pickle.dumps(speclib))
 
@@ -626,6 +698,190 @@ class SpectralLibraryUtils:
 
         return mimeData
 
+    @staticmethod
+    def binaryData(speclib: QgsVectorLayer, features: Iterable[QgsFeature] = None) -> QByteArray:
+        """
+        Serializes a spectral library into a compact, columnar binary format (a numpy .npz archive).
+        Numeric attributes and geometries are stored as raw arrays. Profile values are stored as one
+        array per profile field, while x values, units and bad band lists are stored once per spectral setting.
+        Use readFromBinaryData to restore the spectral library.
+        :param speclib: QgsVectorLayer
+        :param features: optional, the features to serialize. Defaults to all features of the speclib.
+        :return: QByteArray
+        """
+        assert isinstance(speclib, QgsVectorLayer)
+        if features is None:
+            features = speclib.getFeatures()
+        features = list(features)
+        n = len(features)
+        fields = speclib.fields()
+        rows = [f.attributes() for f in features]
+
+        arrays = dict()
+        columns = []
+        for i, field in enumerate(fields):
+            values = [row[i] for row in rows]
+            isNull = np.asarray([v is None or v == NULL for v in values], dtype=bool)
+            if is_profile_field(field):
+                settings = dict()
+                settingIndices = np.full(n, -1, dtype=np.int32)
+                offsets = np.zeros(n + 1, dtype=np.int64)
+                yValues = []
+                for j, value in enumerate(values):
+                    d = decodeProfileValueDict(value)
+                    y = d.get('y', [])
+                    if len(y) > 0:
+                        x, bbl = d.get('x'), d.get('bbl')
+                        key = (tuple(x) if x else None, d.get('xUnit'), d.get('yUnit'), tuple(bbl) if bbl else None)
+                        settingIndices[j] = settings.setdefault(key, len(settings))
+                        yValues.append(y)
+                    offsets[j + 1] = offsets[j] + len(y)
+                arrays[f'y{i}'] = np.fromiter(itertools.chain.from_iterable(yValues),
+                                              dtype=np.float64, count=int(offsets[-1]))
+                arrays[f'o{i}'] = offsets
+                arrays[f's{i}'] = settingIndices
+                columns.append(dict(kind='profile',
+                                    encoding=ProfileEncoding.fromInput(field).name,
+                                    settings=[dict(x=list(k[0]) if k[0] else None, xUnit=k[1], yUnit=k[2],
+                                                   bbl=list(k[3]) if k[3] else None) for k in settings.keys()]))
+            elif field.type() in [QMETATYPE_INT, QMETATYPE_UINT, QMETATYPE_LONGLONG, QMETATYPE_DOUBLE]:
+                dtype = np.float64 if field.type() == QMETATYPE_DOUBLE else np.int64
+                arrays[f'c{i}'] = np.asarray([0 if null else v for v, null in zip(values, isNull)], dtype=dtype)
+                arrays[f'n{i}'] = isNull
+                columns.append(dict(kind='array'))
+            else:
+                columns.append(dict(kind='values',
+                                    values=[None if null else SpectralLibraryUtils._jsonValue(v)
+                                            for v, null in zip(values, isNull)]))
+
+        wkbs = [bytes(f.geometry().asWkb()) if f.hasGeometry() else b'' for f in features]
+        arrays['wkb'] = np.frombuffer(b''.join(wkbs), dtype=np.uint8)
+        arrays['wkb_offsets'] = np.cumsum([0] + [len(wkb) for wkb in wkbs], dtype=np.int64)
+
+        header = dict(version=1,
+                      name=speclib.name(),
+                      crs=speclib.crs().toWkt(),
+                      wkbType=QgsWkbTypes.displayString(speclib.wkbType()),
+                      fields=qgsFields2str(fields),
+                      columns=columns)
+        arrays['header'] = np.frombuffer(json.dumps(header).encode('utf-8'), dtype=np.uint8)
+
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        return QByteArray(buffer.getvalue())
+
+    @staticmethod
+    def _jsonValue(value: Any) -> Any:
+        """
+        Converts an attribute value into a value that can be serialized with json.dumps
+        """
+        if isinstance(value, QDateTime):
+            return value.toString(Qt.ISODate)
+        elif isinstance(value, (QDate, QTime)):
+            return value.toString(Qt.ISODate)
+        elif isinstance(value, QByteArray):
+            return bytes(value.toBase64()).decode('ascii')
+        elif isinstance(value, (str, int, float, bool, list, dict)):
+            return value
+        return str(value)
+
+    @staticmethod
+    def _attributeValue(value: Any, field: QgsField) -> Any:
+        """
+        Converts a value returned by _jsonValue back into an attribute value of a field
+        """
+        if value is None:
+            return None
+        elif field.type() == QMETATYPE_QDATETIME:
+            return QDateTime.fromString(value, Qt.ISODate)
+        elif field.type() == QMETATYPE_QDATE:
+            return QDate.fromString(value, Qt.ISODate)
+        elif field.type() == QMETATYPE_QTIME:
+            return QTime.fromString(value, Qt.ISODate)
+        elif field.type() == QMETATYPE_QBYTEARRAY:
+            return QByteArray.fromBase64(value.encode('ascii'))
+        return value
+
+    @staticmethod
+    def readFromBinaryData(data: Union[QByteArray, bytes]) -> Optional[QgsVectorLayer]:
+        """
+        Reads a spectral library from binary data created with binaryData
+        :param data: QByteArray or bytes
+        :return: in-memory QgsVectorLayer or None, if the data cannot be read
+        """
+        try:
+            archive = np.load(io.BytesIO(bytes(data)), allow_pickle=False)
+            header = json.loads(archive['header'].tobytes().decode('utf-8'))
+            if not (isinstance(header, dict) and header.get('version') == 1):
+                return None
+            return SpectralLibraryUtils._readFromBinaryArchive(archive, header)
+        except (ValueError, OSError, KeyError, IndexError, TypeError, zipfile.BadZipFile):
+            # incomplete or malformed archive
+            return None
+
+    @staticmethod
+    def _readFromBinaryArchive(archive, header: dict) -> QgsVectorLayer:
+        """
+        Creates the spectral library of a binaryData archive. Raises KeyError, ValueError or IndexError
+        if the archive is incomplete.
+        """
+        fields = str2QgsFields(header['fields'])
+        n = len(archive['wkb_offsets']) - 1
+        if len(header['columns']) != fields.count():
+            raise ValueError('Number of columns does not match the number of fields')
+
+        columns = []
+        for i, (field, column) in enumerate(zip(fields, header['columns'])):
+            kind = column['kind']
+            if kind == 'profile':
+                yValues, offsets, settingIndices = archive[f'y{i}'], archive[f'o{i}'], archive[f's{i}']
+                encoding = ProfileEncoding.fromInput(field)
+                values = [None] * n
+                lengths = offsets[1:] - offsets[:-1]
+                # encode profiles with the same spectral setting and number of bands at once
+                for iSetting, setting in enumerate(column['settings']):
+                    for nb in np.unique(lengths[settingIndices == iSetting]):
+                        rows = np.where((settingIndices == iSetting) & (lengths == nb))[0]
+                        y = yValues[offsets[rows, np.newaxis] + np.arange(nb)]
+                        encoded = encodeProfileValueDicts(y.transpose(), encoding,
+                                                          x=setting['x'], xUnit=setting['xUnit'],
+                                                          yUnit=setting['yUnit'], bbl=setting['bbl'])
+                        for row, value in zip(rows.tolist(), encoded):
+                            values[row] = value
+            elif kind == 'array':
+                values = [None if null else v for v, null in zip(archive[f'c{i}'].tolist(), archive[f'n{i}'].tolist())]
+            else:
+                values = [SpectralLibraryUtils._attributeValue(v, field) for v in column['values']]
+            columns.append(values)
+
+        path = f"{header['wkbType']}?crs=epsg:{SPECLIB_EPSG_CODE}"
+        options = QgsVectorLayer.LayerOptions(loadDefaultStyle=True, readExtentFromXml=True)
+        speclib = QgsVectorLayer(path, header['name'], 'memory', options=options)
+        speclib.setCrs(QgsCoordinateReferenceSystem.fromWkt(header['crs']))
+        speclib.setCustomProperty('skipMemoryLayerCheck', 1)
+        provider = speclib.dataProvider()
+        provider.addAttributes(fields)
+        speclib.updateFields()
+        for field in fields:
+            if is_profile_field(field):
+                SpectralLibraryUtils.makeToProfileField(speclib, field.name())
+
+        wkb, wkbOffsets = archive['wkb'], archive['wkb_offsets'].tolist()
+        features = []
+        for j in range(n):
+            feature = QgsFeature(speclib.fields())
+            feature.setAttributes([values[j] for values in columns])
+            if wkbOffsets[j + 1] > wkbOffsets[j]:
+                geometry = QgsGeometry()
+                geometry.fromWkb(wkb[wkbOffsets[j]:wkbOffsets[j + 1]].tobytes())
+                feature.setGeometry(geometry)
+            features.append(feature)
+
+        for i in range(0, n, SpectralLibraryUtils.BULK_BATCH_SIZE):
+            provider.addFeatures(features[i:i + SpectralLibraryUtils.BULK_BATCH_SIZE])
+        speclib.updateExtents()
+        return speclib
+
     @staticmethod
     def addSpectralProfileField(speclib: QgsVectorLayer,
                                 name: str, comment: str = None,
@@ -659,7 +915,8 @@ class SpectralLibraryUtils:
                    copyEditorWidgetSetup: bool = True,
                    feedback: QgsProcessingFeedback = QgsProcessingFeedback()) -> List[int]:
         """
-        Adds profiles from another SpectraLibrary
+        Adds profiles from another SpectraLibrary.
+        If speclibDst is not in edit mode, profiles are appended without undo stack, see appendProfiles.
         :param speclibDst: QgsVectorLayer
         :param addMissingFields: if True (default), missing fields / attributes will be added automatically
         :param copyEditorWidgetSetup: if True (default), the editor widget setup will be copied
@@ -671,6 +928,13 @@ class SpectralLibraryUtils:
         assert is_spectral_library(speclibSrc)
         assert is_spectral_library(speclibDst)
 
+        if not speclibDst.isEditable():
+            return SpectralLibraryUtils.appendProfiles(
+                speclibDst, speclibSrc,
+                addMissingFields=addMissingFields,
+                copyEditorWidgetSetup=copyEditorWidgetSetup,
+                feedback=feedback)
+
         fids_old = sorted(speclibSrc.allFeatureIds(), key=lambda i: abs(i))
         fids_new = SpectralLibraryUtils.addProfiles(
             speclibDst,
@@ -688,10 +952,26 @@ class SpectralLibraryUtils:
                     addMissingFields: bool = False,
                     copyEditorWidgetSetup: bool = True,
                     feedback: QgsProcessingFeedback = QgsProcessingFeedback()) -> List[int]:
-
+        """
+        Adds profiles to a spectral library. If the spectral library is in edit mode, profiles are added
+        to its edit buffer and can be undone. Otherwise, they are appended to its data provider directly,
+        see appendProfiles. In this case, the layer emits dataChanged instead of featureAdded and
+        committedFeaturesAdded.
+        :param speclib: QgsVectorLayer
+        :param profiles: QgsFeature, list of QgsFeatures or QgsVectorLayer
+        :param crs: QgsCoordinateReferenceSystem of the profile geometries. Defaults to the speclib CRS.
+        :param addMissingFields: if True, missing fields / attributes will be added
+        :param copyEditorWidgetSetup: if True (default), the editor widget setup will be copied
+               for each added profile_field
+        :param feedback: QgsProcessingFeedback
+        :return: list of added feature ids
+        """
         assert isinstance(speclib, QgsVectorLayer)
-        assert speclib.isEditable(), 'SpectralLibrary "{}" is not editable. call startEditing() first'.format(
-            speclib.name())
+        if not speclib.isEditable():
+            return SpectralLibraryUtils.appendProfiles(speclib, profiles, crs=crs,
+                                                       addMissingFields=addMissingFields,
+                                                       copyEditorWidgetSetup=copyEditorWidgetSetup,
+                                                       feedback=feedback)
 
         if isinstance(profiles, QgsFeature):
             profiles = [profiles]
@@ -766,6 +1046,183 @@ class SpectralLibraryUtils:
         fids_inserted = [MAP[k].id() for k in reversed(list(MAP.keys())) if k not in keysBefore]
         return fids_inserted
 
+    @staticmethod
+    def bulkFieldMapping(srcFields: QgsFields,
+                         dstFields: QgsFields,
+                         excluded: Iterable[int] = ()) -> List[Tuple[int, int, Optional[Callable]]]:
+        """
+        Maps source fields to destination fields with the same name.
+        :param srcFields: QgsFields of the source features
+        :param dstFields: QgsFields of the destination features
+        :param excluded: indices of destination fields to be skipped, e.g. primary keys
+        :return: list of (source index, destination index, column converter or None)
+        """
+        excluded = set(excluded)
+        mapping = []
+        for iDst, dstField in enumerate(dstFields):
+            iSrc = srcFields.lookupField(dstField.name())
+            if iSrc == -1 or iDst in excluded:
+                continue
+            srcField: QgsField = srcFields.at(iSrc)
+            converter = None
+            if is_profile_field(dstField):
+                dstEncoding = ProfileEncoding.fromInput(dstField)
+                if not (is_profile_field(srcField) and ProfileEncoding.fromInput(srcField) == dstEncoding):
+                    converter = functools.partial(SpectralLibraryUtils.convertProfileColumn, encoding=dstEncoding)
+            elif srcField.type() != dstField.type():
+                converter = functools.partial(SpectralLibraryUtils.convertFieldColumn, field=QgsField(dstField))
+            mapping.append((iSrc, iDst, converter))
+        return mapping
+
+    @staticmethod
+    def convertProfileColumn(values: List[Any], encoding: Union[str, QgsField, ProfileEncoding]) -> List[Any]:
+        """
+        Converts a column of encoded spectral profiles into another profile encoding
+        :param values: list of encoded profiles
+        :param encoding: ProfileEncoding of the returned values
+        :return: list of encoded profiles
+        """
+        encoding = ProfileEncoding.fromInput(encoding)
+        return [encodeProfileValueDict(decodeProfileValueDict(v), encoding) for v in values]
+
+    @staticmethod
+    def convertFieldColumn(values: List[Any], field: QgsField) -> List[Any]:
+        """
+        Converts a column of attribute values into the data type of a field.
+        Values that cannot be converted are returned as None.
+        """
+        converted = []
+        for v in values:
+            try:
+                converted.append(field.convertCompatible(v))
+            except ValueError:
+                converted.append(None)
+        return converted
+
+    @staticmethod
+    def appendProfiles(speclib: QgsVectorLayer,
+                       profiles: Union[QgsFeature, Iterable[QgsFeature], QgsVectorLayer],
+                       crs: QgsCoordinateReferenceSystem = None,
+                       addMissingFields: bool = False,
+                       copyEditorWidgetSetup: bool = True,
+                       batchSize: int = None,
+                       feedback: QgsProcessingFeedback = QgsProcessingFeedback()) -> List[int]:
+        """
+        Appends profiles to the data provider of a spectral library that is not in edit mode, i.e.
+        without undo stack. Profiles are streamed from the input: fields are mapped once, attribute values
+        and profile encodings are converted column-wise and features are written in batches.
+        As the features are not added via the edit buffer, the layer does not emit featureAdded or
+        committedFeaturesAdded, but dataChanged once all profiles are written.
+        :param speclib: QgsVectorLayer, not in edit mode
+        :param profiles: QgsFeature, iterable of QgsFeatures or QgsVectorLayer
+        :param crs: QgsCoordinateReferenceSystem of the profile geometries. Defaults to the speclib CRS.
+        :param addMissingFields: if True, missing fields / attributes will be added
+        :param copyEditorWidgetSetup: if True (default), the editor widget setup will be copied
+               for each added profile_field
+        :param batchSize: number of features written at once. Defaults to BULK_BATCH_SIZE
+        :param feedback: QgsProcessingFeedback
+        :return: list of added feature ids
+        """
+        assert isinstance(speclib, QgsVectorLayer)
+        assert not speclib.isEditable(), \
+            f'SpectralLibrary "{speclib.name()}" is in edit mode. Use addProfiles to add profiles with undo stack.'
+        provider: QgsVectorDataProvider = speclib.dataProvider()
+        assert provider.capabilities() & QgsVectorDataProvider.AddFeatures, \
+            f'Unable to add features to SpectralLibrary "{speclib.name()}"'
+
+        if batchSize is None:
+            batchSize = SpectralLibraryUtils.BULK_BATCH_SIZE
+        assert batchSize > 0
+
+        nTotal = None
+        if isinstance(profiles, QgsFeature):
+            profiles = [profiles]
+        elif isinstance(profiles, QgsVectorLayer):
+            crs = profiles.crs()
+            nTotal = profiles.featureCount()
+            profiles = profiles.getFeatures()
+        if isinstance(profiles, (list, tuple)):
+            nTotal = len(profiles)
+        if nTotal is not None and nTotal <= 0:
+            # feature count is unknown (-1) or not known yet
+            nTotal = None
+
+        profiles = iter(profiles)
+        refProfile: QgsFeature = next(profiles, None)
+        if refProfile is None:
+            return []
+        profiles = itertools.chain([refProfile], profiles)
+
+        if addMissingFields:
+            missingFields = [QgsField(f) for f in refProfile.fields()
+                             if speclib.fields().lookupField(f.name()) == -1]
+            if len(missingFields) > 0:
+                assert provider.addAttributes(missingFields), provider.lastError()
+                speclib.updateFields()
+                if copyEditorWidgetSetup:
+                    SpectralLibraryUtils.copyEditorWidgetSetup(speclib, missingFields)
+
+        # map fields once
+        dstFields = provider.fields()
+        mapping = SpectralLibraryUtils.bulkFieldMapping(refProfile.fields(), dstFields,
+                                                        excluded=provider.pkAttributeIndexes())
+        nDst = dstFields.count()
+
+        transform = None
+        if isinstance(crs, QgsCoordinateReferenceSystem) and crs.isValid() and crs != speclib.crs():
+            transform = QgsCoordinateTransform(crs, speclib.crs(), QgsProject.instance())
+
+        t0 = datetime.datetime.now()
+        feedback.setProgressText(f'Add {nTotal} profiles' if nTotal else 'Add profiles')
+        feedback.setProgress(0)
+
+        fids_inserted = []
+        nDone = 0
+        while not feedback.isCanceled():
+            batch = list(itertools.islice(profiles, batchSize))
+            if len(batch) == 0:
+                break
+
+            rows = [f.attributes() for f in batch]
+            dstRows = [[None] * nDst for _ in batch]
+            for iSrc, iDst, converter in mapping:
+                column = [row[iSrc] for row in rows]
+                if converter:
+                    column = converter(column)
+                for dstRow, value in zip(dstRows, column):
+                    dstRow[iDst] = value
+
+            features = []
+            for profile, attributes in zip(batch, dstRows):
+                feature = QgsFeature(dstFields)
+                feature.setAttributes(attributes)
+                if profile.hasGeometry():
+                    geometry = QgsGeometry(profile.geometry())
+                    if transform:
+                        geometry.transform(transform)
+                    feature.setGeometry(geometry)
+                features.append(feature)
+
+            success, features = provider.addFeatures(features)
+            if not success:
+                feedback.reportError(f'Unable to add profiles: {provider.lastError()}')
+                break
+            fids_inserted.extend(f.id() for f in features)
+            nDone += len(batch)
+            if nTotal:
+                # feature counts of some providers are estimates
+                feedback.setProgress(min(100., 100. * nDone / nTotal))
+
+        if nDone > 0:
+            speclib.updateExtents()
+            # the provider does not notify the layer, let attribute tables and plots reload their data
+            speclib.dataChanged.emit()
+            speclib.triggerRepaint()
+
+        seconds = max((datetime.datetime.now() - t0).total_seconds(), 1e-6)
+        feedback.pushInfo(f'Added {nDone} profiles in {seconds:.2f} s ({nDone / seconds:.0f} profiles/s)')
+        return fids_inserted
+
     @staticmethod
     def setProfileValues(feature: QgsFeature, *args,
                          profileDict: dict = None,
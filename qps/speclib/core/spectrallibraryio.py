@@ -1,20 +1,27 @@
+import datetime
+import itertools
 import os
 import pathlib
 import sys
 import warnings
-from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
 
 from qgis.PyQt.QtCore import pyqtSignal, QObject, QRegExp, QUrl
 from qgis.PyQt.QtGui import QIcon, QRegExpValidator
 from qgis.PyQt.QtWidgets import QAction, QCheckBox, QComboBox, QDialog, QDialogButtonBox, QFormLayout, QLineEdit, \
     QProgressDialog, QStackedWidget, QToolButton, QWidget
-from qgis.core import QgsCoordinateReferenceSystem, QgsExpressionContext, QgsExpressionContextGenerator, \
-    QgsExpressionContextScope, QgsFeature, QgsFeatureIterator, QgsFeatureSink, QgsField, QgsFields, QgsFileUtils, \
+from qgis.core import QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsExpression, QgsExpressionContext, \
+    QgsExpressionContextGenerator, \
+    QgsExpressionContextScope, QgsFeature, QgsFeatureIterator, QgsFeatureRequest, QgsFeatureSink, QgsField, \
+    QgsFields, QgsFileUtils, \
     QgsMapLayer, QgsProcessingFeedback, QgsProject, QgsProperty, QgsProviderUtils, \
     QgsRemappingProxyFeatureSink, QgsRemappingSinkDefinition, QgsVectorLayer, QgsWkbTypes
 from qgis.gui import QgsFieldMappingWidget, QgsFileWidget
 from . import profile_field_list, profile_field_names
-from .spectralprofile import groupBySpectralProperties
+from .spectralprofile import decodeProfileValueDict, encodeProfileValueDicts, groupBySpectralProperties, \
+    ProfileEncoding
 from .. import speclibSettings, speclibUiPath
 from ...fieldvalueconverter import GenericPropertyTransformer
 from ...layerproperties import CopyAttributesDialog
@@ -169,6 +176,61 @@ class SpectralLibraryImportWidget(SpectralLibraryIOWidget):
         return settings
 
 
+class ProfileColumnEncoder(object):
+    """
+    Encodes a column of spectral profile values into the profile encoding of a destination field.
+    Profiles that share x values, units, bad band list and number of bands are encoded at once.
+    Subclasses can overwrite encodeProfiles to plug in other encodings.
+    """
+
+    def __init__(self, field: QgsField, dtype: Optional[np.dtype] = np.float32):
+        """
+        :param field: QgsField, the destination field
+        :param dtype: numpy data type the profile y values are converted to before encoding.
+                      Set None to keep the original values.
+        """
+        self.mField = QgsField(field)
+        self.mEncoding = ProfileEncoding.fromInput(field)
+        self.mDType = dtype
+
+    def field(self) -> QgsField:
+        return QgsField(self.mField)
+
+    def encode(self, values: List[Any]) -> List[Any]:
+        """
+        Encodes a list of profile values, e.g. JSON strings or dictionaries
+        :param values: list of encoded profile values
+        :return: list of profile values in the destination field encoding
+        """
+        return self.encodeProfiles([decodeProfileValueDict(v) for v in values])
+
+    def encodeProfiles(self, profiles: List[dict]) -> List[Any]:
+        """
+        Encodes a list of profile value dictionaries
+        :param profiles: list of profile value dictionaries
+        :return: list of profile values in the destination field encoding
+        """
+        results = [None] * len(profiles)
+        groups: Dict[tuple, List[int]] = dict()
+        for i, d in enumerate(profiles):
+            y = d.get('y')
+            if y is None or len(y) == 0:
+                continue
+            x, bbl = d.get('x'), d.get('bbl')
+            key = (tuple(x) if x is not None else None, d.get('xUnit'), d.get('yUnit'),
+                   tuple(bbl) if bbl is not None else None, len(y))
+            groups.setdefault(key, []).append(i)
+
+        for (x, xUnit, yUnit, bbl, nb), indices in groups.items():
+            y = np.asarray([profiles[i]['y'] for i in indices], dtype=self.mDType if self.mDType else float)
+            encoded = encodeProfileValueDicts(y.transpose(), self.mEncoding,
+                                              x=list(x) if x else None, xUnit=xUnit, yUnit=yUnit,
+                                              bbl=list(bbl) if bbl else None)
+            for i, value in zip(indices, encoded):
+                results[i] = value
+        return results
+
+
 class SpectralLibraryIO(QObject):
     """
     Abstract class interface to define I/O operations for spectral libraries
@@ -178,6 +240,10 @@ class SpectralLibraryIO(QObject):
     IMPSET_FIELDS = 'fields'
     IMPSET_REQUIRED_FIELDS = 'required_fields'
 
+    # number of features that are encoded and written at once
+    WRITER_BATCH_SIZE: int = 1024
+    READER_PAGE_SIZE: int = 1024
+
     def __init__(self, *args, **kwds):
         super().__init__(*args, **kwds)
 
@@ -248,6 +314,129 @@ class SpectralLibraryIO(QObject):
 
         return profiles, fields, crs, wkbType
 
+    @classmethod
+    def extractWriterStream(cls,
+                            input: Union[
+                                QgsFeature,
+                                QgsVectorLayer,
+                                QgsFeatureIterator,
+                                Iterable[QgsFeature]],
+                            settings: dict = dict()) -> Tuple[
+        Iterator[QgsFeature],
+        QgsFields,
+        QgsCoordinateReferenceSystem,
+        QgsWkbTypes.Type,
+        Optional[int]
+    ]:
+        """
+        Like extractWriterInfos, but returns an iterator over the input features instead of a list,
+        so that features can be written without loading all of them into memory.
+        :return: (feature iterator, fields, crs, wkbType, number of features or None, if unknown)
+        """
+        crs = None
+        wkbType = None
+        fields = None
+        nTotal = None
+        if isinstance(input, QgsFeature):
+            input = [input]
+        if isinstance(input, QgsVectorLayer):
+            crs = input.crs()
+            wkbType = input.wkbType()
+            nTotal = input.featureCount()
+            profiles = input.getFeatures()
+        elif isinstance(input, (list, tuple)):
+            nTotal = len(input)
+            profiles = input
+        elif isinstance(input, QgsFeatureIterator) or hasattr(input, '__iter__'):
+            profiles = input
+        else:
+            raise NotImplementedError()
+
+        profiles = iter(profiles)
+        first: QgsFeature = next(profiles, None)
+        if first is None:
+            nTotal = 0
+        else:
+            profiles = itertools.chain([first], profiles)
+            fields = first.fields()
+
+        if crs is None:
+            if 'crs' in settings.keys():
+                crs = QgsCoordinateReferenceSystem(settings['crs'])
+            else:
+                crs = QgsCoordinateReferenceSystem()
+        if wkbType is None:
+            if first is not None and first.geometry():
+                wkbType = first.geometry().wkbType()
+            else:
+                wkbType = settings.get('wkbType', QgsWkbTypes.NoGeometry)
+
+        return profiles, fields, crs, wkbType, nTotal
+
+    @classmethod
+    def writeFeatureBatches(cls,
+                            sink: QgsFeatureSink,
+                            profiles: Iterable[QgsFeature],
+                            encoders: Dict[int, ProfileColumnEncoder] = None,
+                            transform: QgsCoordinateTransform = None,
+                            nTotal: int = None,
+                            batchSize: int = None,
+                            feedback: QgsProcessingFeedback = QgsProcessingFeedback()) -> int:
+        """
+        Writes features into a feature sink in batches. Profile columns are encoded per batch.
+        Encodings and geometry transformations are applied to copies, the input features remain unchanged.
+        :param sink: QgsFeatureSink, e.g. a QgsVectorFileWriter
+        :param profiles: iterable of QgsFeatures
+        :param encoders: ProfileColumnEncoders for the profile fields to be encoded, keyed by field index
+        :param transform: QgsCoordinateTransform to transform the feature geometries, optional
+        :param nTotal: total number of features, used to report the progress
+        :param batchSize: number of features written at once. Defaults to WRITER_BATCH_SIZE
+        :param feedback: QgsProcessingFeedback
+        :return: number of written features
+        """
+        if encoders is None:
+            encoders = dict()
+        if batchSize is None:
+            batchSize = cls.WRITER_BATCH_SIZE
+
+        t0 = datetime.datetime.now()
+        profiles = iter(profiles)
+        nWritten = 0
+        while not feedback.isCanceled():
+            batch: List[QgsFeature] = list(itertools.islice(profiles, batchSize))
+            if len(batch) == 0:
+                break
+
+            if len(encoders) > 0 or transform:
+                # do not modify the input features
+                batch = [QgsFeature(f) for f in batch]
+
+            if len(encoders) > 0:
+                rows = [f.attributes() for f in batch]
+                for i, encoder in encoders.items():
+                    column = encoder.encode([row[i] for row in rows])
+                    for row, value in zip(rows, column):
+                        row[i] = value
+                for f, row in zip(batch, rows):
+                    f.setAttributes(row)
+
+            if transform:
+                for f in batch:
+                    if f.hasGeometry():
+                        geometry = f.geometry()
+                        geometry.transform(transform)
+                        f.setGeometry(geometry)
+
+            if not sink.addFeatures(batch):
+                raise Exception(f'Error when writing features: {sink.lastError()}')
+            nWritten += len(batch)
+            if nTotal:
+                feedback.setProgress(100. * nWritten / nTotal)
+
+        seconds = max((datetime.datetime.now() - t0).total_seconds(), 1e-6)
+        feedback.pushInfo(f'Wrote {nWritten} profiles in {seconds:.2f} s ({nWritten / seconds:.0f} profiles/s)')
+        return nWritten
+
     @staticmethod
     def registerSpectralLibraryIO(speclibIO: Union['SpectralLibraryIO', List['SpectralLibraryIO']]):
 
@@ -368,12 +557,96 @@ class SpectralLibraryIO(QObject):
         """
         raise NotImplementedError()
 
+    @classmethod
+    def iterateProfiles(cls,
+                        path: str,
+                        importSettings: Optional[dict] = None,
+                        attributes: Optional[List[str]] = None,
+                        filterExpression: Optional[str] = None,
+                        feedback: QgsProcessingFeedback = QgsProcessingFeedback()) -> Iterator[QgsFeature]:
+        """
+        Returns an iterator over the profiles of the source specified by 'path'.
+        The default implementation calls importProfiles, forwards the attribute projection as
+        IMPORT_SETTINGS_KEY_REQUIRED_SOURCE_FIELDS and evaluates the filter expression for each profile.
+        SpectralLibraryIOs that read from OGR vector sources can use iterateVectorLayerProfiles instead
+        to stream the profiles from the data provider.
+        :param path: str
+        :param importSettings: dict, optional
+        :param attributes: list of attribute names to read, optional. Defaults to all attributes.
+        :param filterExpression: str, QgsExpression to filter the profiles, optional
+        :param feedback: QgsProcessingFeedback, optional
+        :return: iterator of QgsFeatures
+        """
+        importSettings = dict(importSettings) if isinstance(importSettings, dict) else dict()
+        if attributes is not None:
+            importSettings[IMPORT_SETTINGS_KEY_REQUIRED_SOURCE_FIELDS] = list(attributes)
+
+        profiles = cls.importProfiles(path, importSettings, feedback=feedback)
+        if filterExpression in [None, '']:
+            yield from profiles
+            return
+
+        expression = QgsExpression(filterExpression)
+        if expression.hasParserError():
+            raise Exception(f'Invalid filter expression "{filterExpression}": {expression.parserErrorString()}')
+        context = QgsExpressionContext()
+        prepared = False
+        for profile in profiles:
+            context.setFeature(profile)
+            if not prepared:
+                context.setFields(profile.fields())
+                if not expression.prepare(context):
+                    raise Exception(f'Unable to prepare filter expression: {expression.evalErrorString()}')
+                prepared = True
+            if expression.evaluate(context):
+                yield profile
+
     @staticmethod
-    def readProfilesFromUri(
+    def iterateVectorLayerProfiles(path: Union[str, pathlib.Path],
+                                   attributes: Optional[List[str]] = None,
+                                   filterExpression: Optional[str] = None) -> Iterator[QgsFeature]:
+        """
+        Streams the profiles of a vector source that can be opened as QgsVectorLayer.
+        The attribute projection and filter expression are passed as QgsFeatureRequest to the data provider,
+        which skips unrequested columns and, where possible, compiles the expression into the OGR SQL query.
+        :param path: str or pathlib.Path
+        :param attributes: list of attribute names to read, optional. Defaults to all attributes.
+        :param filterExpression: str, QgsExpression to filter the profiles, optional
+        :return: iterator of QgsFeatures
+        """
+        if isinstance(path, pathlib.Path):
+            path = path.as_posix()
+        lyr = QgsVectorLayer(path)
+        if not lyr.isValid():
+            return
+        # load editor widget information on spectral profile fields
+        lyr.loadDefaultStyle()
+
+        request = QgsFeatureRequest()
+        if attributes is not None:
+            names = [n for n in attributes if n in lyr.fields().names()]
+            request.setSubsetOfAttributes(names, lyr.fields())
+        if filterExpression not in [None, '']:
+            request.setFilterExpression(filterExpression)
+        yield from lyr.getFeatures(request)
+
+    @staticmethod
+    def iterateProfilesFromUri(
             uri: Union[QUrl, str, pathlib.Path],
             importSettings: Optional[dict] = None,
-            feedback: Optional[QgsProcessingFeedback] = None) -> List[QgsFeature]:
-
+            attributes: Optional[List[str]] = None,
+            filterExpression: Optional[str] = None,
+            feedback: Optional[QgsProcessingFeedback] = None) -> Iterator[QgsFeature]:
+        """
+        Lazily reads the profiles from a source uri. Profiles are returned from the first
+        SpectralLibraryIO that matches the file extension and returns at least one profile.
+        :param uri: str, pathlib.Path or QUrl
+        :param importSettings: dict, optional
+        :param attributes: list of attribute names to read, optional. Defaults to all attributes.
+        :param filterExpression: str, QgsExpression to filter the profiles, optional
+        :param feedback: QgsProcessingFeedback, optional
+        :return: iterator of QgsFeatures
+        """
         if isinstance(uri, QUrl):
             uri = uri.toString(QUrl.PreferLocalFile | QUrl.RemoveQuery)
 
@@ -381,14 +654,13 @@ class SpectralLibraryIO(QObject):
             uri = uri.as_posix()
 
         if not isinstance(uri, str):
-            return []
+            return
 
         if importSettings is None:
             importSettings = {}
 
         if feedback is None:
             feedback = QgsProcessingFeedback()
-        # global SpectralLibraryIO
 
         ext = os.path.splitext(uri)[1]
 
@@ -401,12 +673,69 @@ class SpectralLibraryIO(QObject):
                     break
 
         for IO in matched_IOs:
-            importedProfiles = IO.importProfiles(uri, importSettings, feedback=feedback)
-            if len(importedProfiles) > 0:
-                feedback.pushInfo(f'Found {len(importedProfiles)} feature(s) in {uri}')
-                return importedProfiles
+            profiles = iter(IO.iterateProfiles(uri, importSettings,
+                                               attributes=attributes,
+                                               filterExpression=filterExpression,
+                                               feedback=feedback))
+            firstProfile = next(profiles, None)
+            if isinstance(firstProfile, QgsFeature):
+                yield firstProfile
+                yield from profiles
+                return
 
-        return []
+    @staticmethod
+    def readProfilePagesFromUri(
+            uri: Union[QUrl, str, pathlib.Path],
+            pageSize: int = None,
+            importSettings: Optional[dict] = None,
+            attributes: Optional[List[str]] = None,
+            filterExpression: Optional[str] = None,
+            feedback: Optional[QgsProcessingFeedback] = None) -> Iterator[List[QgsFeature]]:
+        """
+        Reads the profiles from a source uri page by page, e.g. to show the first
+        profiles of a large source while the others are still loaded.
+        :param uri: str, pathlib.Path or QUrl
+        :param pageSize: maximum number of profiles per page. Defaults to READER_PAGE_SIZE
+        :param importSettings: dict, optional
+        :param attributes: list of attribute names to read, optional. Defaults to all attributes.
+        :param filterExpression: str, QgsExpression to filter the profiles, optional
+        :param feedback: QgsProcessingFeedback, optional
+        :return: iterator of QgsFeature lists
+        """
+        if pageSize is None:
+            pageSize = SpectralLibraryIO.READER_PAGE_SIZE
+        assert pageSize > 0
+
+        profiles = SpectralLibraryIO.iterateProfilesFromUri(uri, importSettings,
+                                                            attributes=attributes,
+                                                            filterExpression=filterExpression,
+                                                            feedback=feedback)
+        while True:
+            page = list(itertools.islice(profiles, pageSize))
+            if len(page) == 0:
+                break
+            yield page
+            if feedback and feedback.isCanceled():
+                break
+
+    @staticmethod
+    def readProfilesFromUri(
+            uri: Union[QUrl, str, pathlib.Path],
+            importSettings: Optional[dict] = None,
+            feedback: Optional[QgsProcessingFeedback] = None,
+            attributes: Optional[List[str]] = None,
+            filterExpression: Optional[str] = None) -> List[QgsFeature]:
+
+        if feedback is None:
+            feedback = QgsProcessingFeedback()
+
+        importedProfiles = list(SpectralLibraryIO.iterateProfilesFromUri(uri, importSettings,
+                                                                         attributes=attributes,
+                                                                         filterExpression=filterExpression,
+                                                                         feedback=feedback))
+        if len(importedProfiles) > 0:
+            feedback.pushInfo(f'Found {len(importedProfiles)} feature(s) in {uri}')
+        return importedProfiles
 
     @classmethod
     def writeToSource(cls,
@@ -542,14 +871,17 @@ class SpectralLibraryIO(QObject):
         # 2. Search for suited IO options
         if not isinstance(speclib, QgsVectorLayer):
 
-            profiles = SpectralLibraryIO.readProfilesFromUri(uri)
-            if len(profiles) > 0:
+            # stream the profiles into the speclib, without keeping all of them in memory
+            profiles = SpectralLibraryIO.iterateProfilesFromUri(uri, feedback=feedback)
+            firstProfile = next(profiles, None)
+            if isinstance(firstProfile, QgsFeature):
                 from .spectrallibrary import SpectralLibraryUtils
 
                 speclib = SpectralLibraryUtils.createSpectralLibrary(profile_fields=[])
-                speclib.startEditing()
-                SpectralLibraryUtils.addProfiles(speclib, profiles, addMissingFields=True)
-                speclib.commitChanges()
+                kwds = dict(addMissingFields=True)
+                if isinstance(feedback, QgsProcessingFeedback):
+                    kwds['feedback'] = feedback
+                SpectralLibraryUtils.appendProfiles(speclib, itertools.chain([firstProfile], profiles), **kwds)
 
         return speclib
 
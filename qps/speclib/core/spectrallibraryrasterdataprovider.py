@@ -1,12 +1,15 @@
+import enum
 import math
 import re
+from collections import OrderedDict
 from typing import Any, Dict, List, Optional, Tuple, Union
 
 import numpy as np
 from qgis.core import Qgis, QgsColorRampShader, QgsCoordinateReferenceSystem, QgsDataProvider, QgsFeature, \
     QgsFeatureRequest, QgsField, QgsFields, QgsMapLayerModel, QgsMessageLog, QgsPointXY, QgsProject, \
     QgsProviderMetadata, QgsProviderRegistry, QgsRaster, QgsRasterBandStats, QgsRasterBlock, QgsRasterBlockFeedback, \
-    QgsRasterDataProvider, QgsRasterIdentifyResult, QgsRasterInterface, QgsRasterLayer, QgsRectangle, QgsVectorLayer
+    QgsRasterDataProvider, QgsRasterHistogram, QgsRasterIdentifyResult, QgsRasterInterface, QgsRasterLayer, \
+    QgsRectangle, QgsVectorLayer
 from qgis.PyQt.QtCore import NULL, QByteArray, QDateTime, QMetaType, QModelIndex, QObject, Qt, QUrl, QUrlQuery, QVariant
 from qgis.PyQt.QtGui import QColor, QIcon
 
@@ -277,6 +280,16 @@ class FieldToRasterValueConverter(QObject):
     def rasterDataArray(self) -> np.ndarray:
         return self.mRasterData
 
+    def bandData(self, bandNo: int, start: int = 0, stop: int = None) -> np.ndarray:
+        """
+        Returns the raster values of a single band for the features in range [start, stop)
+        :param bandNo: band number
+        :param start: index of first feature
+        :param stop: index after the last feature, defaults to the number of features
+        :return: 1-D np.ndarray
+        """
+        return self.rasterDataArray()[bandNo - 1, 0, start:stop]
+
     def bandCount(self) -> int:
         """
         One field, one raster band
@@ -383,6 +396,16 @@ class FieldToRasterValueConverter(QObject):
 
 
 class SpectralProfileValueConverter(FieldToRasterValueConverter):
+    """
+    Converts spectral profiles into raster values. Profiles are decoded lazily in chunks of CHUNK_SIZE
+    features, and only requested bands are kept in memory.
+    """
+    # number of profiles decoded at once
+    CHUNK_SIZE = 1024
+    # maximum size of decoded chunks in memory, in bytes
+    CHUNK_CACHE_SIZE = 64 * 2 ** 20
+    # maximum number of fully materialized bands kept in memory
+    MAX_CACHED_BANDS = 16
 
     @classmethod
     def supportsField(cls, field: QgsField) -> bool:
@@ -392,6 +415,159 @@ class SpectralProfileValueConverter(FieldToRasterValueConverter):
         assert is_profile_field(field)
         super(SpectralProfileValueConverter, self).__init__(field)
         self.mSpectralSetting: SpectralSetting = None
+        self.mFieldValues: List = []
+        self.mDataType: np.dtype = None
+        self.mChunkCache: Dict[int, np.ndarray] = OrderedDict()
+        self.mBandCache: Dict[int, np.ndarray] = OrderedDict()
+
+    def isValid(self) -> bool:
+        return isinstance(self.mSpectralSetting, SpectralSetting)
+
+    def updateRasterData(self, features: List[QgsFeature]):
+        """
+        Keeps the field values to decode them on request.
+        """
+        self.setFieldValues([f.attribute(self.mField.name()) for f in features])
+
+    def setFieldValues(self, fieldValues: List):
+        """
+        Sets the profile values to decode on request. The spectral setting is taken from the first
+        profile that can be decoded. The data type is promoted over all profiles with this setting,
+        so that e.g. float values are not truncated if the first profile contains integers.
+        Decoded values are not kept in memory.
+        :param fieldValues: list of profile values
+        """
+        self.mRasterData = None
+        self.mChunkCache.clear()
+        self.mBandCache.clear()
+        self.mSpectralSetting = self.mDataType = None
+        self.mColorTable = []
+
+        self.mFieldValues = list(fieldValues)
+        dtypes = set()
+        for v in self.mFieldValues:
+            d = self._decodeProfile(v, setting=self.mSpectralSetting)
+            if d is not None:
+                if self.mSpectralSetting is None:
+                    self.mSpectralSetting = SpectralSetting.fromDictionary(d, field_name=self.field().name())
+                dtypes.add(np.asarray(d['y']).dtype)
+
+        if len(dtypes) > 0:
+            dtype = np.result_type(*dtypes)
+            if np.issubdtype(dtype, np.integer) or np.issubdtype(dtype, np.bool_):
+                self.mDataType = np.dtype(np.int32)
+                self.mNoData = int(np.iinfo(np.int32).min)
+            else:
+                self.mDataType = dtype
+                self.mNoData = float('nan')
+
+    def _decodeProfile(self, value, setting: SpectralSetting = None) -> Optional[dict]:
+        """
+        Decodes a profile value. Returns None if it can not be decoded or does not match the spectral setting.
+        """
+        if not isinstance(value, (QByteArray, str, dict)):
+            return None
+        try:
+            d = decodeProfileValueDict(value)
+            s = SpectralSetting.fromDictionary(d, field_name=self.field().name())
+        except Exception:
+            return None
+        if not isinstance(s, SpectralSetting) or (setting is not None and s != setting):
+            return None
+        return d
+
+    def _chunk(self, chunk: int) -> np.ndarray:
+        """
+        Returns the decoded raster values of the chunk-th block of CHUNK_SIZE profiles
+        :param chunk: chunk index
+        :return: np.ndarray of shape (bands, profiles in chunk)
+        """
+        data = self.mChunkCache.get(chunk)
+        if isinstance(data, np.ndarray):
+            self.mChunkCache.move_to_end(chunk)
+            return data
+
+        i0 = chunk * self.CHUNK_SIZE
+        values = self.mFieldValues[i0:i0 + self.CHUNK_SIZE]
+        data = np.full((self.bandCount(), len(values)), self.mNoData, dtype=self.mDataType)
+        for i, v in enumerate(values):
+            d = self._decodeProfile(v, setting=self.mSpectralSetting)
+            if d is not None:
+                data[:, i] = d['y']
+
+        self.mChunkCache[chunk] = data
+        nbytes = sum(a.nbytes for a in self.mChunkCache.values())
+        while nbytes > self.CHUNK_CACHE_SIZE and len(self.mChunkCache) > 1:
+            _, dropped = self.mChunkCache.popitem(last=False)
+            nbytes -= dropped.nbytes
+        return data
+
+    def materializeBands(self, bandNos: List[int], cache: bool = True) -> Dict[int, np.ndarray]:
+        """
+        Decodes all profiles once and returns the values of the requested bands.
+        If cache is True, up to MAX_CACHED_BANDS of the most recently requested bands are kept in memory.
+        :param bandNos: list of band numbers
+        :param cache: set False to not keep the materialized bands in memory
+        :return: dict with a 1-D np.ndarray of values per band number
+        """
+        result = dict()
+        n = len(self.mFieldValues)
+        missing = []
+        for b in bandNos:
+            if b in self.mBandCache:
+                self.mBandCache.move_to_end(b)
+                result[b] = self.mBandCache[b]
+            else:
+                missing.append(b)
+
+        if len(missing) > 0:
+            bands = {b: np.empty(n, dtype=self.mDataType) for b in missing}
+            for chunk in range(int(math.ceil(n / self.CHUNK_SIZE))):
+                data = self._chunk(chunk)
+                i0 = chunk * self.CHUNK_SIZE
+                for b, array in bands.items():
+                    array[i0:i0 + data.shape[1]] = data[b - 1, :]
+            result.update(bands)
+            if cache:
+                self.mBandCache.update(bands)
+                while len(self.mBandCache) > self.MAX_CACHED_BANDS:
+                    self.mBandCache.popitem(last=False)
+        return {b: result[b] for b in bandNos}
+
+    def bandData(self, bandNo: int, start: int = 0, stop: int = None) -> np.ndarray:
+        assert 0 < bandNo <= self.bandCount()
+        n = len(self.mFieldValues)
+        start, stop, _ = slice(start, stop).indices(n)
+        stop = max(start, stop)
+
+        if bandNo in self.mBandCache:
+            self.mBandCache.move_to_end(bandNo)
+            return self.mBandCache[bandNo][start:stop]
+
+        if start == 0 and stop == n:
+            return self.materializeBands([bandNo])[bandNo]
+
+        # read partial range from (cached) chunks
+        array = np.empty(stop - start, dtype=self.mDataType)
+        if stop == start:
+            return array
+        for chunk in range(start // self.CHUNK_SIZE, (stop - 1) // self.CHUNK_SIZE + 1):
+            data = self._chunk(chunk)
+            c0 = chunk * self.CHUNK_SIZE
+            i0, i1 = max(start, c0), min(stop, c0 + data.shape[1])
+            array[i0 - start:i1 - start] = data[bandNo - 1, i0 - c0:i1 - c0]
+        return array
+
+    def rasterDataArray(self) -> np.ndarray:
+        """
+        Returns the values of all bands as array of shape (bands, 1, features).
+        This decodes all profiles and should be avoided for large spectral libraries.
+        """
+        if not self.isValid():
+            return np.ones((0, 1, len(self.mFieldValues)))
+        bandNos = list(range(1, self.bandCount() + 1))
+        bands = self.materializeBands(bandNos, cache=False)
+        return np.stack([bands[b] for b in bandNos]).reshape((len(bandNos), 1, len(self.mFieldValues)))
 
     def colorInterpretation(self, bandNo: int) -> int:
         if Qgis.versionInt() >= 32900:
@@ -409,63 +585,38 @@ class SpectralProfileValueConverter(FieldToRasterValueConverter):
             return 0
 
     def dataType(self, band: int) -> Qgis.DataType:
-        if isinstance(self.mRasterData, np.ndarray):
-            dt = numpyToQgisDataType(self.mRasterData.dtype)
-            # if dt == Qgis.DataType.Float64:
-            #    dt = Qgis.DataType.Float32
-            return dt
+        if isinstance(self.mDataType, np.dtype):
+            return numpyToQgisDataType(self.mDataType)
         else:
             return Qgis.DataType.UnknownDataType
 
     def toRasterValues(self, fieldValues: List) -> \
             Tuple[np.ndarray, List[QgsColorRampShader.ColorRampItem], Any]:
+        """
+        Decodes all profile values at once, using the same chunk-wise decoding as the lazy band access.
+        """
+        self.setFieldValues(fieldValues)
+        return self.rasterDataArray(), [], self.mNoData
 
-        # get spectral setting
-        self.mSpectralSetting = None
-
-        ns = len(fieldValues)
-        nb = 0
-        profileData: List = []
-        profileIndices: List[int] = []
-
-        for i, v in enumerate(fieldValues):
-            if isinstance(v, (QByteArray, str, dict)):
-                d = s = None
-                try:
-                    d = decodeProfileValueDict(v)
-                    s = SpectralSetting.fromDictionary(d, field_name=self.field().name())
-                except Exception as ex:
-                    _test = ""
-                if isinstance(s, SpectralSetting):
-                    if self.mSpectralSetting is None:
-                        self.mSpectralSetting = s
-                        nb = s.n_bands()
-                    if s == self.mSpectralSetting:
-                        profileData.append(d['y'])
-                        profileIndices.append(i)
-
-        profileIndices = np.asarray(profileIndices)
-
-        profileData = np.asarray(profileData).transpose().reshape(nb, 1, len(profileIndices))
-
-        uniqueValues = np.unique(profileData)
-
-        noData = None
-        no_data_candidates = self.NO_DATA_CANDIDATES[:]
-        if len(profileData) > 0:
-            no_data_candidates.append(profileData.min() - 1)
-        for c in no_data_candidates:
-            if c not in uniqueValues:
-                noData = c
-                break
 
-        if profileData.dtype == np.int64:
-            profileData = profileData.astype(np.int32)
+class FieldRasterLayout(enum.Enum):
+    """
+    Describes how the features of a VectorLayerFieldRasterDataProvider are arranged as raster pixels
+    """
+    # all features in a single raster line
+    Line = 0
+    # features in row-major order in a near-square grid
+    Grid = 1
 
-        rasterData = np.ones((nb, 1, ns), dtype=profileData.dtype) * noData
-        if len(profileIndices) > 0:
-            rasterData[:, :, profileIndices] = profileData
-        return rasterData, [], noData
+    @staticmethod
+    def fromInput(input) -> 'FieldRasterLayout':
+        if isinstance(input, FieldRasterLayout):
+            return input
+        elif isinstance(input, str):
+            for name, member in FieldRasterLayout.__members__.items():
+                if name.lower() == input.lower():
+                    return member
+        raise NotImplementedError(f'Unable to return FieldRasterLayout for "{input}"')
 
 
 class VectorLayerFieldRasterDataProvider(QgsRasterDataProvider):
@@ -474,6 +625,13 @@ class VectorLayerFieldRasterDataProvider(QgsRasterDataProvider):
     """
     PARENT = QObject()
 
+    # maximum block size advertised for grid layouts
+    BLOCK_SIZE = 256
+    # number of features read at once to calculate statistics
+    STATS_CHUNK_SIZE = 65536
+    # default number of histogram bins
+    HISTOGRAM_BINS = 256
+
     FIELD_CONVERTER: List[FieldToRasterValueConverter] = [SpectralProfileValueConverter, FieldToRasterValueConverter]
 
     @staticmethod
@@ -499,6 +657,10 @@ class VectorLayerFieldRasterDataProvider(QgsRasterDataProvider):
         self.mStatsCache = dict()
         self.mYOffset: int = 0
         self.mYOffsetManual: bool = False
+        self.mLayout: FieldRasterLayout = FieldRasterLayout.Line
+        # increases each time the active features or field change, used to key cached statistics
+        self.mRevision: int = 0
+        self.mGridShape: Tuple[int, int] = (0, 0)
         self.initWithDataSourceUri(self.dataSourceUri())
 
     def activeFeatures(self) -> List[QgsFeature]:
@@ -521,6 +683,9 @@ class VectorLayerFieldRasterDataProvider(QgsRasterDataProvider):
             layerID = re.sub(r'[{}]', '', layerID)
             layer = QgsProject.instance().mapLayer(layerID)
 
+        if query.hasQueryItem('layout'):
+            self.setLayout(query.queryItemValue('layout'))
+
         if isinstance(layer, QgsVectorLayer):
             if query.hasQueryItem('cachesize'):
                 cs = int(query.queryItemValue('cachesize'))
@@ -583,20 +748,116 @@ class VectorLayerFieldRasterDataProvider(QgsRasterDataProvider):
 
         converter = self.fieldConverter()
         if isinstance(converter, FieldToRasterValueConverter):
-            x0, x1 = round(intersectExtent.xMinimum()), round(intersectExtent.xMaximum())
-            # y0, y1 = round(intersectExtent.yMinimum()), round(intersectExtent.yMaximum())
-            # import scipy.interpolate as interp
-            band_slice = converter.rasterDataArray()[bandNo - 1, 0:1, int(x0):int(x1)]
+            # nearest neighbour pixel of each buffer pixel center. Pixel size is 1 x 1 map unit
+            xres = reqExtent.width() / bufferWidthPix
+            yres = reqExtent.height() / bufferHeightPix
+            cols = np.floor(reqExtent.xMinimum() - fullExtent.xMinimum()
+                            + (np.arange(bufferWidthPix) + 0.5) * xres).astype(int)
+            rows = np.floor(fullExtent.yMaximum() - reqExtent.yMaximum()
+                            + (np.arange(bufferHeightPix) + 0.5) * yres).astype(int)
+            indices, valid = self._pixelIndices(rows, cols)
+
+            dtype = qgisToNumpyDataType(self.dataType(bandNo))
+            band_data = np.full((bufferHeightPix, bufferWidthPix), self.sourceNoDataValue(bandNo), dtype=dtype)
+            if np.any(valid):
+                # request the covered feature range only
+                i0, i1 = indices[valid].min(), indices[valid].max() + 1
+                values = converter.bandData(bandNo, int(i0), int(i1))
+                band_data[valid] = values[indices[valid] - i0]
+            block.setData(band_data.tobytes())
 
-            band_data = nn_resample(band_slice, (bufferHeightPix, bufferWidthPix))
+        return True
 
-            # print(f'# Extents:\nF={fullExtent}\nR={reqExtent}
-            # \nI={intersectExtent}\n w={bufferWidthPix} h={bufferHeightPix}')
+    def _pixelIndices(self, rows: np.ndarray, cols: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the feature indices of pixel positions and a mask of pixels that refer to a feature
+        :param rows: array of row indices
+        :param cols: array of column indices
+        :return: (indices, valid), arrays of shape (len(rows), len(cols))
+        """
+        nx, ny = self.xSize(), self.ySize()
+        indices = rows[:, None] * nx + cols[None, :]
+        valid = ((rows >= 0) & (rows < ny))[:, None] & ((cols >= 0) & (cols < nx))[None, :] \
+            & (indices < len(self.mFeatures))
+        return indices, valid
 
-            # print(f'# band_data: {band_data.shape} {band_data.min()} to {band_data.max()}')
-            block.setData(band_data.tobytes())
+    def bandValues(self, bandNo: int) -> np.ndarray:
+        """
+        Returns the values of a band as 1-D array with one value per active feature
+        :param bandNo: band number
+        :return: np.ndarray
+        """
+        return self.fieldConverter().bandData(bandNo)
 
-        return True
+    def bandArray(self, bandNo: int) -> np.ndarray:
+        """
+        Returns the values of a band as 2-D array of shape (ySize, xSize), arranged in the current layout.
+        Pixels without feature are set to the no-data value.
+        :param bandNo: band number
+        :return: np.ndarray
+        """
+        values = self.bandValues(bandNo)
+        array = np.full(self.xSize() * self.ySize(), self.sourceNoDataValue(bandNo), dtype=values.dtype)
+        array[0:len(values)] = values
+        return array.reshape((self.ySize(), self.xSize()))
+
+    def fidArray(self) -> np.ndarray:
+        """
+        Returns the feature ids of each raster pixel as 2-D array of shape (ySize, xSize).
+        Pixels without feature are set to -1.
+        :return: np.ndarray
+        """
+        array = np.full(self.xSize() * self.ySize(), -1, dtype=np.int64)
+        array[0:len(self.mFeatures)] = self.activeFeatureIds()
+        return array.reshape((self.ySize(), self.xSize()))
+
+    def pixelFeatureIndex(self, point: QgsPointXY) -> int:
+        """
+        Returns the index of the active feature that is shown at a map position, or -1
+        :param point: QgsPointXY
+        :return: int
+        """
+        col = int(math.floor(point.x() - self.extent().xMinimum()))
+        row = int(math.floor(self.extent().yMaximum() - point.y()))
+        indices, valid = self._pixelIndices(np.asarray([row]), np.asarray([col]))
+        return int(indices[0, 0]) if valid[0, 0] else -1
+
+    def setLayout(self, layout: Union[str, FieldRasterLayout]):
+        """
+        Sets how the active features are arranged as raster pixels
+        :param layout: FieldRasterLayout or its name
+        """
+        layout = FieldRasterLayout.fromInput(layout)
+        if layout != self.mLayout:
+            self.mLayout = layout
+            self._updateGridShape()
+            self.mRevision += 1
+            self.mStatsCache.clear()
+            self.fullExtentCalculated.emit()
+            self.dataChanged.emit()
+
+    def layout(self) -> FieldRasterLayout:
+        return self.mLayout
+
+    def _updateGridShape(self):
+        n = len(self.mFeatures)
+        if n == 0:
+            self.mGridShape = (0, 0)
+        elif self.mLayout == FieldRasterLayout.Grid:
+            nx = int(math.ceil(math.sqrt(n)))
+            self.mGridShape = (int(math.ceil(n / nx)), nx)
+        else:
+            self.mGridShape = (1, n)
+
+    def xBlockSize(self) -> int:
+        if self.mLayout == FieldRasterLayout.Grid:
+            return min(self.xSize(), self.BLOCK_SIZE)
+        return self.xSize()
+
+    def yBlockSize(self) -> int:
+        if self.mLayout == FieldRasterLayout.Grid:
+            return min(self.ySize(), self.BLOCK_SIZE)
+        return self.ySize()
 
     def fieldValues(self) -> list:
         return [f.attribute(self.activeField().name()) for f in self.activeFeatures()]
@@ -614,12 +875,74 @@ class VectorLayerFieldRasterDataProvider(QgsRasterDataProvider):
                       extent: QgsRectangle = ...,
                       sampleSize: int = ...,
                       feedback: Optional['QgsRasterBlockFeedback'] = ...) -> bool:
-        return True
-        # statsKey = self._statsKey(bandNo, stats, extent, sampleSize)
-        # return statsKey in self.mStatsCache.keys()
+        return self._statsKey(bandNo, extent, sampleSize) in self.mStatsCache
 
-    def _statsKey(self, bandNo, stats, extent, sampleSize):
-        return (bandNo, stats, HashableRectangle(extent))
+    def _statsExtent(self, extent: QgsRectangle) -> QgsRectangle:
+        if isinstance(extent, QgsRectangle) and not extent.isEmpty():
+            return extent.intersect(self.extent())
+        return self.extent()
+
+    def _statsKey(self, bandNo: int, extent: QgsRectangle, sampleSize: int, *args) -> tuple:
+        if not isinstance(sampleSize, int) or sampleSize < 0:
+            sampleSize = 0
+        return (bandNo, HashableRectangle(self._statsExtent(extent)), sampleSize, self.mRevision) + args
+
+    def _extentIndices(self, extent: QgsRectangle) -> np.ndarray:
+        """
+        Returns the indices of features whose pixel centers are within an extent
+        :param extent: QgsRectangle
+        :return: sorted 1-D np.ndarray of feature indices
+        """
+        full = self.extent()
+        cols = np.arange(int(math.floor(extent.xMinimum() - full.xMinimum())),
+                         int(math.ceil(extent.xMaximum() - full.xMinimum())))
+        rows = np.arange(int(math.floor(full.yMaximum() - extent.yMaximum())),
+                         int(math.ceil(full.yMaximum() - extent.yMinimum())))
+        indices, valid = self._pixelIndices(rows, cols)
+        return indices[valid]
+
+    def _validValueChunks(self,
+                          bandNo: int,
+                          extent: QgsRectangle,
+                          sampleSize: int = 0,
+                          feedback: Optional[QgsRasterBlockFeedback] = None):
+        """
+        Iterates over the valid (finite, not no-data) values of a band in chunks of STATS_CHUNK_SIZE features.
+        If sampleSize > 0, the values are streamed through a reservoir and a single sample chunk
+        of max. sampleSize values is returned.
+        :return: generator of 1-D float64 np.ndarrays
+        """
+        indices = self._extentIndices(self._statsExtent(extent))
+        converter = self.fieldConverter()
+        noData = self.sourceNoDataValue(bandNo)
+        sampling = isinstance(sampleSize, int) and 0 < sampleSize < len(indices)
+
+        # reservoir sampling with random priorities, keeping the values with the lowest keys
+        rng = np.random.default_rng(0)
+        reservoir = np.empty(0, dtype=np.float64)
+        reservoirKeys = np.empty(0, dtype=np.float64)
+
+        for i in range(0, len(indices), self.STATS_CHUNK_SIZE):
+            if isinstance(feedback, QgsRasterBlockFeedback) and feedback.isCanceled():
+                break
+            chunk = indices[i:i + self.STATS_CHUNK_SIZE]
+            i0 = int(chunk[0])
+            values = converter.bandData(bandNo, i0, int(chunk[-1]) + 1)[chunk - i0].astype(np.float64)
+            values = values[np.isfinite(values)]
+            if noData is not None and np.isfinite(noData):
+                values = values[values != noData]
+
+            if sampling:
+                reservoir = np.concatenate([reservoir, values])
+                reservoirKeys = np.concatenate([reservoirKeys, rng.random(len(values))])
+                if len(reservoir) > sampleSize:
+                    keep = np.argpartition(reservoirKeys, sampleSize)[0:sampleSize]
+                    reservoir, reservoirKeys = reservoir[keep], reservoirKeys[keep]
+            elif len(values) > 0:
+                yield values
+
+        if sampling and len(reservoir) > 0:
+            yield reservoir
 
     def bandStatistics(self,
                        bandNo: int,
@@ -628,41 +951,108 @@ class VectorLayerFieldRasterDataProvider(QgsRasterDataProvider):
                        sampleSize: int = ...,
                        feedback: Optional['QgsRasterBlockFeedback'] = ...) -> 'QgsRasterBandStats':
 
-        statsKey = self._statsKey(bandNo, stats, extent, sampleSize)
-        if statsKey in self.mStatsCache.keys():
+        statsKey = self._statsKey(bandNo, extent, sampleSize)
+        if statsKey in self.mStatsCache:
             return self.mStatsCache[statsKey]
-        print('# statistics')
-        if extent is None:
-            extent = QgsRectangle()
-        else:
-            extent = QgsRectangle(extent)
 
+        extent = self._statsExtent(extent)
         stats = QgsRasterBandStats()
-        if self.hasFieldConverter():
-            band_data: np.ndarray = self.fieldConverter().rasterDataArray()[bandNo - 1, :, :]
+        stats.bandNumber = bandNo
+        stats.extent = extent
+        stats.width = int(math.ceil(extent.width()))
+        stats.height = int(math.ceil(extent.height()))
 
-            stats.sum = np.nansum(band_data)
-            stats.minimumValue = np.nanmin(band_data)
-            stats.maximumValue = np.nanmax(band_data)
-            stats.mean = np.nanmean(band_data)
-            stats.extent = extent
-            stats.elementCount = len(band_data)
-            stats.height = band_data.shape[-2]
-            stats.width = band_data.shape[-1]
+        if self.hasFieldConverter():
+            # one pass over all chunks, merging count, mean and sum of squared deviations (Chan et al.)
+            n = 0
+            mean = m2 = total = 0.0
+            vMin, vMax = math.inf, -math.inf
+            for values in self._validValueChunks(bandNo, extent, statsKey[2], feedback):
+                nb = len(values)
+                meanB = values.mean()
+                delta = meanB - mean
+                m2 += ((values - meanB) ** 2).sum() + delta ** 2 * n * nb / (n + nb)
+                mean += delta * nb / (n + nb)
+                n += nb
+                total += values.sum()
+                vMin = min(vMin, values.min())
+                vMax = max(vMax, values.max())
+
+            stats.elementCount = n
+            if n > 0:
+                stats.sum = total
+                stats.minimumValue = vMin
+                stats.maximumValue = vMax
+                stats.range = vMax - vMin
+                stats.mean = mean
+                stats.sumOfSquares = m2
+                stats.stdDev = math.sqrt(m2 / n)
 
             statsGathered = QGIS_RASTERBANDSTATISTIC.Sum | \
                             QGIS_RASTERBANDSTATISTIC.Min | \
                             QGIS_RASTERBANDSTATISTIC.Max | \
-                            QGIS_RASTERBANDSTATISTIC.Mean
+                            QGIS_RASTERBANDSTATISTIC.Range | \
+                            QGIS_RASTERBANDSTATISTIC.Mean | \
+                            QGIS_RASTERBANDSTATISTIC.StdDev | \
+                            QGIS_RASTERBANDSTATISTIC.SumOfSquares
 
             if Qgis.versionInt() >= 33600:
                 stats.statsGathered = Qgis.RasterBandStatistics(statsGathered)
             else:
                 stats.statsGathered = QgsRasterBandStats.Stats(statsGathered)
 
-            self.mStatsCache[statsKey] = stats
+            if not (isinstance(feedback, QgsRasterBlockFeedback) and feedback.isCanceled()):
+                self.mStatsCache[statsKey] = stats
         return stats
 
+    def histogram(self,
+                  bandNo: int,
+                  binCount: int = 0,
+                  minimum: float = math.nan,
+                  maximum: float = math.nan,
+                  extent: QgsRectangle = QgsRectangle(),
+                  sampleSize: int = 0,
+                  includeOutOfRange: bool = False,
+                  feedback: Optional[QgsRasterBlockFeedback] = None) -> QgsRasterHistogram:
+
+        if not isinstance(binCount, int) or binCount <= 0:
+            binCount = self.HISTOGRAM_BINS
+        if not (isinstance(minimum, (int, float)) and math.isfinite(minimum)
+                and isinstance(maximum, (int, float)) and math.isfinite(maximum)):
+            stats = self.bandStatistics(bandNo, QGIS_RASTERBANDSTATISTIC.All, extent, sampleSize, feedback)
+            minimum = stats.minimumValue if not math.isfinite(minimum) else minimum
+            maximum = stats.maximumValue if not math.isfinite(maximum) else maximum
+
+        key = self._statsKey(bandNo, extent, sampleSize, 'histogram', binCount, minimum, maximum,
+                             includeOutOfRange)
+        if key in self.mStatsCache:
+            return self.mStatsCache[key]
+
+        extent = self._statsExtent(extent)
+        histogram = QgsRasterHistogram()
+        histogram.bandNumber = bandNo
+        histogram.binCount = binCount
+        histogram.minimum = minimum
+        histogram.maximum = maximum
+        histogram.extent = extent
+        histogram.sampleSize = key[2]
+        histogram.includeOutOfRange = includeOutOfRange
+        histogram.width = int(math.ceil(extent.width()))
+        histogram.height = int(math.ceil(extent.height()))
+
+        counts = np.zeros(binCount, dtype=np.int64)
+        if self.hasFieldConverter() and math.isfinite(minimum) and math.isfinite(maximum):
+            for values in self._validValueChunks(bandNo, extent, key[2], feedback):
+                if includeOutOfRange:
+                    values = np.clip(values, minimum, maximum)
+                counts += np.histogram(values, bins=binCount, range=(minimum, maximum))[0]
+        histogram.histogramVector = counts.tolist()
+        histogram.nonNullCount = int(counts.sum())
+        histogram.valid = True
+        if not (isinstance(feedback, QgsRasterBlockFeedback) and feedback.isCanceled()):
+            self.mStatsCache[key] = histogram
+        return histogram
+
     def hasFieldConverter(self) -> bool:
         return isinstance(self.mFieldConverter, FieldToRasterValueConverter)
 
@@ -707,6 +1097,7 @@ class VectorLayerFieldRasterDataProvider(QgsRasterDataProvider):
             if fields.count() > 0:
                 self.mYOffset = fields.lookupField(self.mField.name())
 
+        self.mRevision += 1
         self.mStatsCache.clear()
 
     def setExtentYOffset(self, offset: int):
@@ -727,6 +1118,7 @@ class VectorLayerFieldRasterDataProvider(QgsRasterDataProvider):
         assert isinstance(features, list)
         self.mFeatures.clear()
         self.mFeatures.extend(features)
+        self._updateGridShape()
 
         if isinstance(field, (QgsField, FieldToRasterValueConverter)):
             self.setActiveField(field)
@@ -734,6 +1126,7 @@ class VectorLayerFieldRasterDataProvider(QgsRasterDataProvider):
         if self.fieldConverter():
             self.fieldConverter().updateRasterData(self.activeFeatures())
 
+        self.mRevision += 1
         self.mStatsCache.clear()
         self.fullExtentCalculated.emit()
         self.dataChanged.emit()
@@ -787,13 +1180,10 @@ class VectorLayerFieldRasterDataProvider(QgsRasterDataProvider):
             return 0
 
     def xSize(self) -> int:
-        return len(self.mFeatures)
+        return self.mGridShape[1]
 
     def ySize(self) -> int:
-        if len(self.mFeatures) > 0:
-            return 1
-        else:
-            return 0
+        return self.mGridShape[0]
 
     def capabilities(self):
 
@@ -850,6 +1240,7 @@ class VectorLayerFieldRasterDataProvider(QgsRasterDataProvider):
 
         dp.setActiveFeatures(self.activeFeatures())
         dp.setActiveField(self.activeField())
+        dp.setLayout(self.layout())
         dp.setParent(VectorLayerFieldRasterDataProvider.PARENT)
         # print(f'#CLONE  {self.extent()}  ->  {dp.extent()}')
         # self._refs_.append(dp)
@@ -866,15 +1257,14 @@ class VectorLayerFieldRasterDataProvider(QgsRasterDataProvider):
 
         results = dict()
 
-        x = int(point.x())
-        array = self.fieldConverter().rasterDataArray()
+        i = self.pixelFeatureIndex(point)
 
         r = None
         if format == QgsRaster.IdentifyFormatValue:
 
-            if 0 <= x < array.shape[-1]:
+            if i >= 0:
                 for b in range(self.bandCount()):
-                    results[b + 1] = float(array[b, 0, x])
+                    results[b + 1] = float(self.fieldConverter().bandData(b + 1, i, i + 1)[0])
         elif format in [QgsRaster.IdentifyFormatHtml, QgsRaster.IdentifyFormatText]:
             results[0] = 'Dummy HTML / Text'
 
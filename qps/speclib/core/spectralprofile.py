@@ -267,6 +267,53 @@ def encodeProfileValueDict(d: dict,
         return json.dumps(d2, ensure_ascii=False, allow_nan=False)
 
 
+def encodeProfileValueDicts(y: np.ndarray,
+                            encoding: Union[str, QgsField, ProfileEncoding],
+                            x: Union[np.ndarray, List[Any], Tuple] = None,
+                            xUnit: str = None,
+                            yUnit: str = None,
+                            bbl: Union[np.ndarray, List[Any], Tuple] = None) -> List[Any]:
+    """
+    Encodes multiple profiles that share the same x values, units and bad band list.
+    Returns the same values as calling `encodeProfileValueDict(prepareProfileValueDict(...), encoding)`
+    for each profile, but prepares the shared values only once.
+    :param y: array of shape (bands, profiles), i.e. one profile per column
+    :param encoding: QgsField | ProfileEncoding
+    :return: list with one encoded value per profile
+    """
+    y = np.asarray(y)
+    assert y.ndim == 2
+    encoding = ProfileEncoding.fromInput(encoding)
+
+    # shared values, in the same order as in EMPTY_PROFILE_VALUES
+    shared = prepareProfileValueDict(x=x, y=np.zeros(y.shape[0]), xUnit=xUnit, yUnit=yUnit, bbl=bbl)
+    shared = {k: v for k, v in encodeProfileValueDict(shared, ProfileEncoding.Dict).items() if k != 'y'}
+
+    profiles = y.transpose()
+    if encoding == ProfileEncoding.Dict:
+        return [dict(y=row, **shared) for row in profiles.tolist()]
+
+    for k in ['x', 'bbl']:
+        if k in shared:
+            shared[k] = [nanToNone(v) for v in shared[k]]
+
+    if np.issubdtype(profiles.dtype, np.floating) and not np.all(np.isfinite(profiles)):
+        values = profiles.astype(object)
+        values[~np.isfinite(profiles)] = None
+        rows = values.tolist()
+    else:
+        rows = profiles.tolist()
+
+    if encoding in [ProfileEncoding.Bytes, ProfileEncoding.Binary]:
+        return [QJsonDocument.fromVariant(dict(y=row, **shared)).toBinaryData() for row in rows]
+
+    # encoding = TEXT, y is the first key
+    suffix = json.dumps(shared, ensure_ascii=False, allow_nan=False)[1:-1]
+    if suffix != '':
+        suffix = ', ' + suffix
+    return ['{"y": ' + json.dumps(row, allow_nan=False) + suffix + '}' for row in rows]
+
+
 def decodeProfileValueDict(dump: Union[QByteArray, str, dict], numpy_arrays: bool = False) -> dict:
     """
     Converts a text / json / pickle / bytes representation of a SpectralProfile into a dictionary.
@@ -1,6 +1,7 @@
 import datetime
 import math
 import re
+from collections import OrderedDict
 from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
 
 import numpy as np
@@ -86,6 +87,9 @@ class SpectralProfilePlotModel(QStandardItemModel):
         self.mStartedCommitEditWrapper: bool = False
 
         self.mCACHE_PROFILE_DATA = dict()
+        # x values converted into another x unit, keyed by the spectral setting's x values and units
+        self.mCACHE_X_AXES: Dict[tuple, Optional[np.ndarray]] = OrderedDict()
+        self.mCACHE_X_AXES_REVISION: int = -1
         self.mEnableCaching: bool = False
         self.mProfileFieldModel: SpectralProfileFieldListModel = SpectralProfileFieldListModel()
 
@@ -720,6 +724,51 @@ class SpectralProfilePlotModel(QStandardItemModel):
         mimeData = PropertyItemGroup.toMimeData(groups)
         return mimeData
 
+    MAX_CACHED_X_AXES = 256
+
+    def convertXAxis(self, x: Union[list, np.ndarray], xUnitSrc: str, xUnit: str) -> Optional[np.ndarray]:
+        """
+        Converts x values from xUnitSrc into xUnit and caches the result.
+        As most profiles of a spectral library share the same x values, i.e. the same spectral setting,
+        each x axis needs to be converted only once.
+        :param x: x values
+        :param xUnitSrc: str, unit of the x values
+        :param xUnit: str, unit to convert the x values into
+        :return: read-only numpy.ndarray | None, if the conversion is not possible
+        """
+        # conversion functions added with addConvertFunc may change the results
+        revision = self.mUnitConverterFunctionModel.revision()
+        if revision != self.mCACHE_X_AXES_REVISION:
+            self.mCACHE_X_AXES.clear()
+            self.mCACHE_X_AXES_REVISION = revision
+
+        if isinstance(x, np.ndarray):
+            key = (xUnitSrc, xUnit, x.dtype.str, x.tobytes())
+        else:
+            key = (xUnitSrc, xUnit, tuple(x))
+
+        cache = self.mCACHE_X_AXES
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+
+        func = self.mUnitConverterFunctionModel.convertFunction(xUnitSrc, xUnit)
+        x = func(x)
+        if x is not None and len(x) > 0:
+            # convert date units to float values with decimal year and second precision to make them plotable
+            if isinstance(x[0], (datetime.datetime, datetime.date, datetime.time, np.datetime64)):
+                x = convertDateUnit(datetime64(x), 'DecimalYear')
+            x = np.array(x)
+            if np.issubdtype(x.dtype, np.number):
+                # cached x values are shared between profiles
+                x.setflags(write=False)
+            else:
+                x = None
+        cache[key] = x
+        while len(cache) > self.MAX_CACHED_X_AXES:
+            cache.popitem(last=False)
+        return x
+
     def profileDataToXUnit(self, profileData: dict, xUnit: str) -> dict:
         """
         Converts the x values from plotData.get('xUnit') to xUnit.
@@ -733,22 +782,16 @@ class SpectralProfilePlotModel(QStandardItemModel):
         if profileData.get('xUnit', None) == xUnit:
             return profileData
 
-        func = self.mUnitConverterFunctionModel.convertFunction(profileData.get('xUnit', None), xUnit)
-        x = func(profileData['x'])
+        x = self.convertXAxis(profileData['x'], profileData.get('xUnit', None), xUnit)
         y = profileData['y']
         if x is None or len(x) == 0 or len(x) != len(y):
             return None
         else:
-            # convert date units to float values with decimal year and second precision to make them plotable
-            if isinstance(x[0], (datetime.datetime, datetime.date, datetime.time, np.datetime64)):
-                x = convertDateUnit(datetime64(x), 'DecimalYear')
-
             if isinstance(y[0], (datetime.datetime, datetime.date, datetime.time, np.datetime64)):
                 y = convertDateUnit(datetime64(y), 'DecimalYear')
 
-            x = np.asarray(x)
             y = np.asarray(y)
-            if not (np.issubdtype(x.dtype, np.number) and np.issubdtype(y.dtype, np.number)):
+            if not np.issubdtype(y.dtype, np.number):
                 return None
 
             profileData['x'] = x
@@ -863,6 +906,7 @@ class SpectralProfilePlotModel(QStandardItemModel):
         speclib.beforeCommitChanges.connect(self.onSpeclibBeforeCommitChanges)
         speclib.afterCommitChanges.connect(self.onSpeclibAfterCommitChanges)
         speclib.committedFeaturesAdded.connect(self.onSpeclibCommittedFeaturesAdded)
+        speclib.dataChanged.connect(self.onSpeclibDataChanged)
         speclib.featuresDeleted.connect(self.onSpeclibFeaturesDeleted)
         speclib.selectionChanged.connect(self.onSpeclibSelectionChanged)
         speclib.styleChanged.connect(self.onSpeclibStyleChanged)
@@ -876,6 +920,7 @@ class SpectralProfilePlotModel(QStandardItemModel):
         speclib.beforeCommitChanges.disconnect(self.onSpeclibBeforeCommitChanges)
         # self.mSpeclib.afterCommitChanges.disconnect(self.onSpeclibAfterCommitChanges)
         speclib.committedFeaturesAdded.disconnect(self.onSpeclibCommittedFeaturesAdded)
+        speclib.dataChanged.disconnect(self.onSpeclibDataChanged)
 
         speclib.featuresDeleted.disconnect(self.onSpeclibFeaturesDeleted)
         speclib.selectionChanged.disconnect(self.onSpeclibSelectionChanged)
@@ -934,6 +979,13 @@ class SpectralProfilePlotModel(QStandardItemModel):
 
         self.updatePlot(fids_to_update=OLD2NEW.values())
 
+    def onSpeclibDataChanged(self):
+        # changes outside the edit buffer, e.g. profiles appended to the data provider
+        if self.speclib().isEditable():
+            return
+        self.mCACHE_PROFILE_DATA.clear()
+        self.updatePlot()
+
     def onSpeclibStyleChanged(self, *args):
         # self.loadFeatureColors()
         b = False
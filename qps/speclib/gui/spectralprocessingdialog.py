@@ -2,16 +2,19 @@ import datetime
 import json
 import os
 import pathlib
+import uuid
 from difflib import SequenceMatcher
 from json import JSONDecodeError
 from typing import Any, Dict, List, Optional, Tuple, Union
 
+import numpy as np
+from osgeo import gdal, gdal_array
 from processing import createContext
 from processing.gui.AlgorithmDialogBase import AlgorithmDialogBase
 from processing.gui.wrappers import WidgetWrapper, WidgetWrapperFactory
 from qgis.core import Qgis, QgsApplication, QgsEditorWidgetSetup, QgsFeature, QgsField, QgsFields, QgsMapLayer, \
     QgsMapLayerModel, QgsPalettedRasterRenderer, QgsProcessing, QgsProcessingAlgorithm, QgsProcessingContext, \
-    QgsProcessingFeedback, QgsProcessingModelAlgorithm, QgsProcessingOutputDefinition, \
+    QgsProcessingFeedback, QgsProcessingModelAlgorithm, QgsProcessingMultiStepFeedback, QgsProcessingOutputDefinition, \
     QgsProcessingOutputLayerDefinition, QgsProcessingOutputRasterLayer, QgsProcessingOutputVectorLayer, \
     QgsProcessingParameterDefinition, QgsProcessingParameterMultipleLayers, QgsProcessingParameterRasterDestination, \
     QgsProcessingParameterRasterLayer, QgsProcessingRegistry, QgsProcessingUtils, QgsProject, QgsRasterBlockFeedback, \
@@ -28,14 +31,14 @@ from qgis.PyQt.QtWidgets import QCheckBox, QComboBox, QDialog, QGridLayout, QLab
 from .. import EDITOR_WIDGET_REGISTRY_KEY, speclibSettings
 from ..core import can_store_spectral_profiles, is_profile_field
 from ..core.spectrallibrary import SpectralLibraryUtils
-from ..core.spectrallibraryrasterdataprovider import createRasterLayers, FieldToRasterValueConverter, \
-    SpectralProfileValueConverter, VectorLayerFieldRasterDataProvider
-from ..core.spectralprofile import encodeProfileValueDict, prepareProfileValueDict, ProfileEncoding
+from ..core.spectrallibraryrasterdataprovider import createRasterLayers, FieldRasterLayout, \
+    FieldToRasterValueConverter, SpectralProfileValueConverter, VectorLayerFieldRasterDataProvider
+from ..core.spectralprofile import encodeProfileValueDicts, ProfileEncoding, SpectralSetting
 from ..gui.spectralprofilefieldcombobox import SpectralProfileFieldComboBox
 from ...processing.processingalgorithmdialog import ProcessingAlgorithmDialog
 from ...qgisenums import QMETATYPE_QSTRING
 from ...qgsrasterlayerproperties import QgsRasterLayerSpectralProperties
-from ...utils import iconForFieldType, numpyToQgisDataType, qgsRasterLayer, rasterArray
+from ...utils import check_vsimem, iconForFieldType, numpyToQgisDataType, qgsRasterLayer, rasterArray
 
 LUT_RASTERFILEWRITER_ERRORS: Dict[int, str] = {
     QgsRasterFileWriter.WriterError.SourceProviderError: 'SourceProviderError',
@@ -72,6 +75,36 @@ def has_raster_io(alg: QgsProcessingAlgorithm) -> bool:
     return has_raster_input(alg) and has_raster_output(alg)
 
 
+# processing providers that run algorithms in external processes, which can not access GDAL /vsimem/ files
+EXTERNAL_PROCESS_PROVIDERS = ['gdal', 'grass', 'grass7', 'grassprovider', 'otb', 'saga', 'sagang', 'r', 'wbt']
+
+_VSIMEM_AVAILABLE: Optional[bool] = None
+
+
+def requires_file_paths(alg: QgsProcessingAlgorithm) -> bool:
+    """
+    Returns True if the algorithm, or one of its child algorithms, needs input / output rasters
+    as real files, e.g. because they are read by an external process.
+    """
+    global _VSIMEM_AVAILABLE
+    if _VSIMEM_AVAILABLE is None:
+        _VSIMEM_AVAILABLE = check_vsimem()
+    if not _VSIMEM_AVAILABLE:
+        return True
+
+    algs = [alg]
+    while len(algs) > 0:
+        a = algs.pop(0)
+        if isinstance(a, QgsProcessingModelAlgorithm):
+            for child in a.childAlgorithms().values():
+                algs.append(child.algorithm())
+        elif isinstance(a, QgsProcessingAlgorithm):
+            provider = a.provider()
+            if provider is not None and provider.id() in EXTERNAL_PROCESS_PROVIDERS:
+                return True
+    return False
+
+
 class SpectralProcessingAppliers(QObject):
 
     def __init__(self):
@@ -585,6 +618,9 @@ class SpectralProcessingDialog(QgsProcessingAlgorithmDialogBase):
 
     sigOutputsCreated = pyqtSignal(dict)
 
+    # maximum number of features arranged in a single raster line. More features are arranged in a grid
+    MAX_LINE_LENGTH: int = 16384
+
     def __init__(self, *args,
                  speclib: Optional[QgsVectorLayer] = None,
                  algorithmId: Optional[str] = None,
@@ -601,6 +637,10 @@ class SpectralProcessingDialog(QgsProcessingAlgorithmDialogBase):
         self.btnAlgorithm.clicked.connect(self.onSetAlgorithm)
 
         self.mTemporaryRaster: List[str] = []
+        self.mTemporaryVsimemFolders: List[str] = []
+        self.mInMemoryExchange: bool = True
+        self.mUndoableWriteBack: bool = True
+        self.mBatchSize: int = 0
         self.tbAlgorithmName: QLineEdit = QLineEdit()
         self.tbAlgorithmName.setPlaceholderText('Select a raster processing algorithm / model')
         self.tbAlgorithmName.setReadOnly(True)
@@ -696,9 +736,42 @@ class SpectralProcessingDialog(QgsProcessingAlgorithmDialogBase):
             except Exception as ex:
                 pass
 
+        self.removeTemporaryRaster()
         self.sigAboutToBeClosed.emit()
         super().close()
 
+    def setInMemoryExchange(self, b: bool):
+        """
+        Sets if input and output rasters are exchanged with the processing algorithm as
+        in-memory /vsimem/ datasets. Temporary files are used if the algorithm requires real file paths.
+        :param b: bool
+        """
+        self.mInMemoryExchange = b is True
+
+    def inMemoryExchange(self) -> bool:
+        """
+        Returns True if rasters are exchanged with processing algorithms in memory, if possible.
+        :return: bool
+        """
+        return self.mInMemoryExchange
+
+    def setUndoableWriteBack(self, b: bool):
+        """
+        Sets if processing results are written back to the spectral library as undoable edits.
+        If False, pending edits of the spectral library are committed first and results for fields
+        that exist in the data provider are written to the data provider directly, which is faster
+        but can not be undone.
+        :param b: bool
+        """
+        self.mUndoableWriteBack = b is True
+
+    def undoableWriteBack(self) -> bool:
+        """
+        Returns True if processing results are written back as undoable edits.
+        :return: bool
+        """
+        return self.mUndoableWriteBack
+
     def setMainMessageBar(self, messageBar):
         self.mProcessingWidgetContext.setMessageBar(messageBar)
 
@@ -729,9 +802,8 @@ class SpectralProcessingDialog(QgsProcessingAlgorithmDialogBase):
         Runs the QgsProcessingAlgorithm with the specified settings
         """
 
-        self.mTemporaryRaster.clear()
+        self.removeTemporaryRaster()
 
-        TEMP_FOLDER = QgsProcessingUtils.generateTempFilename('')
         self.mProcessingFeedback.setProgress(int(0))
         wrapper = self.processingModelWrapper()
         if not isinstance(wrapper, SpectralProcessingModelCreatorAlgorithmWrapper):
@@ -744,6 +816,12 @@ class SpectralProcessingDialog(QgsProcessingAlgorithmDialogBase):
             return None
 
         alg: QgsProcessingAlgorithm = wrapper.algorithm()
+        if self.mInMemoryExchange and not requires_file_paths(alg):
+            TEMP_FOLDER = f'/vsimem/spectralprocessing/{uuid.uuid4()}/'
+            self.mTemporaryVsimemFolders.append(TEMP_FOLDER)
+        else:
+            TEMP_FOLDER = QgsProcessingUtils.generateTempFilename('')
+
         parameters = None
         try:
             rasterblockFeedback = QgsRasterBlockFeedback()
@@ -760,10 +838,6 @@ class SpectralProcessingDialog(QgsProcessingAlgorithmDialogBase):
             self.log(f'Save parameters for {alg.id()}')
             self.mProcessingAlgParametersStore[alg.id()] = parameters
 
-            transformContext = processingContext.transformContext()
-            # copy and replace input raster's with temporary data sets
-            # that contain spectral profiles
-
             # Calculate feature intersection, i.e.
             self.log('Calculate feature intersection')
             affected_features = set()
@@ -785,8 +859,7 @@ class SpectralProcessingDialog(QgsProcessingAlgorithmDialogBase):
                 self.log('Feature ID of selected spectral profile images do not overlap', isError=True)
                 return None
 
-            activeFeatures = list(self.speclib().getFeatures(sorted(affected_features)))
-            activeFeatureIDs = [f.id() for f in activeFeatures]
+            activeFeatureIDs = sorted(affected_features)
 
             if len(activeFeatureIDs) == 0:
                 self.log('No active features to process', isError=True)
@@ -794,150 +867,42 @@ class SpectralProcessingDialog(QgsProcessingAlgorithmDialogBase):
             else:
                 self.log(f'Process {len(affected_features)} features')
 
-            parametersHard = parameters.copy()
-            self.log('Make virtual raster(s) permanent')
-            for k, v in parametersHard.items():
-                param = alg.parameterDefinition(k)
+            # clone input providers once, the features of each batch are set later
+            INPUT_PROVIDERS: Dict[str, VectorLayerFieldRasterDataProvider] = dict()
+            for k, v in parameters.items():
                 if isinstance(v, QgsRasterLayer) and isinstance(v.dataProvider(), VectorLayerFieldRasterDataProvider):
-                    dp: VectorLayerFieldRasterDataProvider = v.dataProvider().clone()
-                    dp.setActiveFeatures(activeFeatures)
-
-                    # file_name = QgsProcessingUtils.generateTempFilename(f'{k}.tif')
-                    file_name = TEMP_FOLDER + f'{k}.tif'
-                    self.writeTemporaryRaster(dp, file_name, rasterblockFeedback, transformContext)
-                    parametersHard[k] = file_name
-
-                elif isinstance(param, QgsProcessingParameterRasterDestination):
-                    file_name = TEMP_FOLDER + f'{v}'
-                    parametersHard[k] = file_name
-                    s = ""
-            from processing.gui.AlgorithmExecutor import execute as executeAlg
-
-            self.log(f'Execute algorithm: {alg.id()} ...')
-            processingFeedback.pushInfo('Input parameters:')
-            processingFeedback.pushConsoleInfo(str(parametersHard))
-            t0 = datetime.datetime.now()
-            ok, results = executeAlg(alg,
-                                     parametersHard,
-                                     context=processingContext,
-                                     feedback=processingFeedback,
-                                     catch_exceptions=not fail_fast)
-
-            if ok:
-
-                OUTPUTS: Dict[str, Tuple[QgsProcessingOutputDefinition, Any]] = dict()
-                OUT_RASTERS = dict()
-                for parameter in alg.outputDefinitions():
-                    parameter: QgsProcessingOutputDefinition
-                    if parameter.name() not in results.keys():
-                        processingFeedback.pushWarning(f'Missing result value for parameter "{parameter.name()}"')
-                        continue
-
-                    result_value = results[parameter.name()]
-                    OUTPUTS[parameter.name()] = (parameter, result_value)
+                    INPUT_PROVIDERS[k] = v.dataProvider().clone()
 
-                    if isinstance(parameter, QgsProcessingOutputRasterLayer):
-                        lyr = QgsRasterLayer(results[parameter.name()])
-                        if not lyr.isValid():
-                            info = f'Unable to open {lyr.source()}'
-                            self.log(info, isError=True)
-                        else:
-                            tmp = rasterArray(lyr)
-                            nb, nl, ns = tmp.shape
+            batches = self.featureBatches(activeFeatureIDs)
+            if len(batches) > 1 and any(dp.fieldConverter().isClassification() for dp in INPUT_PROVIDERS.values()):
+                # class values are enumerated per raster, they would differ between batches
+                self.log('Classification inputs can not be processed in batches')
+                batches = self.featureBatches(activeFeatureIDs, batchSize=0)
 
-                            path1 = parameters[parameter.name()]
-                            target_field_name = SpectralProcessingRasterDestination.pathToFieldName(path1)
-                            target_field_index = speclib.fields().lookupField(target_field_name)
-                            if target_field_index == -1:
-                                # create a new field
-
-                                if nb > 1:
-                                    # create spectral profile fields
-                                    field: QgsField = SpectralLibraryUtils.createProfileField(target_field_name)
-                                    if not speclib.dataProvider().supportedType(field):
-                                        field = SpectralLibraryUtils.createProfileField(target_field_name,
-                                                                                        encoding=ProfileEncoding.Text)
-                                else:
-                                    # create standard field
-                                    field: QgsField = QgsField(name=target_field_name,
-                                                               type=numpyToQgisDataType(tmp.dtype))
-                                    if not speclib.dataProvider().supportedType(field):
-                                        field = QgsField(name=target_field_name, type=Qgis.DataType.Float32)
-
-                                speclib.beginEditCommand(f'Add field {field.name()}')
-                                assert SpectralLibraryUtils.addAttribute(speclib, field)
-                                speclib.endEditCommand()
-
-                                target_field_index = speclib.fields().lookupField(target_field_name)
-
-                            if target_field_index >= 0:
-                                # if necessary, change editor widget type to SpectralProfile
-                                target_field: QgsField = speclib.fields().at(target_field_index)
-                                if nb > 0 and can_store_spectral_profiles(target_field) and not is_profile_field(
-                                        target_field):
-                                    setup = QgsEditorWidgetSetup(EDITOR_WIDGET_REGISTRY_KEY, {})
-                                    speclib.setEditorWidgetSetup(target_field_index, setup)
-                                    target_field = speclib.fields().at(target_field_index)
-
-                                OUT_RASTERS[parameter.name()] = (lyr, tmp, target_field)
-
-                    elif isinstance(parameter, QgsProcessingOutputVectorLayer):
-                        # todo: append vector output to speclib
-                        pass
-
-                if len(OUT_RASTERS) > 0:
-                    available_fids = speclib.allFeatureIds()
-                    speclib.beginEditCommand('Add raster processing results')
-                    # reload active features to include new fields
-                    activeFeatures = list(speclib.getFeatures(activeFeatureIDs))
-                    # write raster values to features
-                    for parameterName, (lyr, tmp, target_field) in OUT_RASTERS.items():
-                        self.log(f'Write values to field {target_field.name()}...')
-
-                        spectralProperties = QgsRasterLayerSpectralProperties.fromRasterLayer(lyr)
-                        wl = spectralProperties.wavelengths()
-                        wlu = spectralProperties.wavelengthUnits()
-                        bbl = spectralProperties.badBands()
-
-                        # wavelength need to be defined for all bands
-                        if any([w is None for w in wl]):
-                            wl = None
-
-                        # choose 1st wavelength unit for entire profile
-                        for w in wlu:
-                            if w not in [None, '']:
-                                wlu = w
-
-                        # no need to save a bad-band-list (bbl) if it is True for all bands (default)
-                        if all([b == 1 for b in bbl]):
-                            bbl = None
-
-                        target_field: QgsField
-                        target_field_index: int = speclib.fields().lookupField(target_field.name())
-
-                        is_profile = is_profile_field(target_field)
-                        for i, feature in enumerate(activeFeatures):
-                            feature: QgsFeature
-                            value = None
-                            if is_profile:
-                                pixel_profile = tmp[:, 0, i]
-                                pdict = prepareProfileValueDict(x=wl,
-                                                                xUnit=wlu,
-                                                                y=pixel_profile,
-                                                                bbl=bbl)
-                                value = encodeProfileValueDict(pdict, target_field)
-                            else:
-                                value = float(tmp[0, 0, i])
-                                if target_field.type() == QMETATYPE_QSTRING:
-                                    value = str(value)
-                            assert speclib.changeAttributeValue(feature.id(), target_field_index, value)
-                            # assert feature.setAttribute(target_field_index, value)
-
-                    self.log(f'Update {len(activeFeatures)} features')
-                    speclib.endEditCommand()
-
-                if len(OUTPUTS) > 0:
-                    self.sigOutputsCreated.emit(OUTPUTS)
+            n_batches = len(batches)
+            batchFeedback = QgsProcessingMultiStepFeedback(n_batches, processingFeedback)
+            t0 = datetime.datetime.now()
+            ok, results = False, dict()
+            for b, batchIDs in enumerate(batches):
+                if processingFeedback.isCanceled():
+                    self.log('Processing canceled', isError=True)
+                    ok = False
+                    break
+                batchFeedback.setCurrentStep(b)
+                if n_batches > 1:
+                    self.log(f'Process batch {b + 1}/{n_batches} ({len(batchIDs)} features)')
+                    prefix = TEMP_FOLDER + f'batch{b}_'
+                else:
+                    prefix = TEMP_FOLDER
+
+                ok, results = self.runAlgorithmBatch(alg, parameters, INPUT_PROVIDERS, batchIDs, prefix,
+                                                     batchFeedback, rasterblockFeedback,
+                                                     fail_fast=fail_fast)
+                if n_batches > 1:
+                    # release the in-memory inputs of this batch
+                    self.removeTemporaryRaster(prefix)
+                if not ok:
+                    break
 
             processingFeedback.pushInfo(f'Execution completed in {datetime.datetime.now() - t0}')
             processingFeedback.pushInfo('Results:')
@@ -972,6 +937,233 @@ class SpectralProcessingDialog(QgsProcessingAlgorithmDialogBase):
         self.showLog()
         # self.processingFeedback().setProgress(int(100))
 
+    def setBatchSize(self, batchSize: int):
+        """
+        Sets the maximum number of features that are processed by a single algorithm call.
+        Larger feature sets are split into batches which are processed and written back one after another.
+        Use batches for pixel-wise algorithms only, i.e. algorithms whose results do not depend on other pixels.
+        Algorithms that use global statistics of the input raster, e.g. native:rescaleraster, return
+        different results when the features are processed in batches.
+        :param batchSize: int, 0 = process all features at once (default)
+        """
+        assert batchSize >= 0
+        self.mBatchSize = batchSize
+
+    def batchSize(self) -> int:
+        """
+        Returns the maximum number of features processed by a single algorithm call, 0 = no limit.
+        :return: int
+        """
+        return self.mBatchSize
+
+    def featureBatches(self, fids: List[int], batchSize: Optional[int] = None) -> List[List[int]]:
+        """
+        Splits feature ids into batches of at most batchSize features.
+        :param fids: list of feature ids
+        :param batchSize: int, defaults to batchSize()
+        :return: list of feature id lists
+        """
+        if batchSize is None:
+            batchSize = self.mBatchSize
+        if batchSize <= 0 or len(fids) <= batchSize:
+            return [fids]
+        return [fids[i:i + batchSize] for i in range(0, len(fids), batchSize)]
+
+    def rasterLayout(self, nFeatures: int) -> FieldRasterLayout:
+        """
+        Returns how nFeatures features are arranged in the temporary input rasters.
+        :param nFeatures: number of features processed by a single algorithm call
+        :return: FieldRasterLayout
+        """
+        if nFeatures > self.MAX_LINE_LENGTH:
+            return FieldRasterLayout.Grid
+        return FieldRasterLayout.Line
+
+    def runAlgorithmBatch(self,
+                          alg: QgsProcessingAlgorithm,
+                          parameters: dict,
+                          inputProviders: Dict[str, VectorLayerFieldRasterDataProvider],
+                          fids: List[int],
+                          prefix: str,
+                          feedback: QgsProcessingFeedback,
+                          rasterblockFeedback: QgsRasterBlockFeedback,
+                          fail_fast: bool = False) -> Tuple[bool, dict]:
+        """
+        Runs the algorithm for a batch of features and writes the raster outputs back into the speclib
+        :param alg: QgsProcessingAlgorithm
+        :param parameters: algorithm parameters as returned by the parameter widgets
+        :param inputProviders: VectorLayerFieldRasterDataProvider for each raster input parameter
+        :param fids: ids of the features to process
+        :param prefix: path prefix for temporary inputs and outputs
+        :return: (bool, dict) = execution successful, algorithm results
+        """
+        speclib: QgsVectorLayer = self.speclib()
+        processingContext: QgsProcessingContext = self.processingContext()
+        transformContext = processingContext.transformContext()
+
+        activeFeatures = list(speclib.getFeatures(fids))
+        activeFeatureIDs = [f.id() for f in activeFeatures]
+        layout = self.rasterLayout(len(activeFeatures))
+
+        parametersHard = parameters.copy()
+        self.log('Make virtual raster(s) permanent')
+        for k, v in parametersHard.items():
+            param = alg.parameterDefinition(k)
+            if k in inputProviders:
+                dp: VectorLayerFieldRasterDataProvider = inputProviders[k]
+                dp.setLayout(layout)
+                dp.setActiveFeatures(activeFeatures)
+
+                file_name = prefix + f'{k}.tif'
+                self.writeTemporaryRaster(dp, file_name, rasterblockFeedback, transformContext)
+                parametersHard[k] = file_name
+
+            elif isinstance(param, QgsProcessingParameterRasterDestination):
+                file_name = prefix + f'{v}'
+                parametersHard[k] = file_name
+        del activeFeatures
+        from processing.gui.AlgorithmExecutor import execute as executeAlg
+
+        self.log(f'Execute algorithm: {alg.id()} ...')
+        feedback.pushInfo('Input parameters:')
+        feedback.pushConsoleInfo(str(parametersHard))
+        ok, results = executeAlg(alg,
+                                 parametersHard,
+                                 context=processingContext,
+                                 feedback=feedback,
+                                 catch_exceptions=not fail_fast)
+
+        if ok:
+            OUTPUTS: Dict[str, Tuple[QgsProcessingOutputDefinition, Any]] = dict()
+            OUT_RASTERS = dict()
+            for parameter in alg.outputDefinitions():
+                parameter: QgsProcessingOutputDefinition
+                if parameter.name() not in results.keys():
+                    feedback.pushWarning(f'Missing result value for parameter "{parameter.name()}"')
+                    continue
+
+                result_value = results[parameter.name()]
+                OUTPUTS[parameter.name()] = (parameter, result_value)
+
+                if isinstance(parameter, QgsProcessingOutputRasterLayer):
+                    lyr = QgsRasterLayer(results[parameter.name()])
+                    if not lyr.isValid():
+                        info = f'Unable to open {lyr.source()}'
+                        self.log(info, isError=True)
+                    else:
+                        tmp = rasterArray(lyr)
+                        nb, nl, ns = tmp.shape
+
+                        path1 = parameters[parameter.name()]
+                        target_field_name = SpectralProcessingRasterDestination.pathToFieldName(path1)
+                        target_field_index = speclib.fields().lookupField(target_field_name)
+                        if target_field_index == -1:
+                            # create a new field
+
+                            if nb > 1:
+                                # create spectral profile fields
+                                field: QgsField = SpectralLibraryUtils.createProfileField(target_field_name)
+                                if not speclib.dataProvider().supportedType(field):
+                                    field = SpectralLibraryUtils.createProfileField(target_field_name,
+                                                                                    encoding=ProfileEncoding.Text)
+                            else:
+                                # create standard field
+                                field: QgsField = QgsField(name=target_field_name,
+                                                           type=numpyToQgisDataType(tmp.dtype))
+                                if not speclib.dataProvider().supportedType(field):
+                                    field = QgsField(name=target_field_name, type=Qgis.DataType.Float32)
+
+                            speclib.beginEditCommand(f'Add field {field.name()}')
+                            assert SpectralLibraryUtils.addAttribute(speclib, field)
+                            speclib.endEditCommand()
+
+                            target_field_index = speclib.fields().lookupField(target_field_name)
+
+                        if target_field_index >= 0:
+                            # if necessary, change editor widget type to SpectralProfile
+                            target_field: QgsField = speclib.fields().at(target_field_index)
+                            if nb > 0 and can_store_spectral_profiles(target_field) and not is_profile_field(
+                                    target_field):
+                                setup = QgsEditorWidgetSetup(EDITOR_WIDGET_REGISTRY_KEY, {})
+                                speclib.setEditorWidgetSetup(target_field_index, setup)
+                                target_field = speclib.fields().at(target_field_index)
+
+                            OUT_RASTERS[parameter.name()] = (lyr, tmp, target_field)
+
+                elif isinstance(parameter, QgsProcessingOutputVectorLayer):
+                    # todo: append vector output to speclib
+                    pass
+
+            if len(OUT_RASTERS) > 0:
+                # direct provider writes require an empty edit buffer.
+                # results are written to the edit buffer if it contains new features, as their ids change on commit
+                buffer = speclib.editBuffer()
+                directWrite = not self.mUndoableWriteBack and not (buffer and len(buffer.addedFeatures()) > 0)
+                if directWrite:
+                    if not speclib.commitChanges():
+                        self.log('\n'.join(speclib.commitErrors()), isError=True)
+                        speclib.startEditing()
+                        return False, results
+                else:
+                    speclib.beginEditCommand('Add raster processing results')
+                # reload active features to include new fields
+                activeFeatures = {f.id(): f for f in speclib.getFeatures(activeFeatureIDs)}
+                NEW_VALUES: Dict[int, Dict[int, Any]] = {fid: dict() for fid in activeFeatures.keys()}
+                OLD_VALUES: Dict[int, Dict[int, Any]] = {fid: dict() for fid in activeFeatures.keys()}
+                # encode raster values to field values
+                for parameterName, (lyr, tmp, target_field) in OUT_RASTERS.items():
+                    self.log(f'Write values to field {target_field.name()}...')
+
+                    spectralProperties = QgsRasterLayerSpectralProperties.fromRasterLayer(lyr)
+                    wl = spectralProperties.wavelengths()
+                    wlu = spectralProperties.wavelengthUnits()
+                    bbl = spectralProperties.badBands()
+
+                    # wavelength need to be defined for all bands
+                    if any([w is None for w in wl]):
+                        wl = None
+
+                    # choose 1st wavelength unit for entire profile
+                    for w in wlu:
+                        if w not in [None, '']:
+                            wlu = w
+
+                    # no need to save a bad-band-list (bbl) if it is True for all bands (default)
+                    if all([b == 1 for b in bbl]):
+                        bbl = None
+
+                    target_field: QgsField
+                    target_field_index: int = speclib.fields().lookupField(target_field.name())
+
+                    # pixels are in row-major order, both for line and for grid layouts
+                    pixels = tmp.reshape((tmp.shape[0], -1))[:, 0:len(activeFeatureIDs)]
+                    if is_profile_field(target_field):
+                        values = encodeProfileValueDicts(pixels, target_field, x=wl, xUnit=wlu, bbl=bbl)
+                    else:
+                        values = pixels[0, :].astype(float).tolist()
+                        if target_field.type() == QMETATYPE_QSTRING:
+                            values = [str(v) for v in values]
+
+                    # the i-th raster column contains the values of the i-th active feature
+                    for fid, value in zip(activeFeatureIDs, values):
+                        feature = activeFeatures.get(fid)
+                        if isinstance(feature, QgsFeature):
+                            NEW_VALUES[fid][target_field_index] = value
+                            OLD_VALUES[fid][target_field_index] = feature.attribute(target_field_index)
+
+                self.log(f'Update {len(activeFeatures)} features')
+                assert SpectralLibraryUtils.changeAttributeValues(speclib, NEW_VALUES, OLD_VALUES,
+                                                                  undoable=not directWrite)
+                if directWrite:
+                    speclib.startEditing()
+                else:
+                    speclib.endEditCommand()
+
+            if len(OUTPUTS) > 0:
+                self.sigOutputsCreated.emit(OUTPUTS)
+
+        return ok, results
+
     def temporaryRaster(self) -> List[str]:
         """
         Returns a list of all files which have been written by writeTemporaryRaster
@@ -979,8 +1171,36 @@ class SpectralProcessingDialog(QgsProcessingAlgorithmDialogBase):
         """
         return self.mTemporaryRaster[:]
 
+    def removeTemporaryRaster(self, prefix: Optional[str] = None):
+        """
+        Releases the in-memory /vsimem/ rasters of the last runAlgorithm() call, i.e. its inputs and outputs.
+        :param prefix: str, if set, releases only the temporary input rasters whose path starts with prefix.
+                       Outputs remain readable, as they have been emitted with sigOutputsCreated.
+        """
+        inputs = [f for f in self.mTemporaryRaster if prefix is not None and f.startswith(prefix)]
+        for folder in self.mTemporaryVsimemFolders:
+            files = gdal.ReadDirRecursive(folder)
+            if isinstance(files, list):
+                for f in files:
+                    path = folder + f
+                    if f.endswith('/'):
+                        continue
+                    # includes auxiliary files of the inputs, like *.aux.xml
+                    if prefix is None or any(path.startswith(i) for i in inputs):
+                        gdal.Unlink(path)
+        if prefix is None:
+            self.mTemporaryVsimemFolders.clear()
+            self.mTemporaryRaster.clear()
+        else:
+            self.mTemporaryRaster = [f for f in self.mTemporaryRaster
+                                     if not (f.startswith('/vsimem/') and f.startswith(prefix))]
+
     def writeTemporaryRaster(self, dp: QgsRasterDataProvider, file_name, rasterblockFeedback, transformContext):
 
+        if file_name.startswith('/vsimem/') and isinstance(dp, VectorLayerFieldRasterDataProvider):
+            self.writeInMemoryRaster(dp, file_name)
+            return
+
         file_writer = QgsRasterFileWriter(file_name)
 
         assert dp.xSize() > 0
@@ -1027,6 +1247,69 @@ class SpectralProcessingDialog(QgsProcessingAlgorithmDialogBase):
 
         self.mTemporaryRaster.append(file_name)
 
+    def writeInMemoryRaster(self, dp: VectorLayerFieldRasterDataProvider, file_name: str):
+        """
+        Writes the field values of a VectorLayerFieldRasterDataProvider directly into a /vsimem/ GeoTIFF.
+        Spectral properties, color tables and class names are written as GDAL metadata, so that no
+        sidecar files are required.
+        """
+        assert file_name.startswith('/vsimem/')
+        fieldConverter: FieldToRasterValueConverter = dp.fieldConverter()
+        array: np.ndarray = np.stack([dp.bandArray(b + 1) for b in range(dp.bandCount())])
+        nb, nl, ns = array.shape
+        assert nb > 0 and ns > 0
+
+        if array.dtype == np.int64:
+            array = array.astype(np.int32)
+        eType = gdal_array.NumericTypeCodeToGDALTypeCode(array.dtype)
+        drv: gdal.Driver = gdal.GetDriverByName('GTiff')
+        ds: gdal.Dataset = drv.Create(file_name, ns, nl, nb, eType)
+        if not isinstance(ds, gdal.Dataset):
+            raise Exception(f'Unable to write {file_name}')
+        self.log(f'Write {file_name}')
+
+        extent = dp.extent()
+        ds.SetGeoTransform([extent.xMinimum(), 1, 0, extent.yMaximum(), 0, -1])
+        ds.SetProjection(dp.crs().toWkt())
+
+        setting = fieldConverter.spectralSetting() if isinstance(fieldConverter, SpectralProfileValueConverter) \
+            else None
+        x = bbl = wlu = None
+        if isinstance(setting, SpectralSetting):
+            x, bbl, wlu = setting.x(), setting.bbl(), setting.xUnit()
+
+        noData = dp.sourceNoDataValue(1)
+        for b in range(nb):
+            band: gdal.Band = ds.GetRasterBand(b + 1)
+            band.WriteArray(array[b, :, :])
+            if noData is not None:
+                band.SetNoDataValue(float(noData))
+            band.SetDescription(dp.generateBandName(b + 1))
+            if x:
+                band.SetMetadataItem('wavelength', str(x[b]))
+            if wlu:
+                band.SetMetadataItem('wavelength_units', str(wlu))
+            if bbl:
+                band.SetMetadataItem('bbl', str(bbl[b]))
+
+        if fieldConverter.isClassification():
+            colorTable = fieldConverter.colorTable(1)
+            if len(colorTable) > 0:
+                ct = gdal.ColorTable()
+                names = [''] * (int(max(item.value for item in colorTable)) + 1)
+                for item in colorTable:
+                    c = item.color
+                    ct.SetColorEntry(int(item.value), (c.red(), c.green(), c.blue(), c.alpha()))
+                    names[int(item.value)] = item.label
+                band: gdal.Band = ds.GetRasterBand(1)
+                band.SetColorTable(ct)
+                band.SetCategoryNames(names)
+                band.SetColorInterpretation(gdal.GCI_PaletteIndex)
+
+        ds.FlushCache()
+        del ds
+        self.mTemporaryRaster.append(file_name)
+
     def messageBar(self) -> QgsMessageBar:
         return self.mProcessingWidgetContext.messageBar()
 
@@ -50,7 +50,7 @@ from ..core.spectrallibraryio import SpectralLibraryExportWidget, SpectralLibrar
 from ..core.spectralprofile import decodeProfileValueDict, encodeProfileValueDict, groupBySpectralProperties, \
     prepareProfileValueDict, SpectralSetting
 from ...qgisenums import QMETATYPE_DOUBLE, QMETATYPE_INT, QMETATYPE_QSTRING
-from ...qgsrasterlayerproperties import stringToType
+from ...qgsrasterlayerproperties import ENVIHeaderCache
 
 # lookup GDAL Data Type and its size in bytes
 LUT_GDT_SIZE = {gdal.GDT_Byte: 1,
@@ -681,36 +681,9 @@ def readENVIHeader(pathESL: Union[str, Path], typeConversion: bool = False) -> d
     if pathHdr is None:
         return None
 
-    # hdr = open(pathHdr).readlines()
-    file = open(pathHdr, encoding='utf-8')
-    hdr = file.readlines()
-    file.close()
-
-    i = 0
-    while i < len(hdr):
-        if '{' in hdr[i]:
-            while '}' not in hdr[i]:
-                hdr[i] = hdr[i] + hdr.pop(i + 1)
-        i += 1
-
-    hdr = [''.join(re.split('\n[ ]*', line)).strip() for line in hdr]
-    # keep lines with <tag>=<value> structure only
-    hdr = [line for line in hdr if re.search(r'^[^=]+=', line)]
-
-    # restructure into dictionary of type
-    # md[key] = single value or
-    # md[key] = [list-of-values]
-    md = dict()
-    for line in hdr:
-        tmp = line.split('=')
-        key, value = tmp[0].strip(), '='.join(tmp[1:]).strip()
-        if value.startswith('{') and value.endswith('}'):
-            value = [v.strip() for v in value.strip('{}').split(',')]
-            if len(value) > 0 and len(value[0]) > 0:
-                md[key] = value
-        else:
-            if len(value) > 0:
-                md[key] = value
+    md = ENVIHeaderCache.header(pathHdr, typeConversion=typeConversion)
+    if md is None:
+        return None
 
     # check required metadata tags
     for k in REQUIRED_TAGS:
@@ -718,13 +691,9 @@ def readENVIHeader(pathESL: Union[str, Path], typeConversion: bool = False) -> d
             return None
 
     if typeConversion:
-        for k in list(md.keys()):
-            value = md[k]
-            if isinstance(value, list):
-                value = [stringToType(v) for v in value]
-            else:
-                value = stringToType(value)
-            md[k] = value
+        for k, value in md.items():
+            if isinstance(value, np.ndarray):
+                md[k] = value.tolist()
 
     return md
 
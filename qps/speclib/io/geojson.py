@@ -1,14 +1,14 @@
 import os
 from pathlib import Path
-from typing import Any, List, Union
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
 
 import numpy as np
 
-from qgis.core import QgsCoordinateReferenceSystem, QgsCoordinateTransformContext, QgsExpressionContext, \
-    QgsExpressionContextScope, QgsFeature, QgsField, QgsFields, QgsProcessingFeedback, QgsProject, QgsProperty, \
-    QgsRemappingProxyFeatureSink, QgsRemappingSinkDefinition, QgsVectorFileWriter, QgsVectorLayer
+from qgis.core import QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsExpressionContext, QgsFeature, \
+    QgsField, QgsFields, QgsProcessingFeedback, QgsProject, QgsVectorFileWriter, QgsVectorLayer
 from ..core import is_profile_field
-from ..core.spectrallibraryio import SpectralLibraryExportWidget, SpectralLibraryImportWidget, SpectralLibraryIO
+from ..core.spectrallibraryio import ProfileColumnEncoder, SpectralLibraryExportWidget, SpectralLibraryImportWidget, \
+    SpectralLibraryIO
 from ..core.spectralprofile import decodeProfileValueDict, encodeProfileValueDict
 from ...qgisenums import QMETATYPE_QSTRING
 
@@ -34,7 +34,7 @@ class GeoJsonSpectralLibraryExportWidget(SpectralLibraryExportWidget):
         return SpectralLibraryIO.spectralLibraryIOInstances(GeoJsonSpectralLibraryIO)
 
     def filter(self) -> str:
-        return "GeoJSON (*.geojson)"
+        return "GeoJSON (*.geojson *.geojsonl *.geojsons)"
 
     def exportSettings(self, settings: dict) -> dict:
         speclib = self.speclib()
@@ -55,7 +55,7 @@ class GeoJsonSpectralLibraryImportWidget(SpectralLibraryImportWidget):
         return SpectralLibraryIO.spectralLibraryIOInstances(GeoJsonSpectralLibraryIO)
 
     def filter(self) -> str:
-        return "GeoJSON (*.geojson)"
+        return "GeoJSON (*.geojson *.geojsonl *.geojsons)"
 
     def setSource(self, source: str):
         lyr = QgsVectorLayer(source)
@@ -96,6 +96,7 @@ class GeoJsonFieldValueConverter(QgsVectorFileWriter.FieldValueConverter):
         # define converter functions
         self.mFieldDefinitions = dict()
         self.mFieldConverters = dict()
+        self.mProfileFields: Dict[int, QgsField] = dict()
 
         for field in self.mFields:
             name = field.name()
@@ -104,6 +105,7 @@ class GeoJsonFieldValueConverter(QgsVectorFileWriter.FieldValueConverter):
                 converted_field = QgsField(name=name, type=QMETATYPE_QSTRING, typeName='string', len=-1)
                 self.mFieldDefinitions[name] = converted_field
                 self.mFieldConverters[idx] = lambda v, f=converted_field: self.convertProfileField(v, f)
+                self.mProfileFields[idx] = converted_field
 
             else:
                 self.mFieldDefinitions[name] = QgsField(super().fieldDefinition(field))
@@ -118,6 +120,14 @@ class GeoJsonFieldValueConverter(QgsVectorFileWriter.FieldValueConverter):
     def clone(self) -> QgsVectorFileWriter.FieldValueConverter:
         return GeoJsonFieldValueConverter(self.mFields)
 
+    def profileColumnEncoders(self, encoder: Callable = ProfileColumnEncoder) -> Dict[int, ProfileColumnEncoder]:
+        """
+        Returns encoders that convert the profile fields column-wise, like convertProfileField
+        :param encoder: ProfileColumnEncoder class or a function that returns a ProfileColumnEncoder for a field
+        :return: dict with {field index: ProfileColumnEncoder}
+        """
+        return {idx: encoder(field) for idx, field in self.mProfileFields.items()}
+
     def convert(self, fieldIdxInLayer: int, value: Any) -> Any:
         return self.mFieldConverters[fieldIdxInLayer](value)
 
@@ -155,8 +165,8 @@ class GeoJsonSpectralLibraryIO(SpectralLibraryIO):
                        exportSettings: dict = dict(),
                        feedback: QgsProcessingFeedback = QgsProcessingFeedback(), **kwargs) -> List[str]:
 
-        profiles, fields, crs, wkbType = cls.extractWriterInfos(profiles, exportSettings)
-        if len(profiles) == 0:
+        profiles, fields, crs, wkbType, nTotal = cls.extractWriterStream(profiles, exportSettings)
+        if nTotal == 0:
             return []
 
         transformContext = QgsProject.instance().transformContext()
@@ -169,15 +179,20 @@ class GeoJsonSpectralLibraryIO(SpectralLibraryIO):
         if newLayerName == '':
             newLayerName = os.path.basename(newLayerName)
 
-        datasourceOptions = exportSettings.get('datasourceOptions', dict())
-        assert isinstance(datasourceOptions, dict)
-        rfc7946: bool = exportSettings.get('rfc7946', True) is True
+        # write newline-delimited GeoJSON (GeoJSON text sequences) for *.geojsonl and *.geojsons files
+        sequence: bool = path.suffix.lower() in ['.geojsonl', '.geojsons']
+
+        # GeoJSON sequences are always written in EPSG:4326
+        rfc7946: bool = exportSettings.get('rfc7946', True) is True or sequence
 
         datasourceOptions = exportSettings.get('datasourceOptions',
                                                [])  # 'ATTRIBUTES_SKIP=NO', 'DATE_AS_STRING=YES', 'ARRAY_AS_STRING=YES']
 
-        layerOptions = exportSettings.get('layerOptions', [f'DESCRIPTION={newLayerName}'])
-        layerOptions.insert(0, f'RFC7946={"YES" if rfc7946 else "NO"}')
+        if sequence:
+            layerOptions = list(exportSettings.get('layerOptions', []))
+        else:
+            layerOptions = list(exportSettings.get('layerOptions', [f'DESCRIPTION={newLayerName}']))
+            layerOptions.insert(0, f'RFC7946={"YES" if rfc7946 else "NO"}')
 
         options = QgsVectorFileWriter.SaveVectorOptions()
         options.actionOnExistingFile = QgsVectorFileWriter.ActionOnExistingFile.CreateOrOverwriteFile
@@ -186,11 +201,13 @@ class GeoJsonSpectralLibraryIO(SpectralLibraryIO):
         options.layerOptions = layerOptions
         options.fileEncoding = exportSettings.get('fileEncoding', 'UTF-8')
         options.skipAttributeCreation = False
-        options.driverName = 'GeoJSON'
+        options.driverName = 'GeoJSONSeq' if sequence else 'GeoJSON'
 
+        # profile values are encoded column-wise before being written,
+        # so the writer does not need to convert them per feature
         converter = GeoJsonFieldValueConverter(fields)
-        options.fieldValueConverter = converter
         convertedFields = converter.convertedFields()
+        encoders = converter.profileColumnEncoders(exportSettings.get('profile_encoder', ProfileColumnEncoder))
 
         writer_crs: QgsCoordinateReferenceSystem = crsJson if rfc7946 else crs
         writer: QgsVectorFileWriter = QgsVectorFileWriter.create(path.as_posix(),
@@ -199,40 +216,20 @@ class GeoJsonSpectralLibraryIO(SpectralLibraryIO):
                                                                  writer_crs,
                                                                  transformContext,
                                                                  options)
-        # we might need to transform the coordinates to JSON EPSG:4326
-        mappingDefinition = QgsRemappingSinkDefinition()
-        mappingDefinition.setSourceCrs(crs)
-        mappingDefinition.setDestinationCrs(writer_crs)
-        mappingDefinition.setDestinationFields(fields)
-        mappingDefinition.setDestinationWkbType(wkbType)
-
-        for field in fields:
-            field: QgsField
-            mappingDefinition.addMappedField(field.name(), QgsProperty.fromField(field.name()))
-
-        expressionContext = QgsExpressionContext()
-        expressionContext.setFields(fields)
-        expressionContext.setFeedback(feedback)
-
-        scope = QgsExpressionContextScope()
-        scope.setFields(fields)
-        expressionContext.appendScope(scope)
-        transformationContext = QgsCoordinateTransformContext()
-
-        featureSink = QgsRemappingProxyFeatureSink(mappingDefinition, writer)
-        featureSink.setExpressionContext(expressionContext)
-        featureSink.setTransformContext(transformationContext)
 
         if writer.hasError() != QgsVectorFileWriter.NoError:
             raise Exception(f'Error when creating {path}: {writer.errorMessage()}')
 
-        featureSink.flushBuffer()
-
-        if not featureSink.addFeatures(profiles):
-            errSink = featureSink.lastError()
-            if writer.errorCode() != QgsVectorFileWriter.NoError:
-                raise Exception(f'Error when creating feature: {writer.errorMessage()}')
-
+        # we might need to transform the coordinates to JSON EPSG:4326
+        transform = None
+        if crs.isValid() and writer_crs.isValid() and crs != writer_crs:
+            transform = QgsCoordinateTransform(crs, writer_crs, transformContext)
+
+        cls.writeFeatureBatches(writer, profiles,
+                                encoders=encoders,
+                                transform=transform,
+                                nTotal=nTotal,
+                                feedback=feedback)
         del writer
 
         # set profile column styles etc.
@@ -245,6 +242,13 @@ class GeoJsonSpectralLibraryIO(SpectralLibraryIO):
                        path: str,
                        importSettings: dict = dict(),
                        feedback: QgsProcessingFeedback = QgsProcessingFeedback()) -> List[QgsFeature]:
-        lyr = QgsVectorLayer(Path(path).as_posix())
-        lyr.loadDefaultStyle()
-        return list(lyr.getFeatures())
+        return list(cls.iterateVectorLayerProfiles(path))
+
+    @classmethod
+    def iterateProfiles(cls,
+                        path: str,
+                        importSettings: Optional[dict] = None,
+                        attributes: Optional[List[str]] = None,
+                        filterExpression: Optional[str] = None,
+                        feedback: QgsProcessingFeedback = QgsProcessingFeedback()) -> Iterator[QgsFeature]:
+        return cls.iterateVectorLayerProfiles(path, attributes=attributes, filterExpression=filterExpression)
@@ -1,8 +1,10 @@
 import os
 import pathlib
-from typing import Any, List, Union
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
 
 import numpy as np
+from osgeo import gdal
 from osgeo.gdalconst import DMD_CREATIONFIELDDATASUBTYPES
 from osgeo.ogr import Driver, GetDriverByName
 from qgis.core import QgsCoordinateReferenceSystem, QgsCoordinateTransformContext, QgsExpressionContext, QgsFeature, \
@@ -10,11 +12,39 @@ from qgis.core import QgsCoordinateReferenceSystem, QgsCoordinateTransformContex
 from qgis.PyQt.QtCore import QVariant
 
 from ..core import is_profile_field
-from ..core.spectrallibraryio import SpectralLibraryExportWidget, SpectralLibraryImportWidget, SpectralLibraryIO
+from ..core.spectrallibraryio import ProfileColumnEncoder, SpectralLibraryExportWidget, SpectralLibraryImportWidget, \
+    SpectralLibraryIO
 from ..core.spectralprofile import decodeProfileValueDict, encodeProfileValueDict
 from ...qgisenums import QMETATYPE_QSTRING
 
 
+# SQLite settings used to write GeoPackages. Each new file is written in a single transaction.
+# Without journal, a failed export may leave a corrupt file, which is overwritten by the next export anyway.
+GPKG_WRITER_CONFIG_OPTIONS = {
+    'OGR_SQLITE_PRAGMA': 'page_size=65536',
+    'OGR_SQLITE_JOURNAL': 'OFF',
+    'OGR_SQLITE_SYNCHRONOUS': 'OFF',
+    'OGR_SQLITE_CACHE': '512',
+}
+
+
+@contextmanager
+def gdalConfigOptions(options: Dict[str, str]):
+    """
+    Sets GDAL configuration options for the current thread only and restores the previous values on exit.
+    Datasets opened in other threads, e.g. by map renderers, are not affected.
+    :param options: dict with {option name: value}
+    """
+    previous = {k: gdal.GetThreadLocalConfigOption(k) for k in options.keys()}
+    try:
+        for k, v in options.items():
+            gdal.SetThreadLocalConfigOption(k, v)
+        yield
+    finally:
+        for k, v in previous.items():
+            gdal.SetThreadLocalConfigOption(k, v)
+
+
 class GeoPackageSpectralLibraryExportWidget(SpectralLibraryExportWidget):
 
     def __init__(self, *args, **kwds):
@@ -92,6 +122,7 @@ class GeoPackageFieldValueConverter(QgsVectorFileWriter.FieldValueConverter):
         # define converter functions
         self.mFieldDefinitions = dict()
         self.mFieldConverters = dict()
+        self.mProfileFields: Dict[int, QgsField] = dict()
 
         # can it write JSON fields?
         drv: Driver = GetDriverByName('GPKG')
@@ -105,6 +136,7 @@ class GeoPackageFieldValueConverter(QgsVectorFileWriter.FieldValueConverter):
                 convertedField = QgsField(name=name, type=QMETATYPE_QSTRING, len=-1)
                 self.mFieldDefinitions[name] = convertedField
                 self.mFieldConverters[idx] = lambda v, f=convertedField: self.convertProfileField(v, f)
+                self.mProfileFields[idx] = convertedField
             else:
                 self.mFieldDefinitions[name] = QgsField(super().fieldDefinition(field))
                 self.mFieldConverters[idx] = lambda v: v
@@ -118,6 +150,14 @@ class GeoPackageFieldValueConverter(QgsVectorFileWriter.FieldValueConverter):
     def clone(self) -> QgsVectorFileWriter.FieldValueConverter:
         return GeoPackageFieldValueConverter(self.mFields)
 
+    def profileColumnEncoders(self, encoder: Callable = ProfileColumnEncoder) -> Dict[int, ProfileColumnEncoder]:
+        """
+        Returns encoders that convert the profile fields column-wise, like convertProfileField
+        :param encoder: ProfileColumnEncoder class or a function that returns a ProfileColumnEncoder for a field
+        :return: dict with {field index: ProfileColumnEncoder}
+        """
+        return {idx: encoder(field) for idx, field in self.mProfileFields.items()}
+
     def convert(self, fieldIdxInLayer: int, value: Any) -> Any:
         return self.mFieldConverters[fieldIdxInLayer](value)
 
@@ -173,8 +213,8 @@ class GeoPackageSpectralLibraryIO(SpectralLibraryIO):
         if isinstance(path, pathlib.Path):
             path = path.as_posix()
 
-        profiles, fields, crs, wkbType = cls.extractWriterInfos(profiles, exportSettings)
-        if len(profiles) == 0:
+        profiles, fields, crs, wkbType, nTotal = cls.extractWriterStream(profiles, exportSettings)
+        if nTotal == 0:
             return []
 
         newLayerName = exportSettings.get('layer_name', '')
@@ -197,25 +237,28 @@ class GeoPackageSpectralLibraryIO(SpectralLibraryIO):
 
         transformationContext = QgsCoordinateTransformContext()
 
+        # profile values are encoded column-wise before being written,
+        # so the writer does not need to convert them per feature
         converter = GeoPackageFieldValueConverter(fields)
-        options.fieldValueConverter = converter
         convertedFields = converter.convertedFields()
-
-        writer: QgsVectorFileWriter = QgsVectorFileWriter.create(path,
-                                                                 convertedFields,
-                                                                 # fields,
-                                                                 wkbType,
-                                                                 crs,
-                                                                 transformationContext,
-                                                                 options)
-        if writer.hasError() != QgsVectorFileWriter.NoError:
-            raise Exception(f'Error when creating {path}: {writer.errorMessage()}')
-
-        if not writer.addFeatures(profiles):
+        encoders = converter.profileColumnEncoders(exportSettings.get('profile_encoder', ProfileColumnEncoder))
+
+        configOptions = dict(GPKG_WRITER_CONFIG_OPTIONS)
+        configOptions.update(exportSettings.get('gdal_config_options', dict()))
+
+        with gdalConfigOptions(configOptions):
+            # the writer inserts all features within a single transaction, which is committed when it gets deleted
+            writer: QgsVectorFileWriter = QgsVectorFileWriter.create(path,
+                                                                     convertedFields,
+                                                                     wkbType,
+                                                                     crs,
+                                                                     transformationContext,
+                                                                     options)
             if writer.hasError() != QgsVectorFileWriter.NoError:
-                raise Exception(f'Error when creating feature: {writer.errorMessage()}')
+                raise Exception(f'Error when creating {path}: {writer.errorMessage()}')
 
-        del writer
+            cls.writeFeatureBatches(writer, profiles, encoders=encoders, nTotal=nTotal, feedback=feedback)
+            del writer
 
         cls.copyEditorWidgetSetup(path, fields)
 
@@ -226,7 +269,13 @@ class GeoPackageSpectralLibraryIO(SpectralLibraryIO):
                        path: str,
                        importSettings: dict = dict(),
                        feedback: QgsProcessingFeedback = QgsProcessingFeedback()) -> List[QgsFeature]:
-        lyr = QgsVectorLayer(path)
-        # load editor widget information on spectral profile fields
-        lyr.loadDefaultStyle()
-        return list(lyr.getFeatures())
+        return list(cls.iterateVectorLayerProfiles(path))
+
+    @classmethod
+    def iterateProfiles(cls,
+                        path: str,
+                        importSettings: Optional[dict] = None,
+                        attributes: Optional[List[str]] = None,
+                        filterExpression: Optional[str] = None,
+                        feedback: QgsProcessingFeedback = QgsProcessingFeedback()) -> Iterator[QgsFeature]:
+        return cls.iterateVectorLayerProfiles(path, attributes=attributes, filterExpression=filterExpression)
@@ -2,9 +2,11 @@ import calendar
 import copy
 import datetime
 import re
+import threading
 import warnings
+from collections import OrderedDict
 from math import log10
-from typing import List, Union, Iterator
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
 
 import numpy as np
 from qgis.PyQt.QtCore import Qt, NULL, QAbstractListModel, QModelIndex, QDate, QDateTime
@@ -250,19 +252,25 @@ class UnitConverterFunctionModel(object):
         # unit1 != None and unit2 != None
         self.mLUT = dict()
 
+        # memoized results of convertFunction(unitSrc, unitDst)
+        self.mFunctionCache: Dict[Tuple[str, str], Callable] = dict()
+        # increased with each added function, to invalidate values converted with previous functions
+        self.mRevision: int = 0
+
         self.func_return_band_index = lambda v, *args: np.arange(len(v))
         self.func_return_band_number = lambda v, *args: np.arange(len(v)) + 1
         self.func_return_none = lambda v, *args: None
         self.func_return_same = lambda v, *args: v
         self.func_return_decimalyear = lambda v, *args: UnitLookup.convertDateUnit(v, 'DecimalYear')
 
-        # length units
-        for u1, e1 in UnitLookup.LENGTH_UNITS.items():
-            for u2, e2 in UnitLookup.LENGTH_UNITS.items():
-                key = (u1, u2)
-                if key not in self.mLUT.keys():
-                    if u1 != u2:
-                        self.mLUT[key] = lambda v, *args, k1=u1, k2=u2: UnitLookup.convertLengthUnit(v, k1, k2)
+        # length and area units
+        for units in [UnitLookup.LENGTH_UNITS, UnitLookup.AREA_UNITS]:
+            for u1, e1 in units.items():
+                for u2, e2 in units.items():
+                    key = (u1, u2)
+                    if key not in self.mLUT.keys():
+                        if u1 != u2:
+                            self.mLUT[key] = UnitConverterFunctionModel.scaleFunction(10 ** (e1 - e2))
 
         # time units
         # convert between DecimalYear and DateTime stamp
@@ -273,6 +281,24 @@ class UnitConverterFunctionModel(object):
         self.mLUT[('DecimalYear', 'DOY')] = lambda v, *args: UnitLookup.convertDateUnit(v, 'DOY')
         self.mLUT[('DateTime', 'DOY')] = lambda v, *args: UnitLookup.convertDateUnit(v, 'DOY')
 
+    @staticmethod
+    def scaleFunction(factor: float) -> Callable:
+        """
+        Returns a function that multiplies values with a constant factor.
+        Lists are converted into numpy arrays, so that the values are scaled in a single operation.
+        :param factor: float
+        :return: function
+        """
+
+        def func(v, *args):
+            if v is None:
+                return None
+            if isinstance(v, (list, tuple)):
+                v = np.asarray(v, dtype=np.float64)
+            return v * factor
+
+        return func
+
     def __iter__(self):
         return iter(self.mLUT.items())
 
@@ -299,8 +325,31 @@ class UnitConverterFunctionModel(object):
 
         assert k not in self.mLUT, k
         self.mLUT[k] = func
+        self.mFunctionCache.clear()
+        self.mRevision += 1
 
-    def convertFunction(self, unitSrc: str, unitDst: str):
+    def revision(self) -> int:
+        """
+        Returns the revision of the conversion functions, which changes with each call of addConvertFunc.
+        :return: int
+        """
+        return self.mRevision
+
+    def convertFunction(self, unitSrc: str, unitDst: str) -> Callable:
+        """
+        Returns a function to convert values from unitSrc into unitDst
+        :param unitSrc: str
+        :param unitDst: str
+        :return: function
+        """
+        key = (unitSrc, unitDst)
+        func = self.mFunctionCache.get(key)
+        if func is None:
+            func = self._convertFunction(unitSrc, unitDst)
+            self.mFunctionCache[key] = func
+        return func
+
+    def _convertFunction(self, unitSrc: str, unitDst: str) -> Callable:
         if unitDst == BAND_INDEX:
             return self.func_return_band_index
         elif unitDst in [BAND_NUMBER, None, '']:
@@ -400,15 +449,20 @@ class UnitLookup(object):
     # AREA_UNITS.update({f'{k}': log10_with_sign(v) for k, v in IMPERIAL_AREA_UNITS.items()})
     AREA_UNITS = {f'{k}²': 2 * v for k, v in LENGTH_UNITS.items()}
     AREA_UNITS['ha'] = 4  # because 10^4 m = 1 ha
-    AREA_UNITS.update({f'{k}': 2 * v for k, v in IMPERIAL_AREA_UNITS.items()})
+    AREA_UNITS.update({f'{k}': log10(v) for k, v in IMPERIAL_AREA_UNITS.items()})
 
     # a dictionary to lookup other names of length or area units
     # e.g. UNIT_LOOKUP['meters'] = 'm'
-    # will be filled dynamically
     UNIT_LOOKUP = {BAND_INDEX: BAND_INDEX,
                    BAND_NUMBER: BAND_NUMBER,
                    None: None}
 
+    # base units of the most recently used unit strings, including strings without known base unit
+    # e.g. _BASE_UNIT_CACHE['Meters'] = 'm'
+    MAX_CACHED_BASE_UNITS: int = 1024
+    _BASE_UNIT_CACHE: Dict[str, Optional[str]] = OrderedDict()
+    _LOCK = threading.Lock()
+
     @staticmethod
     def metric_units() -> List[str]:
         warnings.warn(DeprecationWarning('Use area_units() or length_units()'), stacklevel=2)
@@ -444,20 +498,36 @@ class UnitLookup(object):
         if not isinstance(unit, str):
             return None
 
-        unit = unit.strip()
+        if unit in UnitLookup.UNIT_LOOKUP.keys():
+            return UnitLookup.UNIT_LOOKUP[unit]
+
+        cache = UnitLookup._BASE_UNIT_CACHE
+        with UnitLookup._LOCK:
+            if unit in cache:
+                cache.move_to_end(unit)
+                return cache[unit]
+
+        base_unit = UnitLookup._baseUnit(unit.strip())
+        # remember the unit string for fast conversion into its base unit,
+        # including strings without known base unit, to not match them against all patterns again
+        with UnitLookup._LOCK:
+            cache[unit] = base_unit
+            while len(cache) > UnitLookup.MAX_CACHED_BASE_UNITS:
+                cache.popitem(last=False)
+        return base_unit
+
+    @staticmethod
+    def _baseUnit(unit: str) -> Optional[str]:
 
         if unit in UnitLookup.UNIT_LOOKUP.keys():
             return UnitLookup.UNIT_LOOKUP[unit]
 
         # so far this unit is unknown. Try to find the base unit
-        # store unit string in Lookup table for fast conversion into its base unit
         # e.g. to convert string like "MiKrOMetErS" to "μm"
         base_unit = None
 
-        if unit in UnitLookup.length_units() + \
-                UnitLookup.area_units() + \
-                UnitLookup.date_units() + \
-                UnitLookup.time_units():
+        if unit in UnitLookup.LENGTH_UNITS or unit in UnitLookup.AREA_UNITS or \
+                unit in UnitLookup.DATE_UNITS or unit in UnitLookup.TIME_UNITS:
             return unit
 
         # Area units?
@@ -546,9 +616,6 @@ class UnitLookup(object):
         elif re.search(r'^nautical[_ ]miles?$', unit, re.I):
             base_unit = 'nmi'
 
-        if base_unit:
-            # store the base_unit, unit pair into a global lookup table
-            UnitLookup.UNIT_LOOKUP[unit] = base_unit
         return base_unit
 
     @staticmethod
@@ -583,6 +650,14 @@ class UnitLookup(object):
         warnings.warn(DeprecationWarning('Use convertLengthUnit'), stacklevel=2)
         return UnitLookup.convertLengthUnit(*args, **kwds)
 
+    @staticmethod
+    def _scaleValues(value, factor: float):
+        # lists are scaled as numpy array and returned as list
+        if isinstance(value, list):
+            return (np.asarray(value, dtype=np.float64) * factor).tolist()
+        else:
+            return value * factor
+
     @staticmethod
     def convertLengthUnit(value: Union[float, np.ndarray], u1: str, u2: str) -> float:
         """
@@ -605,10 +680,8 @@ class UnitLookup(object):
         if all([arg is not None for arg in [value, e1, e2]]):
             if e1 == e2:
                 return copy.copy(value)
-            elif isinstance(value, list):
-                return [v * 10 ** (e1 - e2) for v in value]
             else:
-                return value * 10 ** (e1 - e2)
+                return UnitLookup._scaleValues(value, 10 ** (e1 - e2))
         else:
             return None
 
@@ -636,10 +709,8 @@ class UnitLookup(object):
         if all([arg is not None for arg in [value, e1, e2]]):
             if e1 == e2:
                 return copy.copy(value)
-            elif isinstance(value, list):
-                return [v * 10 ** (e1 - e2) for v in value]
             else:
-                return value * 10 ** (e1 - e2)
+                return UnitLookup._scaleValues(value, 10 ** (e1 - e2))
         else:
             return None
 
@@ -663,46 +734,109 @@ class UnitLookup(object):
             return None
         # see https://numpy.org/doc/stable/reference/arrays.datetime.html#arrays-dtypes-dateunits
         # for valid date units
-        if isinstance(value, (np.ndarray, list)):
-            func = np.vectorize(UnitLookup.convertDateUnit)
-            return func(value, unit)
+        is_array = isinstance(value, (np.ndarray, list))
+        values = np.asarray(datetime64(value))
+        values = values.astype(datetime64_unit(values.dtype, 's'))
 
-        value = datetime64(value)
         if unit == 'Y':
-            return value.astype(object).year
+            result = values.astype('datetime64[Y]').astype(np.int64) + 1970
         elif unit == 'M':
-            return value.astype(object).month
+            result = values.astype('datetime64[M]').astype(np.int64) % 12 + 1
         elif unit == 'D':
-            return value.astype(object).day
+            result = day_count(values) - day_count(values.astype('datetime64[M]')) + 1
         elif unit == 'W':
-            return value.astype(object).week
+            result = np.vectorize(lambda d: d.isocalendar()[1], otypes=[np.int64])(
+                values.astype('datetime64[D]').astype(object))
         elif unit == 'DOY':
-            return ((value - value.astype('datetime64[Y]')).astype('timedelta64[D]') + 1).astype(int)
-
+            result = day_of_year(values)
         elif unit.startswith('DecimalYear'):
-            year = value.astype(object).year
-            year64 = value.astype('datetime64[Y]')
-
-            # second of year
-            soy = (value - year64).astype('timedelta64[s]').astype(np.float64)
-
-            # seconds per year
             if unit == 'DecimalYear[366]':
-                spy = 366 * 86400
+                dpy = 366
             elif unit == 'DecimalYear[365]':
-                spy = 365 * 86400
+                dpy = 365
             else:
-                spy = 366 if calendar.isleap(year) else 365
-                spy *= 86400
-            spy2 = np.datetime64('{:04}-01-01T00:00:00'.format(year + 1)) - np.datetime64(
-                '{:04}-01-01T00:00:00'.format(year))
-            spy2 = int(spy2.astype(int))
-            if spy != spy2:
-                s = ""
-            return float(year + soy / spy)
+                dpy = None
+            result = datetime64_to_decimal_year(values, dpy=dpy)
         else:
             raise NotImplementedError()
 
+        if is_array:
+            return result
+        return result.item()
+
+
+def datetime64_unit(dtype: np.dtype, unit: str) -> str:
+    """
+    Returns the datetime64 type with the finer resolution of `dtype` and `unit`
+    :param dtype: numpy.datetime64 dtype
+    :param unit: str, e.g. 's'
+    :return: str, e.g. 'datetime64[s]' or 'datetime64[ms]'
+    """
+    return np.promote_types(dtype, np.dtype(f'datetime64[{unit}]')).str
+
+
+def day_count(dates: np.ndarray) -> np.ndarray:
+    """
+    Returns the number of days since 1970-01-01 as int64 values
+    :param dates: numpy.datetime64 array
+    :return: numpy.ndarray[int64]
+    """
+    return np.asarray(dates).astype('datetime64[D]').astype(np.int64)
+
+
+def is_leap_year(year) -> np.ndarray:
+    """
+    Returns True for leap years
+    :param year: int | numpy.ndarray of int
+    :return: bool | numpy.ndarray of bool
+    """
+    year = np.asarray(year, dtype=np.int64)
+    return (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+
+
+def datetime64_to_decimal_year(dates: np.ndarray, dpy: int = None) -> np.ndarray:
+    """
+    Converts numpy.datetime64 values into decimal years.
+    :param dates: numpy.datetime64 array
+    :param dpy: days per year. Defaults to 366 in leap years and 365 in none-leap years.
+    :return: numpy.ndarray of float64
+    """
+    dates = np.asarray(dates)
+    dates = dates.astype(datetime64_unit(dates.dtype, 's'))
+    year64 = dates.astype('datetime64[Y]')
+    year = year64.astype(np.int64) + 1970
+
+    # seconds of year
+    soy = (dates - year64).astype('timedelta64[s]').astype(np.float64)
+
+    # seconds per year
+    if dpy is None:
+        spy = np.where(is_leap_year(year), 366, 365) * 86400
+    else:
+        spy = dpy * 86400
+    return year + soy / spy
+
+
+def decimal_year_to_datetime64(values: np.ndarray, dpy: int = None) -> np.ndarray:
+    """
+    Converts decimal years into numpy.datetime64 values with second precision.
+    :param values: numpy.ndarray of float
+    :param dpy: days per year used to calculate the year fraction.
+                Defaults to 366 in leap years and 365 in none-leap years.
+    :return: numpy.ndarray of numpy.datetime64[s]
+    """
+    values = np.asarray(values, dtype=np.float64)
+    year = np.trunc(values).astype(np.int64)
+    fraction = values - year
+
+    if dpy is None:
+        dpy = np.where(is_leap_year(year), 366, 365)
+    else:
+        assert dpy in [365, 366]
+    # seconds of year
+    soy = np.round(fraction * dpy * 86400).astype(np.int64)
+    return (year - 1970).astype('datetime64[Y]').astype('datetime64[s]') + soy.astype('timedelta64[s]')
+
 
 def datetime64(value, dpy: int = None) -> np.datetime64:
     """
@@ -727,19 +861,20 @@ def datetime64(value, dpy: int = None) -> np.datetime64:
         return np.datetime64('{:04}-01-01'.format(value))
     elif isinstance(value, float):
         # expect a decimal year
-        year = int(value)
-        fraction = value - year
-
-        if dpy is None:
-            dpy = 366 if calendar.isleap(year) else 365
-        else:
-            assert dpy in [365, 366]
-        # seconds of year
-        soy = np.round(fraction * dpy * 86400).astype(int)
-        return np.datetime64('{:04}-01-01'.format(year)) + np.timedelta64(soy, 's')
+        return decimal_year_to_datetime64(value, dpy=dpy)[()]
 
     if isinstance(value, np.ndarray):
-        func = np.vectorize(datetime64)
+        kind = value.dtype.kind
+        if kind == 'M':
+            return value
+        elif kind == 'f':
+            return decimal_year_to_datetime64(value, dpy=dpy)
+        elif kind in 'iu':
+            # expect years
+            return (value.astype(np.int64) - 1970).astype('datetime64[Y]').astype('datetime64[D]')
+        elif kind in 'US':
+            return value.astype('datetime64')
+        func = np.vectorize(lambda v: datetime64(v, dpy=dpy))
         return func(value)
     elif isinstance(value, list):
         return datetime64(np.asarray(value), dpy=dpy)
@@ -753,11 +888,10 @@ def day_of_year(date: np.datetime64) -> int:
     :param date: numpy.datetime64
     :return: numpy.ndarray[int]
     """
-    if not isinstance(date, np.datetime64):
+    if not isinstance(date, (np.datetime64, np.ndarray)):
         date = np.datetime64(date)
-
-    dt = date - date.astype('datetime64[Y]') + 1
-    return dt.astype(int)
+    date = np.asarray(date)
+    return day_count(date) - day_count(date.astype('datetime64[Y]')) + 1
 
 
 def days_per_year(year):
@@ -778,8 +912,13 @@ def days_per_year(year):
     elif isinstance(year, datetime.datetime):
         year = year.year
     elif isinstance(year, np.ndarray):
-        func = np.vectorize(days_per_year)
-        return func(year)
+        if year.dtype.kind == 'M':
+            year = year.astype('datetime64[Y]').astype(np.int64) + 1970
+        elif year.dtype.kind in 'iuf':
+            year = np.trunc(year).astype(np.int64)
+        else:
+            return np.vectorize(days_per_year)(year)
+        return np.where(is_leap_year(year), 366, 365)
 
     return 366 if calendar.isleap(year) else 365
 
@@ -37,14 +37,16 @@ import os
 import re
 import shutil
 import sys
+import threading
 import traceback
 import warnings
 import weakref
 import zipfile
 from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from math import floor
 from pathlib import Path
-from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Pattern, Tuple, Union
 
 import numpy as np
 from osgeo import gdal, gdal_array, ogr, osr
@@ -52,7 +54,7 @@ from osgeo.ogr import OFSTBoolean, OFSTNone, OFTBinary, OFTDate, OFTDateTime, OF
     OFTString, \
     OFTStringList, OFTTime
 from osgeo.osr import SpatialReference
-from qgis.PyQt import uic
+from qgis.PyQt import sip, uic
 from qgis.PyQt.QtCore import NULL, QByteArray, QDirIterator, QMetaType, QObject, QPoint, QPointF, QRect, Qt, QUrl, \
     QVariant
 from qgis.PyQt.QtGui import QColor, QIcon
@@ -74,7 +76,7 @@ from .qgisenums import QGIS_LAYERFILTER, QGIS_WKBTYPE, QMETATYPE_BOOL, QMETATYPE
     QMETATYPE_QTIME, \
     QMETATYPE_QVARIANTLIST, \
     QMETATYPE_UINT
-from .qgsrasterlayerproperties import QgsRasterLayerSpectralProperties
+from .qgsrasterlayerproperties import SpectralMetadataCache
 from .unitmodel import datetime64, UnitLookup
 
 QGIS_RESOURCE_WARNINGS = set()
@@ -298,60 +300,298 @@ def findUpwardPath(basepath, name, is_directory: bool = True) -> Optional[Path]:
 
 
 #
+def filePatternMatcher(pattern: Union[str, Pattern, Iterable[Union[str, Pattern]]],
+                       ignoreCase: bool = False) -> Callable[[str], bool]:
+    """
+    Compiles one or multiple wildcard expressions ("my*files.*") or regular expressions
+    into a single function that returns True if a name matches any of them.
+    :param pattern: wildcard or regular expression, or a list of them
+    :param ignoreCase: set True to ignore character case.
+    :return: function(name: str) -> bool
+    """
+    if isinstance(pattern, (str, re.Pattern)):
+        pattern = [pattern]
+    flags = re.IGNORECASE if ignoreCase else 0
+
+    wildcards = [p for p in pattern if isinstance(p, str)]
+    regexes: List[Pattern] = []
+    if len(wildcards) > 0:
+        # wildcards need to match the entire name
+        regexes.append(re.compile('^(?:{})'.format('|'.join(fnmatch.translate(w) for w in wildcards)), flags))
+    for p in pattern:
+        if isinstance(p, re.Pattern):
+            if ignoreCase and not p.flags & re.IGNORECASE:
+                p = re.compile(p.pattern, p.flags | re.IGNORECASE)
+            regexes.append(p)
+
+    if len(regexes) == 1:
+        rx = regexes[0]
+        return lambda name: rx.search(name) is not None
+    return lambda name: any(rx.search(name) for rx in regexes)
+
+
 def file_search(rootdir,
                 pattern,
                 recursive: bool = False,
                 ignoreCase: bool = False,
                 directories: bool = False,
-                fullpath: bool = False):
+                fullpath: bool = False,
+                excludeDirs: Union[str, Pattern, List[Union[str, Pattern]]] = None,
+                includeDirs: Union[str, Pattern, List[Union[str, Pattern]]] = None,
+                maxDepth: int = None,
+                maxResults: int = None,
+                threads: int = 1) -> Iterator[str]:
     """
     Searches for files or folders
     :param rootdir: root directory to search in
-    :param pattern: wildcard ("my*files.*") or regular expression that describes the file or folder name.
+    :param pattern: wildcard ("my*files.*") or regular expression that describes the file or folder name,
+                    or a list of them.
     :param recursive: set True to search recursively.
     :param ignoreCase: set True to ignore character case.
     :param directories: set True to search for directories/folders instead of files.
     :param fullpath: set True if the entire path should be evaluated and not the file name only
+    :param excludeDirs: wildcard(s) or regular expression(s) of directory names to skip entirely.
+    :param includeDirs: wildcard(s) or regular expression(s) of directory names to descend into.
+                        Defaults to all directories.
+    :param maxDepth: maximum number of directory levels to descend into below rootdir, if recursive is True.
+    :param maxResults: stop the search after maxResults files or folders have been found.
+    :param threads: number of threads that scan directories in parallel.
+                    If > 1, results are returned in the order they are found.
     :return: enumerator over file paths
     """
     assert os.path.isdir(rootdir), "Path is not a directory:{}".format(rootdir)
-    regType = type(re.compile('.*'))
-
-    with os.scandir(rootdir) as entry_search:
-        for entry in entry_search:
-            if directories is False:
-                if entry.is_file():
-                    if fullpath:
-                        name = entry.path
-                    else:
-                        name = os.path.basename(entry.path)
-                    if isinstance(pattern, regType):
-                        if pattern.search(name):
-                            yield entry.path.replace('\\', '/')
-
-                    elif (ignoreCase and fnmatch.fnmatch(name, pattern.lower())) \
-                            or fnmatch.fnmatch(name, pattern):
-                        yield entry.path.replace('\\', '/')
-                elif entry.is_dir() and recursive is True:
-                    for r in file_search(entry.path, pattern, recursive=recursive, directories=directories):
-                        yield r
-            else:
-                if entry.is_dir():
-                    if recursive is True:
-                        for d in file_search(entry.path, pattern, recursive=recursive, directories=directories):
-                            yield d
 
-                    if fullpath:
-                        name = entry.path
-                    else:
-                        name = os.path.basename(entry.path)
-                    if isinstance(pattern, regType):
-                        if pattern.search(name):
-                            yield entry.path.replace('\\', '/')
+    matches = filePatternMatcher(pattern, ignoreCase=ignoreCase)
+    isExcluded = filePatternMatcher(excludeDirs, ignoreCase=ignoreCase) if excludeDirs else None
+    isIncluded = filePatternMatcher(includeDirs, ignoreCase=ignoreCase) if includeDirs else None
+
+    def scan(path: str, depth: int) -> Tuple[List[str], List[str], int]:
+        # returns the matching entries and the sub-directories to descend into
+        found = []
+        subDirs = []
+        descend = recursive is True and (maxDepth is None or depth < maxDepth)
+        try:
+            with os.scandir(path) as entry_search:
+                for entry in entry_search:
+                    if entry.is_dir():
+                        if isExcluded and isExcluded(entry.name):
+                            continue
+                        if descend and (isIncluded is None or isIncluded(entry.name)):
+                            subDirs.append(entry.path)
+                        if directories is False:
+                            continue
+                    elif directories is True or not entry.is_file():
+                        continue
+
+                    name = entry.path if fullpath else entry.name
+                    if matches(name):
+                        found.append(entry.path.replace('\\', '/'))
+        except OSError:
+            # e.g. missing permissions to read a sub-directory
+            pass
+        return found, subDirs, depth
+
+    nFound = 0
+    if threads is None or threads <= 1:
+        stack = [(rootdir, 0)]
+        while len(stack) > 0:
+            found, subDirs, depth = scan(*stack.pop())
+            stack.extend((d, depth + 1) for d in reversed(subDirs))
+            for path in found:
+                yield path
+                nFound += 1
+                if maxResults and nFound >= maxResults:
+                    return
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            pending = {pool.submit(scan, rootdir, 0)}
+            try:
+                while len(pending) > 0:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        found, subDirs, depth = future.result()
+                        for d in subDirs:
+                            pending.add(pool.submit(scan, d, depth + 1))
+                        for path in found:
+                            yield path
+                            nFound += 1
+                            if maxResults and nFound >= maxResults:
+                                return
+            finally:
+                for future in pending:
+                    future.cancel()
+
+
+class MapLayerIndex(QObject):
+    """
+    Indexes the QgsMapLayers of registered QgsMapLayerStores and QgsProjects by layer id, name and source.
+    The index is kept in sync with the layersAdded / layersRemoved signals of each store, so that
+    layers can be resolved in O(1), e.g. per feature during expression evaluation.
+    Store signals are handled in the emitting thread, so all index changes are guarded by a lock.
+    """
+
+    def __init__(self, *args, **kwds):
+        super().__init__(*args, **kwds)
+        # re-entrant, as lookups may remove deleted layers
+        self.mLock = threading.RLock()
+        self.mStores: List[Union[QgsProject, QgsMapLayerStore]] = []
+        self.mLayers: Dict[str, QgsMapLayer] = dict()
+        self.mKeys: Dict[str, Tuple[str, str]] = dict()
+        self.mNames: Dict[str, List[str]] = dict()
+        self.mSources: Dict[str, List[str]] = dict()
+
+    def stores(self) -> List[Union[QgsProject, QgsMapLayerStore]]:
+        """
+        Returns the indexed map layer stores
+        """
+        with self.mLock:
+            return self.mStores[:]
+
+    def addStore(self, store: Union[QgsProject, QgsMapLayerStore]):
+        """
+        Adds a QgsMapLayerStore or QgsProject and indexes its layers
+        :param store: QgsProject | QgsMapLayerStore
+        """
+        assert isinstance(store, (QgsProject, QgsMapLayerStore))
+        with self.mLock:
+            if any(s is store for s in self.mStores):
+                return
+            self.mStores.append(store)
+        # direct connections, as layers might be resolved in non-GUI threads
+        store.layersAdded.connect(self.onLayersAdded, Qt.DirectConnection)
+        store.layersRemoved.connect(self.onLayersRemoved, Qt.DirectConnection)
+        store.destroyed.connect(self.onStoreDestroyed, Qt.DirectConnection)
+        self.onLayersAdded(store.mapLayers().values())
+
+    def onStoreDestroyed(self, *args):
+        with self.mLock:
+            self.mStores = [s for s in self.mStores if not sip.isdeleted(s)]
+            for lid in [lid for lid, lyr in self.mLayers.items() if sip.isdeleted(lyr)]:
+                self._removeLayer(lid)
+
+    def onLayersAdded(self, layers: Iterable[QgsMapLayer]):
+        added = []
+        with self.mLock:
+            for lyr in layers:
+                if isinstance(lyr, QgsMapLayer) and lyr.id() not in self.mLayers:
+                    self.mLayers[lyr.id()] = lyr
+                    self._addKeys(lyr)
+                    added.append(lyr)
+        for lyr in added:
+            lyr.nameChanged.connect(self.onLayerChanged, Qt.DirectConnection)
+            lyr.dataSourceChanged.connect(self.onLayerChanged, Qt.DirectConnection)
+
+    def onLayersRemoved(self, layerIds: Iterable[str]):
+        with self.mLock:
+            for lid in layerIds:
+                # the same layer might still be part of another store
+                if not any(not sip.isdeleted(s) and isinstance(s.mapLayer(lid), QgsMapLayer) for s in self.mStores):
+                    self._removeLayer(lid)
+
+    def onLayerChanged(self, *args):
+        lyr = self.sender()
+        with self.mLock:
+            if isinstance(lyr, QgsMapLayer) and self.mLayers.get(lyr.id()) is lyr:
+                self._removeKeys(lyr.id())
+                self._addKeys(lyr)
+
+    def _addKeys(self, lyr: QgsMapLayer):
+        lid = lyr.id()
+        name, source = lyr.name(), lyr.source()
+        self.mKeys[lid] = (name, source)
+        self.mNames.setdefault(name, []).append(lid)
+        self.mSources.setdefault(source, []).append(lid)
+
+    def _removeKeys(self, lid: str):
+        name, source = self.mKeys.pop(lid)
+        for key, lookup in [(name, self.mNames), (source, self.mSources)]:
+            ids = lookup[key]
+            ids.remove(lid)
+            if len(ids) == 0:
+                del lookup[key]
+
+    def _removeLayer(self, lid: str):
+        if self.mLayers.pop(lid, None) is not None:
+            self._removeKeys(lid)
+
+    def _validLayer(self, lid: str) -> Optional[QgsMapLayer]:
+        with self.mLock:
+            lyr = self.mLayers.get(lid)
+            if lyr is None:
+                return None
+            if sip.isdeleted(lyr):
+                self._removeLayer(lid)
+                return None
+            return lyr
+
+    def layer(self, layerId: str) -> Optional[QgsMapLayer]:
+        """
+        Returns the layer with id layerId
+        :param layerId: str
+        :return: QgsMapLayer or None
+        """
+        return self._validLayer(layerId)
+
+    def layersByName(self, name: str) -> List[QgsMapLayer]:
+        """
+        Returns the layers named name
+        :param name: str
+        :return: [list-of-QgsMapLayers]
+        """
+        with self.mLock:
+            layers = [self._validLayer(lid) for lid in self.mNames.get(name, [])[:]]
+        return [lyr for lyr in layers if isinstance(lyr, QgsMapLayer)]
+
+    def layersBySource(self, source: str) -> List[QgsMapLayer]:
+        """
+        Returns the layers with data source source
+        :param source: str
+        :return: [list-of-QgsMapLayers]
+        """
+        with self.mLock:
+            layers = [self._validLayer(lid) for lid in self.mSources.get(source, [])[:]]
+        return [lyr for lyr in layers if isinstance(lyr, QgsMapLayer)]
+
+    def findLayer(self, key: str) -> Optional[QgsMapLayer]:
+        """
+        Returns the first layer that matches the key by layer id, name or source
+        :param key: str
+        :return: QgsMapLayer or None
+        """
+        lyr = self.layer(key)
+        if lyr is None:
+            for lyr in self.layersByName(key) + self.layersBySource(key):
+                return lyr
+        return lyr
+
+    def layers(self) -> List[QgsMapLayer]:
+        """
+        Returns all indexed layers
+        :return: [list-of-QgsMapLayers]
+        """
+        with self.mLock:
+            return [lyr for lyr in self.mLayers.values() if not sip.isdeleted(lyr)]
+
 
-                    elif (ignoreCase and fnmatch.fnmatch(name, pattern.lower())) \
-                            or fnmatch.fnmatch(name, pattern):
-                        yield entry.path.replace('\\', '/')
+_MAP_LAYER_INDEX: Optional[MapLayerIndex] = None
+_MAP_LAYER_INDEX_LOCK = threading.Lock()
+
+
+def mapLayerIndex() -> MapLayerIndex:
+    """
+    Returns the MapLayerIndex of all registered map layer stores (including QgsProject.instance())
+    :return: MapLayerIndex
+    """
+    global _MAP_LAYER_INDEX
+    with _MAP_LAYER_INDEX_LOCK:
+        if _MAP_LAYER_INDEX is None:
+            _MAP_LAYER_INDEX = MapLayerIndex()
+            for store in _MAP_LAYER_STORES:
+                _MAP_LAYER_INDEX.addStore(store)
+    project = QgsProject.instance()
+    if isinstance(project, QgsProject):
+        _MAP_LAYER_INDEX.addStore(project)
+    return _MAP_LAYER_INDEX
 
 
 def registerMapLayerStore(store):
@@ -362,6 +602,8 @@ def registerMapLayerStore(store):
     assert isinstance(store, (QgsProject, QgsMapLayerStore))
     if store not in mapLayerStores():
         _MAP_LAYER_STORES.append(store)
+        if isinstance(_MAP_LAYER_INDEX, MapLayerIndex):
+            _MAP_LAYER_INDEX.addStore(store)
 
 
 def registeredMapLayers() -> list:
@@ -369,12 +611,7 @@ def registeredMapLayers() -> list:
     Returns the QgsMapLayers which are stored in known QgsMapLayerStores
     :return: [list-of-QgsMapLayers]
     """
-    layers = []
-    for store in mapLayerStores():
-        for layer in store.mapLayers().values():
-            if layer not in layers:
-                layers.append(layer)
-    return layers
+    return mapLayerIndex().layers()
 
 
 convertLengthUnit = UnitLookup.convertLengthUnit
@@ -489,8 +726,9 @@ def findMapLayerStores() -> List[Union[QgsProject, QgsMapLayerStore]]:
 
 def findMapLayer(layer) -> Optional[QgsMapLayer]:
     """
-    Returns the first QgsMapLayer out of all layers stored in MAP_LAYER_STORES that matches layer
-    :param layer: str layer id or layer name or QgsMapLayer
+    Returns the first QgsMapLayer out of all layers stored in MAP_LAYER_STORES that matches layer.
+    Layers of registered stores are resolved by the MapLayerIndex, other stores and layers are searched afterwards.
+    :param layer: str layer id, layer name, layer source or QgsMapLayer
     :return: QgsMapLayer
     """
     assert isinstance(layer, (QgsMapLayer, str))
@@ -498,7 +736,14 @@ def findMapLayer(layer) -> Optional[QgsMapLayer]:
         return layer
 
     elif isinstance(layer, str):
+        lyr = mapLayerIndex().findLayer(layer)
+        if isinstance(lyr, QgsMapLayer):
+            return lyr
+
+        indexed = mapLayerIndex().stores()
         for store in findMapLayerStores():
+            if any(s is store for s in indexed):
+                continue
             lyr = store.mapLayer(layer)
             if isinstance(lyr, QgsMapLayer):
                 return lyr
@@ -840,6 +1085,95 @@ def optimize_block_size(ds: gdal.Dataset,
     return block_size
 
 
+def rasterBandUniqueValues(band: Union[str, gdal.Dataset, gdal.Band],
+                           maxValues: int = None,
+                           threads: int = 1,
+                           tileSize: int = 2 ** 22,
+                           feedback: QgsFeedback = None) -> Optional[Dict[Union[int, float], int]]:
+    """
+    Scans the pixel values of a raster band tile by tile and counts the unique values.
+    No-data pixels are ignored.
+    :param band: gdal.Band, or a gdal.Dataset / path to read the 1st band from
+    :param maxValues: stop the scan and return None as soon as more than maxValues unique values have been found
+    :param threads: number of threads that read and count tiles in parallel.
+                    Each thread uses its own dataset handle, which requires a dataset that can be re-opened by name.
+    :param tileSize: approximated number of pixels per tile. Tiles are aligned to the band block size.
+    :param feedback: QgsFeedback to report progress and cancel the scan
+    :return: dict with pixel count per unique value, None if maxValues was exceeded or the scan was canceled
+    """
+    # keep a reference on the dataset as long as its band is used
+    if isinstance(band, gdal.Band):
+        ds: gdal.Dataset = band.GetDataset()
+    else:
+        ds: gdal.Dataset = gdalDataset(band)
+        band = ds.GetRasterBand(1)
+    assert isinstance(band, gdal.Band)
+    bandNo = band.GetBand()
+    ns, nl = band.XSize, band.YSize
+    noData = band.GetNoDataValue()
+
+    # tiles of full blocks, covering approx. tileSize pixels
+    bw, bh = band.GetBlockSize()
+    tw = min(ns, bw * max(1, int(math.sqrt(tileSize)) // bw))
+    th = min(nl, bh * max(1, (tileSize // tw) // bh))
+    tiles = [(x, y, min(tw, ns - x), min(th, nl - y)) for y in range(0, nl, th) for x in range(0, ns, tw)]
+
+    path = ds.GetDescription() if isinstance(ds, gdal.Dataset) else None
+    if threads is None or threads < 1 or not (path and gdal.VSIStatL(path)):
+        threads = 1
+
+    local = threading.local()
+
+    def countTile(tile) -> Tuple[np.ndarray, np.ndarray]:
+        if threads > 1:
+            if not hasattr(local, 'band'):
+                local.ds = gdal.Open(path)
+                local.band = local.ds.GetRasterBand(bandNo)
+            tileBand = local.band
+        else:
+            tileBand = band
+        array = tileBand.ReadAsArray(*tile).ravel()
+        if noData is not None:
+            array = array[array != noData]
+        if np.issubdtype(array.dtype, np.floating):
+            array = array[np.isfinite(array)]
+        if len(array) > 0 and np.issubdtype(array.dtype, np.integer) and array.min() >= 0 and array.max() < 2 ** 16:
+            counts = np.bincount(array)
+            values = np.flatnonzero(counts)
+            return values, counts[values]
+        return np.unique(array, return_counts=True)
+
+    results: Dict[Union[int, float], int] = dict()
+
+    def merge(values: np.ndarray, counts: np.ndarray) -> bool:
+        for v, c in zip(values.tolist(), counts.tolist()):
+            results[v] = results.get(v, 0) + c
+        return maxValues is None or len(results) <= maxValues
+
+    def isCanceled() -> bool:
+        return isinstance(feedback, QgsFeedback) and feedback.isCanceled()
+
+    if threads == 1:
+        for i, tile in enumerate(tiles):
+            if isCanceled() or not merge(*countTile(tile)):
+                return None
+            if isinstance(feedback, QgsFeedback):
+                feedback.setProgress(100. * (i + 1) / len(tiles))
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            futures = [pool.submit(countTile, tile) for tile in tiles]
+            try:
+                for i, future in enumerate(futures):
+                    if isCanceled() or not merge(*future.result()):
+                        return None
+                    if isinstance(feedback, QgsFeedback):
+                        feedback.setProgress(100. * (i + 1) / len(tiles))
+            finally:
+                for future in futures:
+                    future.cancel()
+    return results
+
+
 def fid2pixelindices(raster: gdal.Dataset,
                      vector: ogr.DataSource,
                      layer: Union[int, str] = 0,
@@ -1091,6 +1425,10 @@ def qgsMapLayer(value: Any) -> QgsMapLayer:
     """
     if isinstance(value, QgsMapLayer):
         return value
+    if isinstance(value, str):
+        lyr = mapLayerIndex().layer(value)
+        if isinstance(lyr, QgsMapLayer):
+            return lyr
     try:
         lyr = qgsRasterLayer(value)
         if isinstance(lyr, QgsRasterLayer):
@@ -1736,8 +2074,10 @@ def parseBadBandList(dataset) -> List[int]:
     """
     bbl = None
 
-    sp = QgsRasterLayerSpectralProperties.fromRasterLayer(dataset)
-    bbl = sp.badBands()
+    md = SpectralMetadataCache.metadata(dataset)
+    if md is None:
+        return None
+    bbl = md.badBands.tolist()
     return bbl
 
     try:
@@ -1768,10 +2108,9 @@ def parseFWHM(dataset) -> np.ndarray:
     :param dataset:
     :return:
     """
-    sp = QgsRasterLayerSpectralProperties.fromRasterLayer(dataset)
-    fwhm = sp.fullWidthHalfMaximum()
-    if any([math.isfinite(v) for v in fwhm]):
-        return np.asarray(fwhm)
+    md = SpectralMetadataCache.metadata(dataset)
+    if md is not None and np.isfinite(md.fwhm).any():
+        return md.fwhm.copy()
     else:
         return None
 
@@ -1867,11 +2206,9 @@ def parseWavelength(dataset) -> Tuple[np.ndarray, str]:
     :return: (wl, wl_u) or (None, None), if not existing
     """
 
-    sp = QgsRasterLayerSpectralProperties.fromRasterLayer(dataset)
-    wl = np.asarray(sp.wavelengths())
-    wlu = sp.wavelengthUnits()
-    if len(wl) > 0 and len(wlu) > 0:
-        return wl, wlu[0]
+    md = SpectralMetadataCache.metadata(dataset)
+    if md is not None and len(md.wavelength) > 0:
+        return md.wavelength.copy(), md.wavelengthUnit
     else:
         return None, None
 
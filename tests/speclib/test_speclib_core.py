@@ -18,6 +18,7 @@
 """
 # noinspection PyPep8Naming
 import datetime
+import io
 import json
 import math
 import pickle
@@ -28,18 +29,19 @@ from typing import List
 import numpy as np
 from osgeo import ogr
 
-from qgis.PyQt.QtCore import NULL, QByteArray, QJsonDocument, QVariant
+from qgis.PyQt.QtCore import NULL, QByteArray, QJsonDocument, QMimeData, QVariant
 from qgis.core import edit, QgsCoordinateReferenceSystem, QgsFeature, QgsField, QgsFields, QgsRasterLayer, \
     QgsVectorLayer, QgsWkbTypes
 from qps import initAll
 from qps.qgisenums import QMETATYPE_DOUBLE, QMETATYPE_INT, QMETATYPE_QBYTEARRAY, QMETATYPE_QSTRING
 from qps.speclib import EDITOR_WIDGET_REGISTRY_KEY
 from qps.speclib.core import can_store_spectral_profiles, create_profile_field, is_profile_field, is_spectral_library, \
-    profile_field_list, profile_fields
-from qps.speclib.core.spectrallibrary import SpectralLibraryUtils
+    profile_field_list, profile_field_names, profile_fields
+from qps.speclib.core.spectrallibrary import MIMEDATA_SPECLIB_BINARY, MIMEDATA_SPECLIB_LINK, SpectralLibraryUtils
 from qps.speclib.core.spectrallibraryrasterdataprovider import featuresToArrays
-from qps.speclib.core.spectralprofile import decodeProfileValueDict, encodeProfileValueDict, isProfileValueDict, \
-    nanToNone, prepareProfileValueDict, ProfileEncoding, SpectralProfileBlock, SpectralSetting, validateProfileValueDict
+from qps.speclib.core.spectralprofile import decodeProfileValueDict, encodeProfileValueDict, \
+    encodeProfileValueDicts, isProfileValueDict, nanToNone, prepareProfileValueDict, ProfileEncoding, \
+    SpectralProfileBlock, SpectralSetting, validateProfileValueDict
 from qps.testing import start_app, TestCase, TestObjects
 from qps.unitmodel import BAND_NUMBER
 from qps.utils import createQgsField, FeatureReferenceIterator, findTypeFromString, qgsFields2str, SpatialExtent, \
@@ -604,6 +606,162 @@ class SpeclibCoreTests(TestCase):
             self.assertEqual(f1['profiles'], fDst['profiles'])
         s = ""
 
+    def test_encodeProfileValueDicts(self):
+
+        y = np.random.rand(5, 4)
+        y[2, 1] = np.nan
+        x = [400, 500, 600, 700, 800]
+        bbl = [1, 1, 0, 1, 1]
+        for encoding in [ProfileEncoding.Text, ProfileEncoding.Bytes, ProfileEncoding.Dict]:
+            values = encodeProfileValueDicts(y, encoding, x=x, xUnit='nm', bbl=bbl)
+            self.assertEqual(len(values), 4)
+            for i, value in enumerate(values):
+                d = prepareProfileValueDict(x=x, y=y[:, i], xUnit='nm', bbl=bbl)
+                ref = encodeProfileValueDict(d, encoding)
+                if encoding == ProfileEncoding.Dict:
+                    self.assertEqual(json.dumps(value), json.dumps(ref))
+                else:
+                    self.assertEqual(value, ref)
+
+    def test_appendProfiles(self):
+
+        speclibSrc = TestObjects.createSpectralLibrary(n=25, n_bands=[10])
+        srcField = profile_field_list(speclibSrc)[0]
+
+        # appends to a speclib that is not in edit mode, with a different profile encoding
+        speclibDst = SpectralLibraryUtils.createSpectralLibrary(profile_fields=[srcField.name()],
+                                                                encoding=ProfileEncoding.Text)
+        self.assertFalse(speclibDst.isEditable())
+        dstField = speclibDst.fields().field(srcField.name())
+        self.assertNotEqual(ProfileEncoding.fromInput(srcField), ProfileEncoding.fromInput(dstField))
+
+        dataChanged = []
+        speclibDst.dataChanged.connect(lambda: dataChanged.append(True))
+        fids = SpectralLibraryUtils.appendProfiles(speclibDst, speclibSrc, addMissingFields=True, batchSize=7)
+        self.assertEqual(len(fids), 25)
+        # views get notified about the appended profiles
+        self.assertTrue(len(dataChanged) > 0)
+        self.assertEqual(speclibDst.featureCount(), 25)
+        self.assertFalse(speclibDst.isModified())
+        self.assertTrue(set(speclibSrc.fields().names()).issubset(speclibDst.fields().names()))
+
+        srcProfiles = [decodeProfileValueDict(f.attribute(srcField.name())) for f in speclibSrc.getFeatures()]
+        dstProfiles = []
+        for f in speclibDst.getFeatures():
+            value = f.attribute(srcField.name())
+            self.assertIsInstance(value, str)
+            dstProfiles.append(decodeProfileValueDict(value))
+        self.assertEqual(json.dumps(srcProfiles), json.dumps(dstProfiles))
+
+        # addSpeclib uses the bulk path if no undo is possible
+        fids = SpectralLibraryUtils.addSpeclib(speclibDst, speclibSrc)
+        self.assertEqual(len(fids), 25)
+        self.assertEqual(speclibDst.featureCount(), 50)
+
+        # profiles added in edit mode can be undone
+        speclibDst.startEditing()
+        fids = SpectralLibraryUtils.addProfiles(speclibDst, speclibSrc)
+        self.assertEqual(len(fids), 25)
+        self.assertEqual(speclibDst.featureCount(), 75)
+        speclibDst.rollBack()
+        self.assertEqual(speclibDst.featureCount(), 50)
+
+    def test_binaryMimeData(self):
+
+        speclib = TestObjects.createSpectralLibrary(n=10, n_empty=2, n_bands=[[5, 7], [3, 7]])
+        speclib.startEditing()
+        speclib.addAttribute(QgsField('number', QMETATYPE_DOUBLE))
+        speclib.commitChanges(False)
+        for i, fid in enumerate(speclib.allFeatureIds()):
+            speclib.changeAttributeValue(fid, speclib.fields().lookupField('number'), None if i == 0 else i * 0.5)
+        speclib.commitChanges()
+
+        # the binary data is created on request only
+        md = SpectralLibraryUtils.mimeData(speclib)
+        self.assertFalse(MIMEDATA_SPECLIB_BINARY in md.formats())
+
+        md = SpectralLibraryUtils.mimeData(speclib, [MIMEDATA_SPECLIB_LINK, MIMEDATA_SPECLIB_BINARY])
+        self.assertTrue(MIMEDATA_SPECLIB_BINARY in md.formats())
+
+        # read the binary data without the same-process link
+        md2 = QMimeData()
+        md2.setData(MIMEDATA_SPECLIB_BINARY, md.data(MIMEDATA_SPECLIB_BINARY))
+        self.assertTrue(SpectralLibraryUtils.canReadFromMimeData(md2))
+        speclib2 = SpectralLibraryUtils.readFromMimeData(md2)
+        self.assertTrue(is_spectral_library(speclib2))
+        self.assertNotEqual(id(speclib2), id(speclib))
+        self.assertEqual(speclib2.fields().names(), speclib.fields().names())
+        self.assertEqual(profile_field_names(speclib2), profile_field_names(speclib))
+        self.assertEqual(speclib2.featureCount(), speclib.featureCount())
+        self.assertEqual(speclib2.crs(), speclib.crs())
+
+        for f1, f2 in zip(speclib.getFeatures(), speclib2.getFeatures()):
+            self.assertEqual(f1.geometry().asWkt(), f2.geometry().asWkt())
+            for name in speclib.fields().names():
+                v1, v2 = f1.attribute(name), f2.attribute(name)
+                if name in profile_field_names(speclib):
+                    self.assertEqual(json.dumps(decodeProfileValueDict(v1)), json.dumps(decodeProfileValueDict(v2)))
+                else:
+                    self.assertEqual(v1, v2)
+
+        self.assertIsNone(SpectralLibraryUtils.readFromBinaryData(QByteArray(b'no speclib')))
+
+        # incomplete archives return None as well
+        archive = np.load(io.BytesIO(bytes(md.data(MIMEDATA_SPECLIB_BINARY))))
+        arrays = {k: archive[k] for k in archive.files if k != 'wkb'}
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        self.assertIsNone(SpectralLibraryUtils.readFromBinaryData(QByteArray(buffer.getvalue())))
+
+    def test_changeAttributeValues(self):
+
+        speclib = TestObjects.createSpectralLibrary(n=5, n_bands=[10])
+        fids = speclib.allFeatureIds()
+        speclib.startEditing()
+        field = QgsField('newfield', QMETATYPE_DOUBLE)
+        self.assertTrue(SpectralLibraryUtils.addAttribute(speclib, field))
+        iNew = speclib.fields().lookupField('newfield')
+        iName = speclib.fields().lookupField('name')
+        self.assertTrue(iNew >= 0 and iName >= 0)
+
+        oldNames = {f.id(): f.attribute(iName) for f in speclib.getFeatures()}
+        values = {fid: {iNew: float(fid), iName: f'name{fid}'} for fid in fids}
+        self.assertTrue(SpectralLibraryUtils.changeAttributeValues(speclib, values, undoable=False))
+        for f in speclib.getFeatures():
+            self.assertEqual(f.attribute(iNew), float(f.id()))
+            self.assertEqual(f.attribute(iName), f'name{f.id()}')
+
+        # layers in editing mode use the edit buffer, i.e. the changes can be rolled back
+        self.assertTrue(speclib.rollBack())
+        for f in speclib.getFeatures():
+            self.assertEqual(f.attribute('name'), oldNames[f.id()])
+
+        # layers not in editing mode are changed in the data provider directly
+        self.assertFalse(speclib.isEditable())
+        changed = []
+        speclib.dataChanged.connect(lambda: changed.append(True))
+        values = {fid: {iName: f'name{fid}'} for fid in fids}
+        self.assertTrue(SpectralLibraryUtils.changeAttributeValues(speclib, values, undoable=False))
+        self.assertTrue(len(changed) > 0)
+        for f in speclib.getFeatures():
+            self.assertEqual(f.attribute('name'), f'name{f.id()}')
+        speclib.startEditing()
+        self.assertTrue(speclib.rollBack())
+        for f in speclib.getFeatures():
+            self.assertEqual(f.attribute('name'), f'name{f.id()}')
+
+        speclib.startEditing()
+        values = {fid: {iName: 'undoable'} for fid in fids}
+        speclib.beginEditCommand('Change names')
+        self.assertTrue(SpectralLibraryUtils.changeAttributeValues(speclib, values))
+        speclib.endEditCommand()
+        for f in speclib.getFeatures():
+            self.assertEqual(f.attribute(iName), 'undoable')
+        speclib.undoStack().undo()
+        for f in speclib.getFeatures():
+            self.assertEqual(f.attribute(iName), f'name{f.id()}')
+        speclib.rollBack()
+
     def test_save_gpkg_crs(self):
         crs = QgsCoordinateReferenceSystem('EPSG:32632')
         lyr = TestObjects.createVectorLayer(QgsWkbTypes.Point, crs=crs)
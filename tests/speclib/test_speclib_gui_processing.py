@@ -4,17 +4,21 @@ import datetime
 import unittest
 from typing import Tuple
 
+from osgeo import gdal
+
+from qgis.PyQt.QtCore import NULL
 from qgis.PyQt.QtWidgets import QGridLayout, QWidget
 from qgis.core import QgsApplication, QgsProcessingAlgorithm, QgsProcessingContext, QgsProcessingFeedback, \
     QgsProcessingOutputRasterLayer, QgsProcessingParameterRasterLayer, QgsProcessingRegistry, QgsProject, \
-    QgsVectorLayer, edit
+    QgsRasterLayer, QgsVectorLayer, edit
 from qgis.gui import QgsDualView, QgsGui, QgsMapCanvas, QgsProcessingAlgorithmDialogBase, QgsProcessingContextGenerator, \
     QgsProcessingGui, QgsProcessingGuiRegistry, QgsProcessingParameterWidgetContext
 from qps import initAll
 from qps.speclib.core import profile_field_list
-from qps.speclib.core.spectralprofile import SpectralSetting
+from qps.speclib.core.spectrallibraryrasterdataprovider import FieldRasterLayout
+from qps.speclib.core.spectralprofile import decodeProfileValueDict, SpectralSetting
 from qps.speclib.gui.spectrallibrarywidget import SpectralLibraryWidget
-from qps.speclib.gui.spectralprocessingdialog import SpectralProcessingDialog, \
+from qps.speclib.gui.spectralprocessingdialog import requires_file_paths, SpectralProcessingDialog, \
     SpectralProcessingRasterLayerWidgetWrapper
 from qps.testing import ExampleAlgorithmProvider, TestCase, TestObjects, start_app
 
@@ -191,6 +195,108 @@ class SpectralProcessingTests(TestCase):
         self.assertTrue(True)
         self.showGui([slw, procw])
 
+    def test_SpectralProcessingInMemoryExchange(self):
+        self.initProcessingRegistry()
+        from qps.speclib.core.spectrallibraryrasterdataprovider import registerDataProvider
+        registerDataProvider()
+        speclib = TestObjects.createSpectralLibrary(n=10, n_bands=[25])
+        speclib.startEditing()
+
+        reg: QgsProcessingRegistry = QgsApplication.instance().processingRegistry()
+        alg = reg.algorithmById('native:rescaleraster')
+        self.assertFalse(requires_file_paths(alg))
+        algGdal = reg.algorithmById('gdal:rearrange_bands')
+        if isinstance(algGdal, QgsProcessingAlgorithm):
+            self.assertTrue(requires_file_paths(algGdal))
+
+        procw = SpectralProcessingDialog(speclib=speclib)
+        self.assertTrue(procw.inMemoryExchange())
+        procw.setAlgorithm(alg)
+        wrapper = procw.processingModelWrapper()
+        wrapper.parameterWidget('INPUT').setCurrentIndex(1)
+        wrapper.outputWidget('OUTPUT').setCurrentText('newfield')
+        procw.runAlgorithm(fail_fast=True)
+
+        tempFiles = procw.temporaryRaster()
+        self.assertTrue(len(tempFiles) > 0)
+        for file in tempFiles:
+            self.assertTrue(file.startswith('/vsimem/'))
+            setting = SpectralSetting.fromRasterLayer(file)
+            self.assertIsInstance(setting, SpectralSetting)
+            self.assertEqual(setting.n_bands(), 25)
+
+        procw.removeTemporaryRaster()
+        self.assertEqual(procw.temporaryRaster(), [])
+        for file in tempFiles:
+            self.assertIsNone(gdal.VSIStatL(file))
+        procw.close()
+
+    def test_SpectralProcessingBatches(self):
+        self.initProcessingRegistry()
+        from qps.speclib.core.spectrallibraryrasterdataprovider import registerDataProvider
+        registerDataProvider()
+        speclib = TestObjects.createSpectralLibrary(n=10, n_bands=[25])
+        speclib.startEditing()
+
+        procw = SpectralProcessingDialog(speclib=speclib)
+        self.assertEqual(procw.batchSize(), 0)
+        fids = list(range(10))
+        self.assertEqual(procw.featureBatches(fids), [fids])
+        procw.setBatchSize(4)
+        self.assertEqual(procw.featureBatches(fids), [fids[0:4], fids[4:8], fids[8:10]])
+
+        # use a pixel-wise algorithm, batches of features need to return the same as a single run
+        reg: QgsProcessingRegistry = QgsApplication.instance().processingRegistry()
+        alg = reg.algorithmById('native:roundrastervalues')
+        OUTPUTS = []
+        procw.sigOutputsCreated.connect(OUTPUTS.append)
+        for batchSize, fieldName in [(0, 'unbatched'), (4, 'batched')]:
+            procw.setBatchSize(batchSize)
+            procw.setAlgorithm(alg)
+            wrapper = procw.processingModelWrapper()
+            wrapper.parameterWidget('INPUT').setCurrentIndex(1)
+            wrapper.outputWidget('OUTPUT').setCurrentText(fieldName)
+            OUTPUTS.clear()
+            procw.runAlgorithm(fail_fast=True)
+
+        # in-memory inputs of each batch are released after writing the results
+        self.assertEqual(procw.temporaryRaster(), [])
+
+        # emitted outputs of all batches remain readable
+        self.assertEqual(len(OUTPUTS), 3)
+        for outputs in OUTPUTS:
+            parameter, path = outputs['OUTPUT']
+            lyr = QgsRasterLayer(path)
+            self.assertTrue(lyr.isValid(), msg=path)
+            self.assertEqual(lyr.bandCount(), 25)
+
+        # many features are arranged in a grid
+        self.assertEqual(procw.rasterLayout(10), FieldRasterLayout.Line)
+        procw.MAX_LINE_LENGTH = 4
+        self.assertEqual(procw.rasterLayout(10), FieldRasterLayout.Grid)
+        procw.setBatchSize(0)
+        procw.setAlgorithm(alg)
+        wrapper = procw.processingModelWrapper()
+        wrapper.parameterWidget('INPUT').setCurrentIndex(1)
+        wrapper.outputWidget('OUTPUT').setCurrentText('grid')
+        OUTPUTS.clear()
+        procw.runAlgorithm(fail_fast=True)
+        self.assertEqual(len(OUTPUTS), 1)
+        lyr = QgsRasterLayer(OUTPUTS[0]['OUTPUT'][1])
+        self.assertEqual((lyr.height(), lyr.width()), (3, 4))
+        i1 = speclib.fields().lookupField('unbatched')
+        i2 = speclib.fields().lookupField('batched')
+        i3 = speclib.fields().lookupField('grid')
+        self.assertTrue(i1 >= 0 and i2 >= 0 and i3 >= 0)
+        for f in speclib.getFeatures():
+            self.assertTrue(f.attribute(i2) not in [None, NULL])
+            d1 = decodeProfileValueDict(f.attribute(i1))
+            d2 = decodeProfileValueDict(f.attribute(i2))
+            d3 = decodeProfileValueDict(f.attribute(i3))
+            self.assertEqual(d1['y'], d2['y'])
+            self.assertEqual(d1['y'], d3['y'])
+        procw.close()
+
     def test_SpectralProcessingRasterLayerWidgetWrapper(self):
 
         parameters = [
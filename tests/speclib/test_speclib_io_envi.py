@@ -10,7 +10,8 @@ from qps.speclib.core import profile_field_list
 from qps.speclib.core.spectrallibraryio import SpectralLibraryExportWidget, SpectralLibraryImportWidget, \
     SpectralLibraryIO
 from qps.speclib.io.envi import EnviSpectralLibraryExportWidget, EnviSpectralLibraryImportWidget, EnviSpectralLibraryIO, \
-    findENVIHeader
+    findENVIHeader, readENVIHeader
+from qps.qgsrasterlayerproperties import ENVIHeaderCache, parseENVIHeader
 from qps.testing import start_app, TestCase, TestObjects
 from qpstestdata import enmap, envi_sli as speclibpath
 
@@ -57,6 +58,45 @@ class TestSpeclibIO_ENVI(TestCase):
         hdr, bin = findENVIHeader(pathWrong)
         self.assertTrue((hdr, bin) == (None, None))
 
+    def test_readENVIHeader(self):
+
+        import qpstestdata
+
+        text = 'ENVI\nsamples = 3\nlines = 1\nbands = 1\n; a comment\n' \
+               'band names = {Band 1}\nbbl = {\n1, 0,\n; another comment\n 1}\nwavelength = {0.5, 0.6,\n 0.75}\n'
+        md = parseENVIHeader(text, typeConversion=True)
+        self.assertEqual(md['samples'], 3)
+        self.assertEqual(md['band names'], ['Band 1'])
+        self.assertIsInstance(md['bbl'], np.ndarray)
+        self.assertEqual(md['bbl'].dtype, np.int64)
+        self.assertListEqual(md['bbl'].tolist(), [1, 0, 1])
+        self.assertListEqual(md['wavelength'].tolist(), [0.5, 0.6, 0.75])
+        self.assertEqual(parseENVIHeader(text, keys=['wavelength']), {'wavelength': ['0.5', '0.6', '0.75']})
+
+        ENVIHeaderCache.clear()
+        hdr1 = readENVIHeader(qpstestdata.envi_sli_hdr, typeConversion=True)
+        self.assertIsInstance(hdr1['wavelength'], list)
+        self.assertIsInstance(hdr1['wavelength'][0], float)
+        hdr2 = readENVIHeader(qpstestdata.envi_sli_hdr, typeConversion=False)
+        self.assertEqual(hdr2['file type'], 'ENVI Spectral Library')
+        self.assertEqual(len(hdr2['wavelength']), len(hdr1['wavelength']))
+
+        # header-only reads are cached and invalidated on file changes
+        path = self.createTestOutputDirectory() / 'speclib.hdr'
+        with open(qpstestdata.envi_sli_hdr, encoding='utf-8') as f:
+            text = f.read()
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        wl1 = ENVIHeaderCache.header(path, keys=['wavelength'])['wavelength']
+        self.assertIsInstance(wl1, np.ndarray)
+        self.assertFalse(wl1.flags.writeable)
+        self.assertIs(ENVIHeaderCache.header(path)['wavelength'], wl1)
+
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text.replace('wavelength units = Micrometers', 'wavelength units = Nanometers'))
+        self.assertEqual(ENVIHeaderCache.header(path)['wavelength units'], 'Nanometers')
+        self.assertIsNone(ENVIHeaderCache.header(path.parent / 'does_not_exist.hdr'))
+
     def test_ENVI_Import(self):
 
         w = EnviSpectralLibraryIO.createImportWidget()
@@ -98,6 +98,17 @@ class TestSpeclibIOGeoJSON(TestCase):
                 if not is_profile_field(field):
                     self.assertEqual(value1, value2)
 
+        # column-wise encoders return the same profiles as the per-feature conversion
+        encoders = converter.profileColumnEncoders()
+        self.assertTrue(len(encoders) > 0)
+        profiles = list(sl.getFeatures())
+        for idx, encoder in encoders.items():
+            values1 = [converter.convert(idx, p.attribute(idx)) for p in profiles]
+            values2 = encoder.encode([p.attribute(idx) for p in profiles])
+            self.assertEqual(len(values1), len(values2))
+            for v1, v2 in zip(values1, values2):
+                self.assertEqual(decodeProfileValueDict(v1), decodeProfileValueDict(v2))
+
     def test_import(self):
         IO = GeoJsonSpectralLibraryIO()
         from qpstestdata import speclib_geojson
@@ -141,6 +152,37 @@ class TestSpeclibIOGeoJSON(TestCase):
 
         s = ""
 
+    def test_write_geojson_sequence(self):
+
+        sl: QgsVectorLayer = TestObjects.createSpectralLibrary(n=10, n_bands=[5, 7])
+        path = self.createTestOutputDirectory() / 'profiles.geojsonl'
+
+        feedback = QgsProcessingFeedback()
+        files = GeoJsonSpectralLibraryIO.exportProfiles(path, sl, {}, feedback)
+        self.assertEqual(files, [path.as_posix()])
+
+        # one feature per line
+        with open(path, encoding='utf-8') as f:
+            lines = [line for line in f.read().splitlines() if line.strip() != '']
+        self.assertEqual(len(lines), sl.featureCount())
+
+        lyr = QgsVectorLayer(files[0])
+        self.assertTrue(lyr.isValid())
+        self.assertEqual(lyr.featureCount(), sl.featureCount())
+        lyr.loadDefaultStyle()
+        self.assertEqual(profile_field_names(lyr), profile_field_names(sl))
+
+        profiles = GeoJsonSpectralLibraryIO.importProfiles(files[0])
+        self.assertEqual(len(profiles), sl.featureCount())
+
+        # input features are not modified
+        features = list(sl.getFeatures())
+        attributes = [f.attributes() for f in features]
+        geometries = [f.geometry().asWkt() for f in features]
+        GeoJsonSpectralLibraryIO.exportProfiles(path, features, {}, feedback)
+        self.assertEqual([f.attributes() for f in features], attributes)
+        self.assertEqual([f.geometry().asWkt() for f in features], geometries)
+
     def test_write_profiles(self):
         IO = GeoJsonSpectralLibraryIO()
 
@@ -2,9 +2,10 @@
 import os
 import unittest
 
-from osgeo import ogr
+from osgeo import gdal, ogr
 
-from qgis.core import QgsFeature, QgsProcessingFeedback, QgsVectorLayer
+from qgis.core import NULL, QgsFeature, QgsProcessingFeedback, QgsVectorLayer
+from qps.speclib.core import profile_field_names
 from qps.speclib.core.spectrallibrary import SpectralLibraryUtils
 from qps.speclib.core.spectrallibraryio import SpectralLibraryIO
 from qps.speclib.io.geopackage import GeoPackageSpectralLibraryExportWidget, GeoPackageSpectralLibraryIO, \
@@ -68,6 +69,64 @@ class TestSpeclibIO_GPKG(TestCase):
 
         s = ""
 
+    def test_write_profiles_batches(self):
+
+        sl: QgsVectorLayer = TestObjects.createSpectralLibrary(n=25, n_bands=[5, 7])
+        path = self.createTestOutputDirectory() / 'profiles.gpkg'
+
+        SpectralLibraryIO.WRITER_BATCH_SIZE, batchSize = 4, SpectralLibraryIO.WRITER_BATCH_SIZE
+        try:
+            feedback = QgsProcessingFeedback()
+            files = GeoPackageSpectralLibraryIO.exportProfiles(path.as_posix(), sl.getFeatures(), {}, feedback)
+        finally:
+            SpectralLibraryIO.WRITER_BATCH_SIZE = batchSize
+
+        self.assertEqual(files, [path.as_posix()])
+        lyr = QgsVectorLayer(files[0])
+        self.assertTrue(lyr.isValid())
+        self.assertEqual(lyr.featureCount(), sl.featureCount())
+        self.assertEqual(set(sl.fields().names()).difference(lyr.fields().names()), set())
+
+        # the SQLite settings are only used while writing
+        self.assertIsNone(gdal.GetConfigOption('OGR_SQLITE_JOURNAL'))
+        self.assertIsNone(gdal.GetThreadLocalConfigOption('OGR_SQLITE_JOURNAL'))
+
+    def test_read_profiles_lazy(self):
+
+        sl: QgsVectorLayer = TestObjects.createSpectralLibrary(n=25, n_bands=[5, 7])
+        sl.startEditing()
+        for f in sl.getFeatures():
+            f: QgsFeature
+            f.setAttribute('name', f'Name {f.id()}')
+            sl.updateFeature(f)
+        self.assertTrue(sl.commitChanges())
+
+        path = self.createTestOutputDirectory() / 'profiles_lazy.gpkg'
+        files = GeoPackageSpectralLibraryIO.exportProfiles(path.as_posix(), sl.getFeatures(), {})
+        self.assertEqual(files, [path.as_posix()])
+
+        profiles = SpectralLibraryIO.iterateProfilesFromUri(path)
+        self.assertNotIsInstance(profiles, list)
+        self.assertEqual(len(list(profiles)), sl.featureCount())
+
+        # column projection
+        pfield = profile_field_names(sl)[0]
+        for p in SpectralLibraryIO.iterateProfilesFromUri(path, attributes=[pfield]):
+            self.assertIsNotNone(p.attribute(pfield))
+            self.assertEqual(p.attribute('name'), NULL)
+
+        # filter expression
+        profiles = SpectralLibraryIO.readProfilesFromUri(path, filterExpression="\"name\" = 'Name 3'")
+        self.assertEqual(len(profiles), 1)
+        self.assertEqual(profiles[0].attribute('name'), 'Name 3')
+
+        # page-wise reading
+        pages = list(SpectralLibraryIO.readProfilePagesFromUri(path, pageSize=10))
+        self.assertEqual([len(p) for p in pages], [10, 10, 5])
+
+        speclib = SpectralLibraryIO.readSpeclibFromUri(path)
+        self.assertEqual(speclib.featureCount(), sl.featureCount())
+
     def test_export_widget(self):
 
         IO = GeoPackageSpectralLibraryIO()
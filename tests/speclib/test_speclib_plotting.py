@@ -456,6 +456,26 @@ class TestSpeclibPlotting(TestCase):
         unregisterSpectralLibraryPlotFactories()
         QgsProject.instance().removeAllMapLayers()
 
+    def test_convertXAxis(self):
+
+        model = SpectralProfilePlotModel()
+        x = np.asarray([400, 500, 600])
+        x2 = model.convertXAxis(x, 'nm', 'μm')
+        self.assertTrue(np.allclose(x2, [0.4, 0.5, 0.6]))
+        self.assertIs(model.convertXAxis(x, 'nm', 'μm'), x2)
+
+        # cached x values are shared and can not be modified
+        self.assertFalse(x2.flags.writeable)
+        self.assertTrue(x.flags.writeable)
+        self.assertIsNone(model.convertXAxis(x, 'nm', 'DOY'))
+
+        # new conversion functions invalidate the cache
+        converter = model.mUnitConverterFunctionModel
+        converter.addConvertFunc('test_convertXAxis_src', 'μm', lambda v, *args: v)
+        x3 = model.convertXAxis(x, 'nm', 'μm')
+        self.assertIsNot(x3, x2)
+        self.assertTrue(np.array_equal(x3, x2))
+
     def test_QgsPropertyItems(self):
         context = QgsReadWriteContext()
         itemLabel = QgsPropertyItem('Label')
@@ -1,13 +1,17 @@
 import unittest
 
+import numpy as np
+
 from qgis.PyQt.QtWidgets import QVBoxLayout, QWidget
-from qgis.core import Qgis, QgsCoordinateReferenceSystem, QgsProject, QgsRasterLayer, QgsRasterPipe, QgsRasterRange
+from qgis.core import Qgis, QgsCoordinateReferenceSystem, QgsPointXY, QgsProject, QgsRaster, QgsRasterLayer, \
+    QgsRasterPipe, QgsRasterRange, QgsRectangle
 from qgis.gui import QgsMapCanvas, QgsMapLayerComboBox
 from qps import initResources
+from qps.qgisenums import QGIS_RASTERBANDSTATISTIC
 from qps.speclib.core import profile_fields
-from qps.speclib.core.spectrallibraryrasterdataprovider import VectorLayerFieldRasterDataProvider, createRasterLayers, \
-    registerDataProvider
-from qps.speclib.core.spectralprofile import SpectralSetting, decodeProfileValueDict
+from qps.speclib.core.spectrallibraryrasterdataprovider import FieldRasterLayout, SpectralProfileValueConverter, \
+    VectorLayerFieldRasterDataProvider, createRasterLayers, registerDataProvider
+from qps.speclib.core.spectralprofile import SpectralSetting, decodeProfileValueDict, prepareProfileValueDict
 from qps.testing import TestCase, TestObjects, start_app
 from qps.utils import rasterArray
 
@@ -132,6 +136,163 @@ class RasterDataProviderTests(TestCase):
 
         QgsProject.instance().removeAllMapLayers()
 
+    def test_lazyProfileConverter(self):
+
+        n_total = 25
+        n_empty = 3
+        vl = TestObjects.createSpectralLibrary(n_total, n_empty=n_empty, n_bands=[11])
+        field = profile_fields(vl).at(0)
+        QgsProject.instance().addMapLayer(vl, addToLegend=False)
+
+        lyr = createRasterLayers(vl, field)[0]
+        dp: VectorLayerFieldRasterDataProvider = lyr.dataProvider()
+        converter = dp.fieldConverter()
+        self.assertIsInstance(converter, SpectralProfileValueConverter)
+        converter.CHUNK_SIZE = 4
+        converter.updateRasterData(dp.activeFeatures())
+
+        # nothing is decoded before values are requested
+        self.assertEqual(len(converter.mChunkCache), 0)
+        self.assertEqual(len(converter.mBandCache), 0)
+        self.assertEqual(converter.bandCount(), 11)
+
+        profiles = []
+        for fid in dp.activeFeatureIds():
+            profiles.append(decodeProfileValueDict(vl.getFeature(fid).attribute(field.name()))['y'])
+        profiles = np.asarray(profiles).T
+
+        # partial ranges decode the overlapping chunks only
+        values = converter.bandData(3, 5, 9)
+        self.assertTrue(np.all(values == profiles[2, 5:9]))
+        self.assertListEqual(sorted(converter.mChunkCache.keys()), [1, 2])
+        self.assertEqual(len(converter.mBandCache), 0)
+
+        values = dp.bandValues(3)
+        self.assertTrue(np.all(values == profiles[2, :]))
+        self.assertListEqual(list(converter.mBandCache.keys()), [3])
+
+        array = converter.rasterDataArray()
+        self.assertEqual(array.shape, (11, 1, profiles.shape[1]))
+        self.assertTrue(np.all(array[:, 0, :] == profiles))
+        # full materializations are not cached
+        self.assertListEqual(list(converter.mBandCache.keys()), [3])
+
+        QgsProject.instance().removeAllMapLayers()
+
+    def test_lazyProfileConverterDataType(self):
+
+        vl = TestObjects.createSpectralLibrary(1, n_bands=[3])
+        field = profile_fields(vl).at(0)
+        converter = SpectralProfileValueConverter(field)
+
+        # float values of later profiles are not truncated to the type of the 1st profile
+        p1 = prepareProfileValueDict(x=[1, 2, 3], y=[1, 2, 3])
+        p2 = prepareProfileValueDict(x=[1, 2, 3], y=[0.5, 1.5, 2.5])
+        array, _, noData = converter.toRasterValues([p1, p2])
+        self.assertTrue(np.issubdtype(array.dtype, np.floating))
+        self.assertTrue(np.all(array[:, 0, 0] == [1, 2, 3]))
+        self.assertTrue(np.all(array[:, 0, 1] == [0.5, 1.5, 2.5]))
+
+        # integer profiles only
+        array, _, noData = converter.toRasterValues([p1, p1])
+        self.assertEqual(array.dtype, np.int32)
+
+    def test_bandStatistics(self):
+
+        n_total = 30
+        vl = TestObjects.createSpectralLibrary(n_total, n_bands=[5])
+        field = profile_fields(vl).at(0)
+        QgsProject.instance().addMapLayer(vl, addToLegend=False)
+
+        lyr = createRasterLayers(vl, field)[0]
+        dp: VectorLayerFieldRasterDataProvider = lyr.dataProvider()
+        values = dp.bandValues(2).astype(float)
+        values = values[np.isfinite(values)]
+
+        self.assertFalse(dp.hasStatistics(2, QGIS_RASTERBANDSTATISTIC.All, QgsRectangle(), 0))
+        stats = dp.bandStatistics(2, QGIS_RASTERBANDSTATISTIC.All, QgsRectangle(), 0)
+        self.assertTrue(dp.hasStatistics(2, QGIS_RASTERBANDSTATISTIC.All, QgsRectangle(), 0))
+        self.assertEqual(stats.elementCount, len(values))
+        self.assertAlmostEqual(stats.minimumValue, values.min())
+        self.assertAlmostEqual(stats.maximumValue, values.max())
+        self.assertAlmostEqual(stats.mean, values.mean())
+        self.assertAlmostEqual(stats.stdDev, values.std())
+        self.assertAlmostEqual(stats.sum, values.sum())
+
+        # statistics of a sub-extent
+        ext = dp.extent()
+        subExtent = QgsRectangle(ext.xMinimum() + 10, ext.yMinimum(), ext.xMinimum() + 20, ext.yMaximum())
+        stats = dp.bandStatistics(2, QGIS_RASTERBANDSTATISTIC.All, subExtent, 0)
+        self.assertEqual(stats.elementCount, 10)
+        self.assertAlmostEqual(stats.mean, dp.bandValues(2)[10:20].mean())
+
+        # sampled statistics
+        stats = dp.bandStatistics(2, QGIS_RASTERBANDSTATISTIC.All, QgsRectangle(), 7)
+        self.assertEqual(stats.elementCount, 7)
+        self.assertTrue(values.min() <= stats.minimumValue <= stats.maximumValue <= values.max())
+
+        histogram = dp.histogram(2, 10, values.min(), values.max(), QgsRectangle(), 0, False)
+        self.assertEqual(sum(histogram.histogramVector), len(values))
+
+        # changing the active features invalidates cached statistics
+        dp.setActiveFeatures(list(vl.getFeatures())[0:5])
+        self.assertFalse(dp.hasStatistics(2, QGIS_RASTERBANDSTATISTIC.All, QgsRectangle(), 0))
+        self.assertEqual(dp.bandStatistics(2, QGIS_RASTERBANDSTATISTIC.All, QgsRectangle(), 0).elementCount, 5)
+
+        QgsProject.instance().removeAllMapLayers()
+
+    def test_gridLayout(self):
+
+        n_total = 10
+        vl = TestObjects.createSpectralLibrary(n_total, n_bands=[7])
+        field = profile_fields(vl).at(0)
+        QgsProject.instance().addMapLayer(vl, addToLegend=False)
+
+        lyr = createRasterLayers(vl, field)[0]
+        dp: VectorLayerFieldRasterDataProvider = lyr.dataProvider()
+        self.assertEqual(dp.layout(), FieldRasterLayout.Line)
+        self.assertEqual((dp.ySize(), dp.xSize()), (1, n_total))
+        arrayLine = rasterArray(dp)
+
+        dp.setLayout(FieldRasterLayout.Grid)
+        self.assertEqual(dp.layout(), FieldRasterLayout.Grid)
+        self.assertEqual((dp.ySize(), dp.xSize()), (3, 4))
+        self.assertEqual(dp.extent().width(), 4)
+        self.assertEqual(dp.extent().height(), 3)
+
+        # pixels are filled in row-major order, the remaining ones are no-data
+        arrayGrid = rasterArray(dp)
+        self.assertEqual(arrayGrid.shape, (7, 3, 4))
+        pixels = arrayGrid.reshape((7, -1))
+        self.assertTrue(np.all(pixels[:, 0:n_total] == arrayLine[:, 0, :]))
+        noData = dp.sourceNoDataValue(1)
+        if np.isnan(noData):
+            self.assertTrue(np.all(np.isnan(pixels[:, n_total:])))
+        else:
+            self.assertTrue(np.all(pixels[:, n_total:] == noData))
+
+        fids = dp.fidArray()
+        self.assertEqual(fids.shape, (3, 4))
+        self.assertListEqual(fids.flatten()[0:n_total].tolist(), dp.activeFeatureIds())
+        self.assertTrue(np.all(fids.flatten()[n_total:] == -1))
+        self.assertTrue(np.all(dp.bandArray(1) == arrayGrid[0, :, :]))
+
+        # identify a pixel in the 2nd row
+        ext = dp.extent()
+        pt = QgsPointXY(ext.xMinimum() + 1.5, ext.yMaximum() - 1.5)
+        self.assertEqual(dp.pixelFeatureIndex(pt), 5)
+        results = dp.identify(pt, QgsRaster.IdentifyFormatValue).results()
+        self.assertEqual(results[1], pixels[0, 5])
+
+        dp2 = dp.clone()
+        self.assertEqual(dp2.layout(), FieldRasterLayout.Grid)
+
+        src = f'?lid={{{vl.id()}}}&field={field.name()}&layout=grid'
+        lyr2 = QgsRasterLayer(src, 'grid', VectorLayerFieldRasterDataProvider.providerKey())
+        self.assertEqual(lyr2.dataProvider().layout(), FieldRasterLayout.Grid)
+
+        QgsProject.instance().removeAllMapLayers()
+
 
 if __name__ == '__main__':
     unittest.main(buffer=False)
@@ -10,8 +10,11 @@ import os
 import tempfile
 import unittest
 
+import numpy as np
+from osgeo import gdal
+
 from qgis.PyQt.QtCore import NULL, QMimeData, QModelIndex, QSize, Qt
-from qgis.PyQt.QtGui import QColor
+from qgis.PyQt.QtGui import QColor, QPixmap
 from qgis.PyQt.QtWidgets import QApplication, QCheckBox, QVBoxLayout, QWidget
 from qgis.PyQt.QtXml import QDomDocument, QDomElement
 from qgis.core import QgsCategorizedSymbolRenderer, QgsEditorWidgetSetup, QgsFeature, QgsFeatureRenderer, QgsField, \
@@ -115,6 +118,34 @@ class TestsClassificationScheme(TestCase):
         self.assertEqual(c.label(), label2)
         self.assertEqual(c.color(), color2)
 
+    def test_ClassInfoPixmapCache(self):
+        ClassInfo.PIXMAP_CACHE.clear()
+        ClassInfo.ICON_CACHE.clear()
+
+        c1 = ClassInfo(name='A', label=1, color=QColor('green'))
+        c2 = ClassInfo(name='B', label=2, color=QColor('green'))
+
+        pm1 = c1.pixmap()
+        self.assertIsInstance(pm1, QPixmap)
+        self.assertEqual(pm1.toImage().pixelColor(0, 0), QColor('green'))
+        self.assertEqual(len(ClassInfo.PIXMAP_CACHE), 1)
+
+        # same color and size: shared pixmap and icon
+        c2.pixmap(QSize(20, 20))
+        c2.icon()
+        c1.icon()
+        self.assertEqual(len(ClassInfo.PIXMAP_CACHE), 1)
+        self.assertEqual(len(ClassInfo.ICON_CACHE), 1)
+
+        c1.pixmap(10, 10)
+        self.assertEqual(len(ClassInfo.PIXMAP_CACHE), 2)
+
+        # a new color results in a new pixmap
+        c1.setColor(QColor('red'))
+        self.assertEqual(c1.pixmap().toImage().pixelColor(0, 0), QColor('red'))
+        self.assertEqual(c2.pixmap().toImage().pixelColor(0, 0), QColor('green'))
+        self.assertEqual(len(ClassInfo.PIXMAP_CACHE), 3)
+
     def test_ClassificationSchemeFromField(self):
 
         lyr = TestObjects.createVectorLayer(QgsWkbTypes.Point)
@@ -180,6 +211,43 @@ class TestsClassificationScheme(TestCase):
         for key in [MIMEDATA_KEY]:
             self.assertTrue(key in mimeData.formats())
 
+    def test_ClassificationSchemeLookup(self):
+        cs = ClassificationScheme()
+        cs.insertClasses([ClassInfo(label=0, name='Unclassified', color=QColor('black')),
+                          ClassInfo(label=2, name='Forest', color=QColor('green')),
+                          ClassInfo(label=5, name='Water', color=QColor('blue'))])
+
+        self.assertEqual(cs.classInfo(label=0), cs[0])
+        self.assertEqual(cs.classInfo(label=5), cs[2])
+        self.assertEqual(cs.classInfo(name='Forest'), cs[1])
+        self.assertIsNone(cs.classInfo(label=3))
+        self.assertEqual(cs.classIndexFromValue('Water'), 2)
+        self.assertEqual(cs.classIndexFromValue('Unknown'), -1)
+
+        labels = np.asarray([[0, 2, 5], [1, -1, 100]])
+        indices = cs.labelsToIndices(labels)
+        self.assertEqual(indices.tolist(), [[0, 1, 2], [-1, -1, -1]])
+
+        colors = cs.labelsToColors(labels)
+        self.assertEqual(colors.shape, (2, 3, 4))
+        self.assertEqual(colors.dtype, np.uint8)
+        self.assertEqual(tuple(colors[0, 1]), QColor('green').getRgb())
+        self.assertEqual(tuple(colors[1, 2]), (0, 0, 0, 0))
+
+        # lookups follow changes of the class infos
+        cs[1].setName('Trees')
+        self.assertIsNone(cs.classInfo(name='Forest'))
+        self.assertEqual(cs.classInfo(name='Trees'), cs[1])
+        cs.setData(cs.createIndex(2, 2), QColor('red'), Qt.EditRole)
+        self.assertEqual(tuple(cs.labelsToColors(np.asarray([5]))[0]), QColor('red').getRgb())
+
+        cs.removeClasses(cs[1])
+        self.assertIsNone(cs.classInfo(label=2))
+        self.assertEqual(cs.labelsToIndices(np.asarray([2, 5])).tolist(), [-1, 1])
+
+        # non-integer labels
+        self.assertEqual(cs.labelsToIndices(np.asarray([5.0, 0.5])).tolist(), [1, -1])
+
     def test_json_pickle(self):
         cs = self.createClassSchemeA()
 
@@ -385,6 +453,48 @@ class TestsClassificationScheme(TestCase):
         self.assertIsInstance(cs2, ClassificationScheme)
         self.assertEqual(cs, cs2)
 
+    def test_io_RasterBandValues(self):
+        array = np.zeros((100, 120), dtype=np.int16)
+        array[10:20, :] = 3
+        array[50:, 30:40] = 7
+        ds: gdal.Dataset = gdal.GetDriverByName('MEM').Create('', 120, 100, 1, gdal.GDT_Int16)
+        band: gdal.Band = ds.GetRasterBand(1)
+        band.WriteArray(array)
+
+        # without category names classes are derived from pixel values on request only
+        self.assertIsNone(ClassificationScheme.fromRasterBand(band))
+        cs = ClassificationScheme.fromRasterBand(band, scanValues=True)
+        self.assertIsInstance(cs, ClassificationScheme)
+        self.assertListEqual(cs.classLabels(), [0, 3, 7])
+        self.assertListEqual(cs.classNames(), ['Unclassified', '3', '7'])
+
+        self.assertIsNone(ClassificationScheme.fromRasterBand(band, scanValues=True, maxClasses=2))
+
+    def test_io_saveToRasters(self):
+        cs = self.createClassSchemeA()
+        drv: gdal.Driver = gdal.GetDriverByName('MEM')
+        datasets = [drv.Create('', 10, 10, 2, gdal.GDT_Byte) for _ in range(3)]
+
+        # all bands get names and colors
+        self.assertEqual(cs.saveToRasters(datasets, bandIndex=[0, 1]), 6)
+        for ds in datasets:
+            for b in range(ds.RasterCount):
+                band: gdal.Band = ds.GetRasterBand(b + 1)
+                self.assertListEqual(band.GetCategoryNames(), cs.classNames())
+                colors = ClassificationScheme.colorTableArray(band.GetColorTable())
+                self.assertTrue(np.array_equal(colors, cs.classColorArray()))
+
+        # unchanged bands are skipped
+        self.assertEqual(cs.saveToRasters(datasets, bandIndex=[0, 1]), 0)
+
+        # colors given as array
+        colors = cs.classColorArray()
+        colors[1, :] = (255, 0, 0, 255)
+        self.assertEqual(cs.saveToRasters(datasets, bandIndex=0, colors=colors), 3)
+        self.assertEqual(datasets[0].GetRasterBand(1).GetColorTable().GetColorEntry(1), (255, 0, 0, 255))
+        self.assertNotEqual(ClassificationScheme.colorArrayHash(colors),
+                            ClassificationScheme.colorArrayHash(cs.classColorArray()))
+
     def test_io_RasterRenderer(self):
 
         cs = self.createClassSchemeA()
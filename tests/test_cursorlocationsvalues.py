@@ -17,10 +17,11 @@ import unittest
 from osgeo import gdal
 
 from qgis.PyQt.QtWidgets import QHBoxLayout, QTreeView, QWidget
-from qgis.core import QgsCoordinateReferenceSystem, QgsFeature, QgsMapLayer, QgsMapLayerStore, QgsPointXY, QgsProject, \
-    QgsRasterLayer, QgsVectorLayer
+from qgis.core import QgsCoordinateReferenceSystem, QgsFeature, QgsGeometry, QgsMapLayer, QgsMapLayerStore, \
+    QgsPointXY, QgsProject, QgsRasterLayer, QgsVectorLayer
 from qgis.gui import QgsMapCanvas
-from qps.cursorlocationvalue import CursorLocationInfoDock
+from qps.cursorlocationvalue import CursorLocationInfoDock, CursorLocationInfoModel, VectorFieldTreeNode, \
+    VectorValueSet, VectorValueSetTreeNode
 from qps.testing import TestCase, TestObjects, start_app
 from qps.utils import SpatialPoint
 
@@ -69,6 +70,79 @@ class CursorLocationTest(TestCase):
         self.showGui(w)
         QgsProject.instance().removeAllMapLayers()
 
+    def test_vectorvalues_fetch(self):
+
+        lyrV = TestObjects.createVectorLayer()
+        features = list(lyrV.getFeatures())
+        self.assertTrue(len(features) > 1)
+        point = SpatialPoint.fromMapLayerCenter(lyrV)
+
+        vs = VectorValueSet(lyrV.source(), point)
+        vs.features.extend(features)
+
+        model = CursorLocationInfoModel()
+        model.addSourceValues(vs)
+        self.assertEqual(model.rootNode().childCount(), 1)
+
+        # field and feature nodes are created on demand
+        layerNode = model.rootNode()[0]
+        self.assertIsInstance(layerNode, VectorValueSetTreeNode)
+        self.assertEqual(layerNode.childCount(), 0)
+        self.assertTrue(layerNode.hasChildren())
+        idxLayer = model.node2idx(layerNode)
+        self.assertTrue(model.canFetchMore(idxLayer))
+        while model.canFetchMore(idxLayer):
+            model.fetchMore(idxLayer)
+        self.assertEqual(layerNode.childCount(), features[0].fields().count())
+
+        fieldNode = layerNode[0]
+        self.assertIsInstance(fieldNode, VectorFieldTreeNode)
+        self.assertEqual(fieldNode.childCount(), 0)
+        while fieldNode.canFetchMore():
+            fieldNode.fetch()
+        self.assertEqual(fieldNode.childCount(), len(features))
+        self.assertEqual(fieldNode[0].value(), features[0].attribute(fieldNode.name()))
+
+        # the dock loads not more than maxFeatures features per layer
+        lyrP = QgsVectorLayer('Point?crs=EPSG:4326&field=name:string', 'points', 'memory')
+        lyrP.startEditing()
+        for i in range(3):
+            f = QgsFeature(lyrP.fields())
+            f.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(13.5, 52.5)))
+            f.setAttribute('name', f'point {i}')
+            lyrP.addFeature(f)
+        self.assertTrue(lyrP.commitChanges())
+        point = SpatialPoint(lyrP.crs(), QgsPointXY(13.5, 52.5))
+
+        c = QgsMapCanvas()
+        c.setLayers([lyrP])
+        c.setDestinationCrs(lyrP.crs())
+        c.zoomToFullExtent()
+        dock = CursorLocationInfoDock()
+        dock.setMaxFeatures(2)
+        self.assertEqual(dock.maxFeatures(), 2)
+        dock.loadCursorLocation(point, c)
+
+        self.assertEqual(dock.mLocationInfoModel.rootNode().childCount(), 1)
+        layerNode = dock.mLocationInfoModel.rootNode()[0]
+        self.assertIsInstance(layerNode, VectorValueSetTreeNode)
+        self.assertEqual(len(layerNode.mValueSet.features), dock.maxFeatures())
+        self.assertTrue(layerNode.mValueSet.hasMoreFeatures)
+        self.assertIn('First 2 features', layerNode.toolTip())
+
+        # all features are loaded if there are not more than maxFeatures
+        dock.setMaxFeatures(3)
+        dock.loadCursorLocation(point, c)
+        layerNode = dock.mLocationInfoModel.rootNode()[0]
+        self.assertEqual(len(layerNode.mValueSet.features), 3)
+        self.assertFalse(layerNode.mValueSet.hasMoreFeatures)
+
+        # the layer node is expanded, field nodes create their feature nodes when they get expanded
+        self.assertTrue(layerNode.childCount() > 0)
+        for fieldNode in layerNode.childNodes():
+            self.assertIsInstance(fieldNode, VectorFieldTreeNode)
+            self.assertEqual(fieldNode.childCount(), 0)
+
     def test_locallayers(self):
 
         canvas = QgsMapCanvas()
@@ -140,6 +140,35 @@ class TestsGdalMetadata(TestCase):
 
         self.showGui(view)
 
+    def test_GDALBandMetadataModel_changes(self):
+        from qpstestdata import enmap
+        img_path = self.createImageCopy(enmap)
+        lyr = QgsRasterLayer(img_path)
+        model = GDALBandMetadataModel()
+        model.setLayer(lyr)
+        self.assertEqual(model.featureCount(), lyr.bandCount())
+        self.assertEqual(model.undoStack().count(), 0)
+        self.assertFalse(model.hasEdits)
+        self.assertEqual(model.changedBandValues(), dict())
+
+        features = {f.attribute(BandFieldNames.Number): f for f in model.getFeatures()}
+        self.assertEqual(set(features.keys()), set(range(1, lyr.bandCount() + 1)))
+
+        with edit(model):
+            f = features[3]
+            f.setAttribute(BandFieldNames.Name, 'Changed Band')
+            model.updateFeature(f)
+
+        changes = model.changedBandValues()
+        self.assertEqual(changes, {3: {BandFieldNames.Name: 'Changed Band'}})
+        model.applyToLayer()
+        self.assertEqual(model.changedBandValues(), dict())
+
+        ds: gdal.Dataset = gdal.Open(img_path)
+        self.assertEqual(ds.GetRasterBand(3).GetDescription(), 'Changed Band')
+        self.assertEqual(ds.GetRasterBand(2).GetDescription(), features[2].attribute(BandFieldNames.Name))
+        del ds
+
     def test_gdal_envi_header_comments(self):
 
         path = '/vsimem/test.bin'
@@ -16,7 +16,7 @@ from typing import Match
 from osgeo import gdal
 
 from qgis.PyQt.QtWidgets import QHBoxLayout, QPushButton, QTableView, QVBoxLayout, QWidget
-from qgis.core import QgsField, QgsProject, QgsRasterLayer
+from qgis.core import QgsContrastEnhancement, QgsField, QgsProject, QgsRasterLayer
 from qgis.gui import QgsMapCanvas, QgsMapLayerComboBox, QgsMapLayerConfigWidget, QgsMapLayerConfigWidgetFactory, \
     QgsRasterTransparencyWidget
 from qps.layerconfigwidgets.gdalmetadata import RX_OGR_URI
@@ -125,6 +125,33 @@ class LayerConfigWidgetsTests(TestCase):
 
         self.showGui([cR, w])
 
+    def test_rasterbandselection_stretch(self):
+        from qps.layerconfigwidgets.rasterbands import RasterBandConfigWidget
+        from qps.layerproperties import RasterBandStatisticsCache
+
+        lyrR = TestObjects.createRasterLayer(nb=5, eType=gdal.GDT_Int16)
+        w = RasterBandConfigWidget(lyrR, None)
+        stats = RasterBandStatisticsCache.statistics(lyrR, [1, 2], sampleSize=w.mSampleSize)
+        if RasterBandStatisticsCache.fileSignature(lyrR.source()) is None:
+            return
+
+        cut1 = RasterBandStatisticsCache.quantileCut(stats[1])
+        cut2 = RasterBandStatisticsCache.quantileCut(stats[2])
+        ce = QgsContrastEnhancement(lyrR.dataProvider().dataType(1))
+        ce.setContrastEnhancementAlgorithm(QgsContrastEnhancement.StretchToMinimumMaximum)
+
+        # a stretch derived from the band statistics is re-calculated for a new band
+        ce.setMinimumValue(cut1[0])
+        ce.setMaximumValue(cut1[1])
+        ce2 = w.stretchedContrastEnhancement(ce, 1, 2)
+        self.assertIsInstance(ce2, QgsContrastEnhancement)
+        self.assertAlmostEqual(ce2.minimumValue(), cut2[0])
+        self.assertAlmostEqual(ce2.maximumValue(), cut2[1])
+
+        # min / max values set by the user are kept
+        ce.setMinimumValue(cut1[0] - 1)
+        self.assertIsNone(w.stretchedContrastEnhancement(ce, 1, 2))
+
     def test_rasterbandComboBox(self):
         lyr = TestObjects.createRasterLayer(nb=255)
         cb = RasterBandComboBox()
@@ -10,8 +10,10 @@
 
 __author__ = 'benjamin.jakimow@geo.hu-berlin.de'
 
+import os
 import unittest
 
+import numpy as np
 from osgeo import gdal
 from qgis.PyQt.QtWidgets import QDialog, QGridLayout, QWidget
 from qgis.core import QgsMultiBandColorRenderer, QgsPalettedRasterRenderer, QgsProject, QgsRasterLayer, \
@@ -22,7 +24,7 @@ from qgis.gui import QgsMapCanvas, QgsMapLayerConfigWidgetFactory, QgsOptionsDia
 from qps import MAPLAYER_CONFIGWIDGET_FACTORIES
 from qps.layerconfigwidgets.rasterbands import RasterBandConfigWidget
 from qps.layerproperties import AddAttributeDialog, AttributeTableWidget, CopyAttributesDialog, defaultRasterRenderer, \
-    equal_styles, RemoveAttributeDialog, showLayerPropertiesDialog
+    equal_styles, RasterBandStatisticsCache, RasterBandStatisticsTask, RemoveAttributeDialog, showLayerPropertiesDialog
 from qps.testing import start_app, TestCase, TestObjects
 from qps.utils import createQgsField
 
@@ -69,6 +71,73 @@ class LayerPropertyTests(TestCase):
         del r
         QgsProject.instance().removeAllMapLayers()
 
+    def test_RasterBandStatisticsCache(self):
+        RasterBandStatisticsCache.clear()
+        path = '/vsimem/statistics_test.tif'
+        ds = TestObjects.createRasterDataset(nb=3, ns=50, nl=40, eType=gdal.GDT_Int16)
+        ds = gdal.Translate(path, ds)
+        array = ds.ReadAsArray()
+        del ds
+        lyr = QgsRasterLayer(path)
+        self.assertTrue(lyr.isValid())
+
+        # all pixels
+        stats = RasterBandStatisticsCache.statistics(lyr, [1, 3], sampleSize=0)
+        self.assertEqual(set(stats.keys()), {1, 3})
+        for b, s in stats.items():
+            self.assertEqual(s['min'], array[b - 1].min())
+            self.assertEqual(s['max'], array[b - 1].max())
+            self.assertEqual(s['count'], array[b - 1].size)
+            self.assertEqual(len(s['quantiles']), len(RasterBandStatisticsCache.QUANTILES))
+
+        # cached values are returned without calculation
+        cached = RasterBandStatisticsCache.cachedStatistics(lyr, [1, 2, 3], sampleSize=0)
+        self.assertIs(cached[1], stats[1])
+        self.assertIsNone(cached[2])
+
+        vmin, vmax = RasterBandStatisticsCache.cumulativeCut(lyr, 1, 0.02, 0.98, sampleSize=0)
+        self.assertTrue(array[0].min() <= vmin <= vmax <= array[0].max())
+
+        # statistics of a changed source are invalid
+        self.assertIsNotNone(RasterBandStatisticsCache.fileSignature(path))
+        lyr2 = QgsRasterLayer(path)
+        gdal.Translate(path, TestObjects.createRasterDataset(nb=3, ns=60, nl=40, eType=gdal.GDT_Int16))
+        cached = RasterBandStatisticsCache.cachedStatistics(lyr2, [1], sampleSize=0)
+        self.assertIsNone(cached[1])
+        stats = RasterBandStatisticsCache.statistics(lyr, [1, 3], sampleSize=0)
+
+        # sources without file signature are not cached
+        signature = RasterBandStatisticsCache.fileSignature('no_file_source')
+        self.assertIsNone(signature)
+        RasterBandStatisticsCache.insertStatistics('no_file_source', {1: stats[1]}, 0, signature=signature)
+        self.assertFalse(any(k[0] == 'no_file_source' for k in RasterBandStatisticsCache._ENTRIES.keys()))
+
+        # sampled statistics are calculated separately
+        stats = RasterBandStatisticsCache.statistics(lyr, [2], sampleSize=100)
+        self.assertTrue(0 < stats[2]['count'] <= 100)
+
+        # background task
+        task = RasterBandStatisticsTask(lyr, [1, 2, 3], sampleSize=256)
+        self.assertTrue(task.run())
+        cached = RasterBandStatisticsCache.cachedStatistics(lyr, [1, 2, 3], sampleSize=256)
+        self.assertTrue(all(s is not None for s in cached.values()))
+
+        # persistence in the GDAL PAM
+        pathTif = self.createTestOutputDirectory() / 'statistics_pam.tif'
+        gdal.Translate(pathTif.as_posix(), path)
+        lyr2 = QgsRasterLayer(pathTif.as_posix())
+        RasterBandStatisticsCache.setUsePam(True)
+        try:
+            stats2 = RasterBandStatisticsCache.statistics(lyr2, [1], sampleSize=0)
+            self.assertTrue(os.path.isfile(pathTif.as_posix() + '.aux.xml'))
+            RasterBandStatisticsCache.clear()
+            stats3 = RasterBandStatisticsCache.readFromPam(lyr2.source(), [1], 0)
+            self.assertEqual(stats2[1]['min'], stats3[1]['min'])
+            self.assertTrue(np.array_equal(stats2[1]['quantiles'], stats3[1]['quantiles']))
+        finally:
+            RasterBandStatisticsCache.setUsePam(False)
+        gdal.Unlink(path)
+
     def test_enmapboxbug_452(self):
         lyr = TestObjects.createVectorLayer()
         rlr = TestObjects.createRasterLayer()
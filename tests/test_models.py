@@ -220,6 +220,42 @@ class ModelTests(TestCase):
         n2.setStatusTip(t)
         assert n2.statusTip() == t
 
+    def test_treeNodeRows(self):
+
+        TM = TreeModel()
+        tester = QAbstractItemModelTester(TM, QAbstractItemModelTester.FailureReportingMode.Fatal)
+        root = TM.rootNode()
+
+        removed = []
+        root.endRemoveChildNodes.connect(lambda node, first, last: removed.append((first, last)))
+
+        nodes = [TreeNode(f'Node {i}') for i in range(10)]
+        root.appendChildNodes(nodes)
+        root.insertChildNodes(2, [TreeNode('Inserted A'), TreeNode('Inserted B')])
+
+        def checkRows():
+            for row, node in enumerate(root.childNodes()):
+                self.assertEqual(node.nodeIndex(), row)
+                self.assertEqual(TM.node2idx(node).row(), row)
+                self.assertEqual(TM.index(row, 0).internalPointer(), node)
+
+        checkRows()
+        self.assertTrue(nodes[0] in root)
+        self.assertEqual(nodes[0].next(), nodes[1])
+        self.assertEqual(nodes[2].previous().name(), 'Inserted B')
+
+        # neighboured nodes are removed within one range
+        root.removeChildNodes(nodes[3:6] + [nodes[8]])
+        self.assertEqual(removed, [(10, 10), (5, 7)])
+        self.assertFalse(nodes[3] in root)
+        self.assertEqual(nodes[3].nodeIndex(), None)
+        checkRows()
+
+        removed.clear()
+        root.removeAllChildNodes()
+        self.assertEqual(removed, [(0, len(nodes) + 2 - 4 - 1)])
+        self.assertEqual(len(root), 0)
+
     def test_treeModelNew(self):
 
         TM = TreeModel()
@@ -628,6 +628,41 @@ class QgsFunctionTests(TestCase):
         self.assertTrue(QgsExpression.unregisterFunction(f.name()))
         QgsProject.instance().removeAllMapLayers()
 
+    def test_SpectralMathBatch(self):
+        sl = TestObjects.createSpectralLibrary(10, n_bands=[20, 20], profile_field_names=['p1', 'p2'])
+        features = list(sl.getFeatures())
+        p1 = [f.attribute('p1') for f in features]
+        p2 = [f.attribute('p2') for f in features]
+
+        code = SpectralMath.compiledCode('y=y1/y2')
+        self.assertIs(code, SpectralMath.compiledCode('y=y1/y2'))
+
+        self.assertFalse(SpectralMath.isStackedCode('y=y1/y1.max()'))
+        self.assertTrue(SpectralMath.isStackedCode('# stacked\ny=y1/y1.max(axis=-1, keepdims=True)'))
+
+        expressions = ['y=y1/y2',
+                       '# stacked\ny=(y1-y2)/(y1+y2)',
+                       '# stacked\ny=y1/y1.max(axis=-1, keepdims=True)',
+                       # not row-wise, needs to be evaluated per feature
+                       'y=y1 - y1.mean()',
+                       'y=y1/y1.max()',
+                       'y=y1[0:5]\nx=x1[0:5]']
+        for e in expressions:
+            results = SpectralMath.evaluateBatch([p1, p2], e, ProfileEncoding.Dict)
+            self.assertEqual(len(results), len(features))
+            for v1, v2, result in zip(p1, p2, results):
+                d = SpectralMath.evaluateProfiles(code=SpectralMath.compiledCode(e),
+                                                  profiles=[decodeProfileValueDict(v, numpy_arrays=True)
+                                                            for v in [v1, v2]])
+                dResult = decodeProfileValueDict(result, numpy_arrays=True)
+                self.assertTrue(np.allclose(d['y'], dResult['y'], equal_nan=True))
+
+        # invalid inputs return None
+        results = SpectralMath.evaluateBatch([p1 + [None]], 'y=y*2', ProfileEncoding.Text)
+        self.assertEqual(len(results), len(p1) + 1)
+        self.assertIsNone(results[-1])
+        self.assertTrue(all(isinstance(r, str) for r in results[:-1]))
+
     def test_Format_Py(self):
         f = Format_Py()
         self.registerFunction(f)
@@ -3,8 +3,9 @@ import unittest
 from qgis.core import QgsRasterLayer
 from qgis.gui import QgsGui
 from qps.qgsrasterlayerproperties import QgsRasterLayerSpectralProperties, QgsRasterLayerSpectralPropertiesTable, \
-    QgsRasterLayerSpectralPropertiesTableWidget, stringToType
+    QgsRasterLayerSpectralPropertiesTableWidget, SpectralMetadata, SpectralMetadataCache, stringToType
 from qps.testing import start_app, TestCase, TestObjects
+from qps.utils import parseBadBandList, parseFWHM, parseWavelength
 from qpstestdata import envi_bsq
 
 start_app()
@@ -60,6 +61,45 @@ class TestQgsRasterLayerProperties(TestCase):
         for v in wlu2:
             self.assertEqual(v, 'm')
 
+    def test_SpectralMetadataCache(self):
+
+        path = self.createImageCopy(envi_bsq)
+        SpectralMetadataCache.invalidate()
+
+        lyr = QgsRasterLayer(path)
+        md1 = SpectralMetadataCache.metadata(path)
+        self.assertIsInstance(md1, SpectralMetadata)
+        self.assertEqual(md1.bandCount(), lyr.bandCount())
+        for array in [md1.wavelength, md1.fwhm, md1.badBands, md1.offsets, md1.scales]:
+            self.assertEqual(len(array), lyr.bandCount())
+
+        # same source, unchanged file -> cached metadata
+        self.assertIs(SpectralMetadataCache.metadata(lyr), md1)
+        self.assertIs(SpectralMetadataCache.metadata(lyr.dataProvider()), md1)
+
+        wl, wlu = parseWavelength(lyr)
+        self.assertListEqual(wl.tolist(), md1.wavelength.tolist())
+        self.assertEqual(wlu, md1.wavelengthUnit)
+        self.assertListEqual(parseBadBandList(lyr), md1.badBands.tolist())
+        fwhm = parseFWHM(lyr)
+        if fwhm is not None:
+            self.assertListEqual(fwhm.tolist(), md1.fwhm.tolist())
+
+        # returned arrays are copies
+        wl[0] = -1
+        self.assertNotEqual(md1.wavelength[0], -1)
+
+        # layer-specific properties are not cached
+        lyr.setCustomProperty('band_3/wavelength', 350)
+        wl, wlu = parseWavelength(lyr)
+        self.assertEqual(wl[2], 350)
+        self.assertNotEqual(md1.wavelength[2], 350)
+
+        SpectralMetadataCache.invalidate(path)
+        md2 = SpectralMetadataCache.metadata(path)
+        self.assertIsInstance(md2, SpectralMetadata)
+        self.assertIsNot(md1, md2)
+
     def test_QgsRasterLayerSpectralPropertiesTable(self):
         rasterLayer = TestObjects.createRasterLayer()
         properties = QgsRasterLayerSpectralPropertiesTable()
@@ -1,6 +1,7 @@
+import pathlib
 import unittest
 
-from qps.searchfiledialog import SearchFilesDialog
+from qps.searchfiledialog import FileSearchTask, SearchFilesDialog
 from qps.testing import TestCase, start_app
 
 start_app()
@@ -8,6 +9,16 @@ start_app()
 
 class SearchFileDialogTest(TestCase):
 
+    def test_file_search_task(self):
+        rootQps = pathlib.Path(__file__).parents[1] / 'qps'
+
+        found = []
+        task = FileSearchTask(rootQps.as_posix(), ['*.py', '*.ui'], recursive=True, threads=4)
+        task.sigFilesFound.connect(found.extend)
+        self.assertTrue(task.run())
+        self.assertTrue(len(found) > 0)
+        self.assertListEqual(sorted(found), sorted(task.files()))
+
     @unittest.skipIf(TestCase.runsInCI(), 'Blocking Dialog')
     def test_search_files_dialog(self):
         d = SearchFilesDialog()
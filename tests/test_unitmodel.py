@@ -171,6 +171,40 @@ class UnitModelTests(TestCase):
         r = m.convertFunction('nm', 'nm')(v, 'X')
         self.assertListEqual(list(r), [100, 200, 300])
 
+    def test_UnitConverterFunctionCache(self):
+
+        m = UnitConverterFunctionModel()
+        f1 = m.convertFunction('Nanometers', 'μm')
+        self.assertIs(f1, m.convertFunction('Nanometers', 'μm'))
+
+        # lists and arrays are converted as numpy arrays
+        for v in [[100, 200, 300], np.asarray([100, 200, 300])]:
+            r = f1(v)
+            self.assertIsInstance(r, np.ndarray)
+            self.assertTrue(np.allclose(r, [0.1, 0.2, 0.3]))
+        self.assertEqual(f1(100), 0.1)
+
+        f2 = m.convertFunction('m²', 'cm²')
+        self.assertTrue(np.allclose(f2([1, 2]), [10000, 20000]))
+
+        # added functions replace memoized ones
+        self.assertIs(m.convertFunction('foo', 'bar'), m.func_return_none)
+        revision = m.revision()
+        m.addConvertFunc('foo', 'bar', lambda v, *args: v)
+        self.assertIsNot(m.convertFunction('foo', 'bar'), m.func_return_none)
+        self.assertNotEqual(m.revision(), revision)
+
+        # unknown units are remembered as well, up to MAX_CACHED_BASE_UNITS unit strings
+        self.assertIsNone(UnitLookup.baseUnit('no unit'))
+        self.assertIn('no unit', UnitLookup._BASE_UNIT_CACHE)
+        self.assertNotIn('no unit', UnitLookup.UNIT_LOOKUP)
+        for i in range(UnitLookup.MAX_CACHED_BASE_UNITS + 10):
+            UnitLookup.baseUnit(f'no unit {i}')
+        self.assertEqual(len(UnitLookup._BASE_UNIT_CACHE), UnitLookup.MAX_CACHED_BASE_UNITS)
+        self.assertNotIn('no unit', UnitLookup._BASE_UNIT_CACHE)
+        self.assertEqual(UnitLookup.baseUnit('Meters'), 'm')
+        self.assertEqual(UnitLookup.convertLengthUnit([100, 200], 'nm', 'μm'), [0.1, 0.2])
+
     def test_convertMetricUnits(self):
 
         self.assertEqual(UnitLookup.convertLengthUnit(100, 'm', 'km'), 0.1)
@@ -208,6 +242,24 @@ class UnitModelTests(TestCase):
             self.assertIsInstance(dateB, np.datetime64)
             self.assertEqual(dateA, dateB)
 
+    def test_decimalYearArrays(self):
+        dates = np.arange(np.datetime64('1999-01-01'), np.datetime64('2025-01-01'), np.timedelta64(13, 'h'))
+        dates = dates.astype('datetime64[s]')
+
+        decimalYears = UnitLookup.convertDateUnit(dates, 'DecimalYear')
+        self.assertIsInstance(decimalYears, np.ndarray)
+        self.assertEqual(decimalYears.shape, dates.shape)
+        self.assertTrue(np.array_equal(datetime64(decimalYears), dates))
+
+        DOYs = UnitLookup.convertDateUnit(dates, 'DOY')
+        for i in range(0, len(dates), 499):
+            self.assertEqual(decimalYears[i], UnitLookup.convertDateUnit(dates[i], 'DecimalYear'))
+            self.assertEqual(DOYs[i], UnitLookup.convertDateUnit(dates[i], 'DOY'))
+        self.assertTrue(np.array_equal(UnitLookup.convertDateUnit(list(dates[0:3]), 'Y'), [1999, 1999, 1999]))
+
+        # decimal years based on 365 days per year
+        self.assertEqual(datetime64(np.asarray([2020.5]), dpy=365)[0], np.datetime64('2020-07-01T12:00:00'))
+
     def test_convertTimeUnits(self):
 
         refDate = np.datetime64('2020-01-01')
@@ -17,9 +17,11 @@ import pathlib
 import pickle
 import random
 import re
+import threading
 import unittest
 import warnings
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict
 
 import numpy as np
@@ -37,12 +39,13 @@ from qps.speclib.core import is_spectral_library
 from qps.testing import start_app, TestCase, TestObjects
 from qps.unitmodel import UnitLookup
 from qps.utils import aggregateArray, appendItemsToMenu, createQgsField, defaultBands, displayBandNames, dn, \
-    ExtentTileIterator, fid2pixelindices, file_search, filenameFromString, findMapLayerStores, findParent, gdalDataset, \
-    gdalFileSize, geo2px, layerGeoTransform, loadUi, MapGeometryToPixel, nextColor, nodeXmlString, optimize_block_size, \
-    osrSpatialReference, parseFWHM, parseWavelength, px2geo, px2geocoordinates, px2spatialPoint, qgsField, \
-    qgsFieldAttributes2List, qgsRasterLayer, qgsRasterLayers, rasterArray, rasterBlockArray, rasterizeFeatures, \
-    relativePath, SelectMapLayerDialog, SelectMapLayersDialog, snapGeoCoordinates, SpatialExtent, SpatialPoint, \
-    spatialPoint2px, value2str, writeAsVectorFormat
+    ExtentTileIterator, fid2pixelindices, file_search, filenameFromString, findMapLayer, findMapLayerStores, \
+    findParent, gdalDataset, gdalFileSize, geo2px, layerGeoTransform, loadUi, MapGeometryToPixel, MapLayerIndex, \
+    mapLayerIndex, nextColor, nodeXmlString, optimize_block_size, osrSpatialReference, parseFWHM, parseWavelength, \
+    px2geo, px2geocoordinates, px2spatialPoint, qgsField, qgsFieldAttributes2List, qgsMapLayer, qgsRasterLayer, \
+    qgsRasterLayers, rasterArray, rasterBandUniqueValues, rasterBlockArray, rasterizeFeatures, registeredMapLayers, \
+    registerMapLayerStore, relativePath, SelectMapLayerDialog, SelectMapLayersDialog, snapGeoCoordinates, \
+    SpatialExtent, SpatialPoint, spatialPoint2px, value2str, writeAsVectorFormat
 from qpstestdata import enmap, enmap_multipoint, enmap_multipolygon, enmap_pixel, hymap, landcover
 
 start_app()
@@ -170,6 +173,64 @@ class TestUtils(TestCase):
         for s in ref:
             self.assertTrue(s in found)
 
+    def test_mapLayerIndex(self):
+
+        store = QgsMapLayerStore()
+        registerMapLayerStore(store)
+        index = mapLayerIndex()
+        self.assertIsInstance(index, MapLayerIndex)
+        self.assertTrue(any(s is store for s in index.stores()))
+
+        lyr1 = TestObjects.createRasterLayer()
+        lyr2 = TestObjects.createVectorLayer()
+        lyr1.setName('MyRaster')
+        store.addMapLayers([lyr1, lyr2])
+
+        self.assertIn(lyr1, registeredMapLayers())
+        self.assertIn(lyr2, registeredMapLayers())
+        self.assertEqual(findMapLayer(lyr1.id()), lyr1)
+        self.assertEqual(findMapLayer('MyRaster'), lyr1)
+        self.assertEqual(findMapLayer(lyr2.source()).source(), lyr2.source())
+        self.assertEqual(qgsMapLayer(lyr2.id()), lyr2)
+
+        # renamed layers are re-indexed
+        lyr1.setName('Renamed')
+        self.assertEqual(index.layersByName('MyRaster'), [])
+        self.assertEqual(index.layersByName('Renamed'), [lyr1])
+
+        lid2 = lyr2.id()
+        store.removeMapLayer(lid2)
+        self.assertIsNone(index.layer(lid2))
+        self.assertNotIn(lid2, [lyr.id() for lyr in registeredMapLayers()])
+
+        store.removeAllMapLayers()
+        self.assertEqual(index.layersByName('Renamed'), [])
+
+        # lookups in other threads while layers are added and removed
+        layers = [TestObjects.createVectorLayer() for _ in range(10)]
+        stop = threading.Event()
+
+        def lookup() -> int:
+            n = 0
+            while not stop.is_set():
+                for lyr in index.layers():
+                    index.findLayer(lyr.id())
+                    index.layersByName(lyr.name())
+                    n += 1
+            return n
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [pool.submit(lookup) for _ in range(4)]
+            for _ in range(20):
+                store.addMapLayers(layers)
+                # take the layers, so that the lookup threads do not use deleted layers
+                for lyr in layers:
+                    store.takeMapLayer(lyr)
+            stop.set()
+            for future in futures:
+                self.assertIsInstance(future.result(), int)
+        self.assertEqual(index.mKeys.keys(), index.mLayers.keys())
+
     def test_findwavelength(self):
 
         lyr = TestObjects.createRasterLayer()
@@ -208,6 +269,62 @@ class TestUtils(TestCase):
             self.assertTrue(len(results) == 1)
             self.assertTrue(os.path.isfile(results[0]))
 
+    def test_rasterBandUniqueValues(self):
+        array = np.random.randint(0, 7, size=(300, 500)).astype(np.uint8)
+        array[0:10, :] = 255
+        path = '/vsimem/test_rasterBandUniqueValues.tif'
+        ds: gdal.Dataset = gdal.GetDriverByName('GTiff').Create(
+            path, 500, 300, 1, gdal.GDT_Byte, options=['TILED=YES', 'BLOCKXSIZE=64', 'BLOCKYSIZE=64'])
+        band: gdal.Band = ds.GetRasterBand(1)
+        band.WriteArray(array)
+        band.SetNoDataValue(255)
+        ds.FlushCache()
+
+        values, counts = np.unique(array[array != 255], return_counts=True)
+        expected = dict(zip(values.tolist(), counts.tolist()))
+
+        for threads in [1, 4]:
+            results = rasterBandUniqueValues(band, tileSize=128 * 128, threads=threads)
+            self.assertEqual(results, expected)
+
+        # stop when exceeding the maximum number of unique values
+        self.assertIsNone(rasterBandUniqueValues(band, maxValues=3))
+        self.assertEqual(rasterBandUniqueValues(path, maxValues=len(expected)), expected)
+
+        del band, ds
+        gdal.Unlink(path)
+
+    def test_file_search_options(self):
+
+        root = self.createTestOutputDirectory(cleanup=True)
+        for d in ['a/b/c', 'a/.git/x', 'B/d']:
+            os.makedirs(root / d, exist_ok=True)
+        for f in ['1.asd', 'a/2.asd', 'a/b/3.ASD', 'a/b/c/4.asd', 'a/.git/x/5.asd', 'B/d/6.sig']:
+            with open(root / f, 'w') as file:
+                file.write(f)
+
+        def names(results) -> list:
+            return sorted(os.path.basename(p) for p in results)
+
+        self.assertEqual(names(file_search(root, '*.asd', recursive=True)),
+                         ['1.asd', '2.asd', '4.asd', '5.asd'])
+        self.assertEqual(names(file_search(root, '*.asd', recursive=True, ignoreCase=True)),
+                         ['1.asd', '2.asd', '3.ASD', '4.asd', '5.asd'])
+        self.assertEqual(names(file_search(root, '*.asd', recursive=True, ignoreCase=True, excludeDirs='.git')),
+                         ['1.asd', '2.asd', '3.ASD', '4.asd'])
+        self.assertEqual(names(file_search(root, ['*.asd', re.compile(r'\.sig$')], recursive=True, maxDepth=1)),
+                         ['1.asd', '2.asd'])
+        self.assertEqual(names(file_search(root, '*', recursive=True, includeDirs=['B', 'd'])),
+                         ['1.asd', '6.sig'])
+        self.assertEqual(names(file_search(root, 'b', recursive=True, directories=True, ignoreCase=True)),
+                         ['B', 'b'])
+
+        for threads in [1, 4]:
+            results = list(file_search(root, '*', recursive=True, threads=threads))
+            self.assertEqual(len(results), 6)
+            results = list(file_search(root, '*', recursive=True, threads=threads, maxResults=2))
+            self.assertEqual(len(results), 2)
+
     def test_vsimem(self):
 
         from qps.utils import check_vsimem